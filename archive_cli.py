@@ -0,0 +1,211 @@
+"""
+Non-interactive command line for sending the photo archive.
+
+The archive scripts ask for the archive directory and a menu choice with
+input(), so they can't run from cron or a systemd timer. This runs the same
+drain from command line arguments and exits with a status code:
+
+    python archive_cli.py --archive-dir /path/to/archive --backend smtp
+    python archive_cli.py --archive-dir archive --recipient-glob '*@example.com' --dry-run --json
+
+send_archived_photos.py, send_archived_photos_smtp.py and send_archived.sh
+run it too when they are given any arguments.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import fnmatch
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+from send_pipeline import coalesce_batches, normalize_recipient
+
+# Exit codes
+EXIT_OK = 0  # Everything selected was sent (or there was nothing to send)
+EXIT_SEND_FAILED = 1  # At least one email could not be sent
+EXIT_USAGE = 2  # Bad arguments or configuration (argparse uses 2 as well)
+EXIT_ERROR = 3  # The run stopped on an unexpected error
+EXIT_INTERRUPTED = 130
+
+BACKENDS = ('smtp', 'gmail')
+ARCHIVE_TIMESTAMP = re.compile(r'(\d{8}_\d{6})')
+
+
+def parse_since(value):
+    """argparse type for --since: YYYY-MM-DD, 'YYYY-MM-DD HH:MM' or YYYY-MM-DDTHH:MM[:SS]
+
+    A time with a UTC offset (e.g. 2024-01-15T18:00+01:00) is converted to
+    local time, which is what the archive's timestamps are in.
+    """
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a date or time: {value!r} (use e.g. 2024-01-15 or 2024-01-15T18:00)")
+    if since.tzinfo is not None:
+        since = since.astimezone().replace(tzinfo=None)
+    return since
+
+
+def batch_time(batch):
+    """When a batch was archived, from its metadata or its folder name (None if unknown)"""
+    for value in (batch['metadata'].get('timestamp'), batch['folder_name']):
+        match = ARCHIVE_TIMESTAMP.search(value or '')
+        if match:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+    return None
+
+
+def filter_batches(batches, since=None, recipient_glob=None):
+    """Only the batches archived at or after `since` for recipients matching `recipient_glob`"""
+    for batch in batches:
+        if since:
+            archived = batch_time(batch)
+            if archived is None or archived < since:
+                continue
+        if recipient_glob and not fnmatch.fnmatchcase(
+                normalize_recipient(batch['metadata'].get('email') or ''), recipient_glob.lower()):
+            continue
+        yield batch
+
+
+def build_parser(default_backend=None):
+    parser = argparse.ArgumentParser(
+        description="Send archived photo booth batches without prompts.",
+        epilog=f"Exit status: {EXIT_OK} all sent, {EXIT_SEND_FAILED} some sends failed, "
+               f"{EXIT_USAGE} bad arguments or configuration, {EXIT_ERROR} unexpected error, "
+               f"{EXIT_INTERRUPTED} interrupted.")
+    parser.add_argument('--archive-dir', required=True, help="archive directory to send from")
+    parser.add_argument('--backend', choices=BACKENDS, default=default_backend or 'smtp',
+                        help=f"how to send (default: {default_backend or 'smtp'})")
+    parser.add_argument('--since', type=parse_since,
+                        help="only batches archived at or after this date/time")
+    parser.add_argument('--recipient-glob', metavar='PATTERN',
+                        help="only recipients matching this pattern, e.g. '*@example.com'")
+    parser.add_argument('--max-messages', type=int, metavar='N',
+                        help="send at most N emails, the rest stay in the archive")
+    parser.add_argument('--concurrency', type=int, metavar='N',
+                        help="emails sent at the same time (default: the script's setting)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="list the emails that would be sent, without sending anything")
+    parser.add_argument('--json', action='store_true',
+                        help="print a JSON summary on stdout (progress goes to stderr)")
+    return parser
+
+
+def _result(group, status, error=None):
+    return {
+        'email': group[0]['metadata'].get('email'),
+        'folders': [batch['folder_name'] for batch in group],
+        'photos': sum(int(batch['metadata'].get('photo_count') or 0) for batch in group),
+        'status': status,
+        'error': str(error) if error else None,
+    }
+
+
+def new_summary(args):
+    return {'backend': args.backend, 'archive_dir': args.archive_dir, 'dry_run': args.dry_run,
+            'sent': 0, 'failed': 0, 'bytes_sent': 0, 'elapsed': 0.0, 'messages_per_sec': 0.0,
+            'mb_per_sec': 0.0, 'results': []}
+
+
+def run(args, summary=None):
+    """Send (or list) the selected batches - returns (exit code, summary dict)
+
+    summary (from new_summary()) is filled in as emails are sent, so the
+    caller still has the progress so far if this is interrupted.
+    """
+    if summary is None:
+        summary = new_summary(args)
+    if not os.path.isdir(args.archive_dir):
+        print(f"ERROR: Directory not found: {args.archive_dir}")
+        return EXIT_USAGE, summary
+
+    # Import the backend only now - the Gmail libraries aren't needed for SMTP
+    if args.backend == 'smtp':
+        import send_archived_photos_smtp as backend
+    else:
+        import send_archived_photos as backend
+    batches = filter_batches(backend.iter_archived_batches(args.archive_dir), args.since,
+                             args.recipient_glob)
+
+    if args.dry_run:
+        # Group the batches the way the backend would
+        max_message_size = backend.MAX_MESSAGE_SIZE
+        if args.backend == 'smtp':
+            max_message_size = (backend.load_smtp_config() or {}).get('max_message_size', max_message_size)
+        for group in itertools.islice(coalesce_batches(batches, max_message_size), args.max_messages):
+            result = _result(group, 'would_send')
+            summary['results'].append(result)
+            print(f"WOULD SEND {result['email']} ({', '.join(result['folders'])})")
+        return EXIT_OK, summary
+
+    sent_dir = os.path.join(args.archive_dir, '_sent')
+    os.makedirs(sent_dir, exist_ok=True)
+
+    def on_sent(group, error):
+        summary['results'].append(_result(group, 'failed' if error else 'sent', error))
+        summary['failed' if error else 'sent'] += 1
+
+    if args.backend == 'smtp':
+        smtp_config = backend.load_smtp_config()
+        if not smtp_config or not backend.python_supported():
+            return EXIT_USAGE, summary
+        stats = asyncio.run(backend.send_batches(
+            smtp_config, batches, sent_dir, concurrency=args.concurrency or backend.SEND_CONCURRENCY,
+            max_messages=args.max_messages, on_sent=on_sent))
+    else:
+        # Never open a browser for the OAuth consent screen, nobody is there to click it
+        sender = backend.setup_gmail_api(interactive=False)
+        if not sender:
+            return EXIT_USAGE, summary
+        stats = backend.send_batches(sender, batches, sent_dir, workers=args.concurrency or backend.SEND_WORKERS,
+                                     max_messages=args.max_messages, on_sent=on_sent)
+
+    elapsed = max(stats.elapsed(), 1e-9)
+    summary.update(sent=stats.sent, failed=stats.failed, bytes_sent=stats.bytes_sent,
+                   elapsed=round(elapsed, 3), messages_per_sec=round(stats.sent / elapsed, 2),
+                   mb_per_sec=round(stats.bytes_sent / elapsed / 1024 / 1024, 3))
+    print(f"Results: {stats.summary()}")
+    return (EXIT_SEND_FAILED if stats.failed else EXIT_OK), summary
+
+
+def main(argv=None, default_backend=None):
+    """Run the command line - returns the exit status"""
+    args = build_parser(default_backend).parse_args(argv)
+    if args.max_messages is not None and args.max_messages < 0:
+        print("ERROR: --max-messages can't be negative", file=sys.stderr)
+        return EXIT_USAGE
+    if args.concurrency is not None and args.concurrency < 1:
+        print("ERROR: --concurrency must be at least 1", file=sys.stderr)
+        return EXIT_USAGE
+
+    started = time.monotonic()
+    # With --json, stdout is reserved for the summary
+    output = contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext()
+    summary = new_summary(args)
+    with output:
+        try:
+            code, summary = run(args, summary)
+        except KeyboardInterrupt:
+            print("\nInterrupted - run again to continue where this run stopped.")
+            code = EXIT_INTERRUPTED
+            summary.update(interrupted=True, elapsed=round(time.monotonic() - started, 3))
+        except Exception as e:
+            print(f"ERROR: {e}")
+            code = EXIT_ERROR
+            summary.update(error=str(e), elapsed=round(time.monotonic() - started, 3))
+
+    if args.json:
+        summary['exit_code'] = code
+        print(json.dumps(summary, indent=2))
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Drains the archive in the background while the app keeps serving guests.
+
+Batches that could not be sent are retried by the OutboxRetrier, but until
+now only the ones this app put in the outbox itself; anything else in the
+archive directory (an earlier run without an outbox database, the other
+app's batches) waited for someone to run a helper script. import_archive()
+adds every unsent batch in the archive manifest to the outbox, so the
+retrier sends those too. ledger_send() makes the retrier keep the
+manifest's delivery ledger the way the archive scripts do, so a batch the
+scripts (or an earlier retry) already delivered isn't sent again, and a
+resend keeps its Message-ID.
+
+Retrying competes with live guests for the uplink and the sender accounts,
+so the retrier asks a LatencyBudget before each batch. Live sends always
+go first: a batch is only started while no live session is queued or being
+sent, and only if it is expected to finish (at the throughput measured so
+far) within the latency budget that is left over after a typical live send.
+A guest who walks up just as a batch starts therefore waits at most about
+the budget. Batches too large for that are sent once the booth has been
+quiet for quiet_period seconds (or before the first guest since startup),
+so the backlog still clears between guests.
+"""
+
+import os
+import threading
+import time
+
+from archive_manifest import DELIVERED, SENT, ArchiveManifest, message_id_for
+
+DEFAULT_LATENCY_BUDGET = 30.0  # Seconds a live send may take, including a drain send in the way
+DEFAULT_QUIET_PERIOD = 120.0
+SMOOTHING = 0.3  # Weight of the newest measurement in the moving averages
+
+
+def import_archive(outbox, archive_directory):
+    """Add the archive's unsent batches that are not in the outbox yet - returns how many were added"""
+    known = outbox.zip_paths()
+    added = 0
+    manifest = ArchiveManifest(archive_directory)
+    manifest.reindex()
+    for entry in manifest.unsent():
+        folder = os.path.join(archive_directory, entry['folder'])
+        zip_path = os.path.abspath(os.path.join(folder, entry.get('zip_file') or ''))
+        if zip_path in known or not entry.get('email') or not os.path.isfile(zip_path):
+            continue
+        outbox.add(entry['email'], zip_path, entry.get('photo_count'), folder=folder)
+        added += 1
+    return added
+
+
+def ledger_send(send_fn):
+    """Wrap send_fn(recipient, zip_path, message_id) as an OutboxRetrier send_fn that updates the manifest
+
+    The batch is marked in flight before it is sent, delivered once the
+    server accepted it, and failed if sending raised, like send_batches() in
+    the archive scripts. A batch the manifest already lists as delivered is
+    not sent again.
+    """
+    def send(recipient, zip_path):
+        folder = os.path.dirname(os.path.abspath(zip_path))
+        folder_name = os.path.basename(folder)
+        manifest = ArchiveManifest(os.path.dirname(folder))
+        entry = manifest.entries().get(folder_name) or {'folder': folder_name}
+        if entry.get('status') in (DELIVERED, SENT):
+            print(f"{folder_name} was already delivered, not sending it again")
+            return
+        # A batch an earlier attempt may have delivered keeps the Message-ID it was sent with
+        message_id = message_id_for([entry])
+        manifest.mark_in_flight([folder_name], message_id)
+        try:
+            send_fn(recipient, zip_path, message_id)
+        except Exception as e:
+            manifest.mark_failed([folder_name], e)
+            raise
+        manifest.mark_delivered([folder_name])
+    return send
+
+
+class LatencyBudget:
+    """Decides when a low-priority (drain) send may start without slowing live sends down too much.
+
+    live_pending() returns whether a live session is queued or being sent.
+    The app reports every live send with live_finished() and the retrier
+    every drain send with drain_finished().
+    """
+
+    def __init__(self, budget=DEFAULT_LATENCY_BUDGET, live_pending=None,
+                 quiet_period=DEFAULT_QUIET_PERIOD):
+        self.budget = budget
+        self.live_pending = live_pending or (lambda: False)
+        self.quiet_period = quiet_period
+        self.live_latency = None  # Moving average of live send times (seconds)
+        self.throughput = None  # Moving average of bytes/second over all sends
+        self.last_live = None  # When the last live send finished (None: not since startup)
+        self.started = time.monotonic()
+        self._changed = threading.Condition()
+
+    def _average(self, current, value):
+        return value if current is None else (1 - SMOOTHING) * current + SMOOTHING * value
+
+    def _record_throughput(self, seconds, nbytes):
+        if nbytes and seconds > 0:
+            self.throughput = self._average(self.throughput, nbytes / seconds)
+
+    def live_finished(self, seconds, nbytes=None):
+        """Record a live send that took `seconds`"""
+        with self._changed:
+            self.live_latency = self._average(self.live_latency, seconds)
+            self._record_throughput(seconds, nbytes)
+            self.last_live = time.monotonic()
+            self._changed.notify_all()
+
+    def drain_finished(self, seconds, nbytes=None):
+        """Record a drain send that took `seconds`"""
+        with self._changed:
+            self._record_throughput(seconds, nbytes)
+
+    def estimate(self, nbytes):
+        """Expected seconds to send nbytes (None until a send has been measured)"""
+        if self.throughput is None:
+            return None
+        return nbytes / self.throughput
+
+    def may_send(self, nbytes):
+        """Whether a drain send of nbytes may start now
+
+        Any send may start once there has been no live send for quiet_period
+        (counted from startup if there was none yet). Until then it has to
+        fit in the budget, given the measured throughput. Before anything
+        was measured only sends made before the first live send may start.
+        """
+        if self.live_pending():
+            return False
+        quiet_since = self.last_live if self.last_live is not None else self.started
+        if time.monotonic() - quiet_since >= self.quiet_period:
+            return True
+        estimate = self.estimate(nbytes)
+        if estimate is None:
+            return self.last_live is None  # Nothing to go by, the first drain send measures it
+        return (self.live_latency or 0.0) + estimate <= self.budget
+
+    def wait(self, nbytes, stopped, poll_interval=1.0):
+        """Block until a drain send of nbytes may start - returns False if stopped() became true first"""
+        with self._changed:
+            while not stopped():
+                if self.may_send(nbytes):
+                    return True
+                self._changed.wait(poll_interval)
+        return False
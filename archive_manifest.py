@@ -0,0 +1,263 @@
+"""
+Machine-readable index of the archive directory.
+
+The archive scripts used to list the archive directory and open and parse
+every folder's SEND_TO.txt on each run, which gets slow after a long outage
+leaves thousands of folders behind. Every archived batch is now also
+recorded in manifest.jsonl in the archive directory: one JSON object per
+line, appended with a single write and fsynced. Every change of a batch's
+delivery state appends another line for the same folder; the last line for
+a folder wins.
+
+The manifest is also the delivery ledger of the archive scripts. A batch is
+marked in flight (with the Message-ID it is sent with) before it is sent,
+delivered as soon as the server accepts it, and sent once its folder has
+been moved to _sent. A run that is interrupted can therefore be resumed:
+delivered batches are only moved, and in-flight batches are sent again
+with the same Message-ID, so the recipient's mailbox can recognize the
+duplicate if the first attempt did get through.
+
+Reading the manifest is a single file open. Folders the manifest doesn't
+know (e.g. the app could not write to it when it archived them) are found
+by reindex(), which the archive scripts and the apps call once when they
+start: it lists the folder names, reads the SEND_TO.txt of the unknown
+ones and adds them to the manifest. A last line without a newline (a write cut short by a
+crash) is cut off and the lines before it are kept. If the manifest is
+missing (an archive from an older version) it is rebuilt from the folders
+and their SEND_TO.txt files; if a line in the middle can't be parsed, it is
+rebuilt the same way but keeps every state the other lines recorded. A
+rebuilt manifest replaces the old one atomically. SEND_TO.txt is still
+written for people looking at the archive by hand.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_FILE = 'manifest.jsonl'
+
+# Delivery states
+UNSENT = 'unsent'
+IN_FLIGHT = 'in_flight'  # Being sent - if a run stopped here, it may or may not have arrived
+FAILED = 'failed'
+DELIVERED = 'delivered'  # Accepted by the server, folder not moved to _sent yet
+SENT = 'sent'  # Delivered and moved to _sent
+
+PENDING_STATES = (UNSENT, IN_FLIGHT, FAILED)
+
+# Rewrite the manifest once it has this many superseded lines
+COMPACT_AFTER = 1000
+
+# Domain of the Message-IDs batches are sent with, by the apps and both archive scripts alike
+MESSAGE_ID_DOMAIN = 'photo-booth.local'
+
+_lock = threading.Lock()  # Appends and rebuilds from this process
+
+
+def read_metadata(folder_path):
+    """Read the SEND_TO.txt metadata file of an archived batch (None if there is none)"""
+    metadata_path = os.path.join(folder_path, "SEND_TO.txt")
+
+    if not os.path.exists(metadata_path):
+        return None
+
+    metadata = {}
+    with open(metadata_path, 'r') as f:
+        for line in f:
+            if line.startswith("RECIPIENT EMAIL:"):
+                metadata['email'] = line.split(":", 1)[1].strip()
+            elif line.startswith("TIMESTAMP:"):
+                metadata['timestamp'] = line.split(":", 1)[1].strip()
+            elif line.startswith("ZIP FILE:"):
+                metadata['zip_file'] = line.split(":", 1)[1].strip()
+            elif line.startswith("NUMBER OF PHOTOS:"):
+                metadata['photo_count'] = line.split(":", 1)[1].strip()
+            elif line.startswith("METHOD:"):
+                metadata['method'] = line.split(":", 1)[1].strip()
+
+    return metadata
+
+
+def batch_message_id(folders):
+    """A Message-ID that is the same every time the same batches are sent together"""
+    digest = hashlib.sha1('\n'.join(sorted(folders)).encode()).hexdigest()[:32]
+    return f"<photo-booth.{digest}@{MESSAGE_ID_DOMAIN}>"
+
+
+def message_id_for(entries):
+    """The Message-ID to send batches with in one email, given their manifest entries
+
+    If every batch is in flight with the same Message-ID (an earlier attempt
+    sent them together and may have got through), that one is reused.
+    Otherwise it is the batch_message_id() of their folders.
+    """
+    in_flight = {entry.get('message_id') if entry.get('status') == IN_FLIGHT else None for entry in entries}
+    if len(in_flight) == 1 and None not in in_flight:
+        return in_flight.pop()
+    return batch_message_id([entry['folder'] for entry in entries])
+
+
+class ArchiveManifest:
+    def __init__(self, archive_directory):
+        self.archive_directory = archive_directory
+        self.path = os.path.join(archive_directory, MANIFEST_FILE)
+
+    def add(self, folder, email, zip_file, photo_count, method, timestamp=None, size=None):
+        """Record a newly archived batch (folder is the batch folder's name)"""
+        if size is None:
+            try:
+                size = os.path.getsize(os.path.join(self.archive_directory, folder, zip_file))
+            except OSError:
+                pass
+        self._append([{'folder': folder, 'email': email, 'zip_file': zip_file, 'size': size,
+                       'photo_count': photo_count, 'method': method, 'timestamp': timestamp,
+                       'status': UNSENT}])
+
+    def mark_in_flight(self, folders, message_id):
+        """Record that batches are about to be sent together as message_id"""
+        self._append([{'folder': folder, 'status': IN_FLIGHT, 'message_id': message_id}
+                      for folder in folders])
+
+    def mark_delivered(self, folders):
+        """Record that the server accepted the email with these batches"""
+        self._append([{'folder': folder, 'status': DELIVERED} for folder in folders])
+
+    def mark_failed(self, folders, error):
+        """Record that sending these batches failed (they are retried on the next run)"""
+        self._append([{'folder': folder, 'status': FAILED, 'last_error': str(error)}
+                      for folder in folders])
+
+    def mark_sent(self, folders):
+        """Record that batches were sent and moved out of the archive directory"""
+        self._append([{'folder': folder, 'status': SENT} for folder in folders])
+
+    def entries(self):
+        """{folder name: entry} for every batch, rebuilding the manifest if needed"""
+        with _lock:
+            entries, lines, corrupt = self._load()
+            if entries is None or corrupt:
+                return self._rebuild(entries)
+            if lines - len(entries) >= COMPACT_AFTER:
+                self._write(entries)
+            return entries
+
+    def reindex(self):
+        """Add the batch folders the manifest doesn't know about - returns how many were added"""
+        with _lock:
+            entries, _, corrupt = self._load()
+            if entries is None or corrupt:
+                known = len(entries or {})
+                return len(self._rebuild(entries)) - known
+            missing = self._index_folders(skip=entries)
+            if missing:
+                print(f"Adding {len(missing)} archived batches missing from {self.path}")
+                self._write_records(list(missing.values()))
+            return len(missing)
+
+    def unsent(self):
+        """Entries of the batches still waiting to be sent (new, in flight or failed), oldest first"""
+        return [entry for entry in self.entries().values() if entry.get('status') in PENDING_STATES]
+
+    def delivered(self):
+        """Entries of the batches that were delivered but not moved to _sent yet"""
+        return [entry for entry in self.entries().values() if entry.get('status') == DELIVERED]
+
+    def _append(self, records):
+        """Append records in a single write, so a state change of several batches is all or nothing"""
+        with _lock:
+            if not os.path.exists(self.path):
+                # Index the folders archived before there was a manifest first
+                self._rebuild()
+            self._write_records(records)
+
+    def _write_records(self, records):
+        data = ''.join(json.dumps(record) + '\n' for record in records).encode()
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                data = b'\n' + data  # Don't glue the records onto a torn line
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _load(self):
+        """(entries, number of lines, whether a line was corrupt), entries is None if the manifest is missing
+
+        A torn last line is truncated away, the lines that can't be parsed are
+        skipped.
+        """
+        entries = {}
+        lines = 0
+        corrupt = False
+        try:
+            with open(self.path, 'rb') as f:
+                complete = 0  # Offset after the last complete line
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        print(f"Archive manifest {self.path} ends in a partly written line, dropping it")
+                        f.close()
+                        os.truncate(self.path, complete)
+                        break
+                    complete += len(line)
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                        entry = entries.setdefault(record['folder'], {})
+                        entry.update(record)
+                    except (ValueError, KeyError, TypeError) as e:
+                        print(f"Archive manifest {self.path} has a corrupt line, rebuilding it: {e}")
+                        corrupt = True
+        except FileNotFoundError:
+            return None, 0, False
+        return entries, lines, corrupt
+
+    def _index_folders(self, skip=()):
+        """{folder name: unsent entry} from the SEND_TO.txt of the batch folders not in skip"""
+        entries = {}
+        if not os.path.isdir(self.archive_directory):
+            return entries
+        with os.scandir(self.archive_directory) as dir_entries:
+            folders = sorted(entry.name for entry in dir_entries
+                             if entry.is_dir() and entry.name.startswith('unsent_') and entry.name not in skip)
+        for folder in folders:
+            metadata = read_metadata(os.path.join(self.archive_directory, folder))
+            if not metadata:
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.archive_directory, folder,
+                                                    metadata.get('zip_file', '')))
+            except OSError:
+                size = None
+            entries[folder] = {'folder': folder, 'email': metadata.get('email'),
+                               'zip_file': metadata.get('zip_file'), 'size': size,
+                               'photo_count': int(metadata['photo_count'])
+                               if metadata.get('photo_count', '').isdigit() else None,
+                               'method': metadata.get('method'),
+                               'timestamp': metadata.get('timestamp'), 'status': UNSENT}
+        return entries
+
+    def _rebuild(self, known=None):
+        """Index the archive folders from their SEND_TO.txt files and write a fresh manifest
+
+        known are the entries read from the old manifest; their fields (and
+        delivery states) take precedence over what the folders say.
+        """
+        entries = self._index_folders()
+        for folder, entry in (known or {}).items():
+            entries[folder] = {**entries.get(folder, {}), **entry}
+        if os.path.isdir(self.archive_directory):
+            self._write(entries)
+        return entries
+
+    def _write(self, entries):
+        """Replace the manifest with one line per entry"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in entries.values():
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,311 @@
+"""
+asyncio SMTP sender for draining the archive quickly.
+
+Sending archived batches one after another leaves the connection idle while
+each message waits for the server. AsyncSMTPSender keeps up to `concurrency`
+authenticated connections open and sends over all of them at once. When the
+server advertises PIPELINING (RFC 2920) the envelope (MAIL FROM, RCPT TO,
+DATA) goes out in a single write, saving two round trips per message.
+
+Errors are raised as the usual smtplib exceptions, so callers can handle
+them exactly like SMTPConnectionPool errors. Only the standard library is
+used (asyncio streams); StreamWriter.start_tls() needs Python 3.11
+(REQUIRED_PYTHON), the photo booth apps themselves don't use this module.
+
+drain() runs a producer/consumer loop over any iterable of jobs and reports
+messages/sec and bytes/sec. Used by send_archived_photos_smtp.py.
+"""
+
+import asyncio
+import base64
+import smtplib
+import socket
+import ssl
+import time
+
+from mime_stream import RawMessage, smtp_data_chunks
+
+CRLF = b'\r\n'
+
+REQUIRED_PYTHON = (3, 11)  # StreamWriter.start_tls()
+
+
+class _AsyncConnection:
+    def __init__(self, reader, writer, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.extensions = {}
+        self.messages_sent = 0
+
+    async def read_reply(self):
+        """Read a (possibly multi-line) reply - returns (code, message)"""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            try:
+                code = int(line[:3])
+            except ValueError:
+                raise smtplib.SMTPServerDisconnected(f"Malformed reply from server: {line!r}")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return code, b'\n'.join(lines)
+
+    async def command(self, line):
+        self.writer.write(line.encode() + CRLF)
+        await self.writer.drain()
+        return await self.read_reply()
+
+    async def ehlo(self, name):
+        code, msg = await self.command(f"EHLO {name}")
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, msg)
+        self.extensions = {}
+        for line in msg.decode(errors='replace').split('\n')[1:]:
+            parts = line.split(None, 1)
+            if parts:
+                self.extensions[parts[0].lower()] = parts[1] if len(parts) > 1 else ''
+
+    def abort(self):
+        self.writer.close()
+
+    async def close(self):
+        """Say QUIT and close the connection, ignoring errors"""
+        try:
+            await self.command("QUIT")
+        except Exception:
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+class AsyncSMTPSender:
+    def __init__(self, server, port, email, password, concurrency=4, max_messages_per_connection=50,
+                 timeout=60, starttls=True):
+        self.server = server
+        self.port = port
+        self.email = email
+        self.password = password
+        self.concurrency = concurrency
+        self.max_messages_per_connection = max_messages_per_connection
+        self.timeout = timeout
+        self.starttls = starttls
+        self.local_hostname = socket.getfqdn()
+        self.handshakes = 0  # Number of connections opened (connect + TLS + login)
+        self._idle = []
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @classmethod
+    def from_config(cls, smtp_config, **kwargs):
+        """Create a sender from a loaded smtp_config.json dictionary"""
+        return cls(smtp_config.get('server', 'smtp.gmail.com'), smtp_config.get('port', 587),
+                   smtp_config['email'], smtp_config['password'], **kwargs)
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server, self.port), self.timeout)
+        conn = _AsyncConnection(reader, writer, self.timeout)
+        try:
+            code, msg = await conn.read_reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, msg)
+            await conn.ehlo(self.local_hostname)
+            if self.starttls:
+                # Secure the connection
+                if 'starttls' not in conn.extensions:
+                    raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+                code, msg = await conn.command("STARTTLS")
+                if code != 220:
+                    raise smtplib.SMTPResponseException(code, msg)
+                await writer.start_tls(ssl.create_default_context(), server_hostname=self.server)
+                await conn.ehlo(self.local_hostname)
+            if self.password:
+                await self._login(conn)
+        except BaseException:
+            conn.abort()
+            raise
+        self.handshakes += 1
+        return conn
+
+    async def _login(self, conn):
+        mechanisms = conn.extensions.get('auth', '').upper().split()
+        if 'PLAIN' in mechanisms or 'LOGIN' not in mechanisms:
+            token = base64.b64encode(f"\0{self.email}\0{self.password}".encode()).decode()
+            code, msg = await conn.command(f"AUTH PLAIN {token}")
+        else:
+            code, msg = await conn.command("AUTH LOGIN")
+            for value in (self.email, self.password):
+                if code != 334:
+                    break
+                code, msg = await conn.command(base64.b64encode(value.encode()).decode())
+        if code not in (235, 503):  # 503: already authenticated
+            raise smtplib.SMTPAuthenticationError(code, msg)
+
+    async def _transaction(self, conn, message, from_addr, to_addrs):
+        envelope = [f"MAIL FROM:<{from_addr}>"
+                    + (f" SIZE={message.size()}" if 'size' in conn.extensions else '')]
+        envelope += [f"RCPT TO:<{addr}>" for addr in to_addrs]
+        envelope.append("DATA")
+
+        if 'pipelining' in conn.extensions:
+            # Send the whole envelope in one go, then collect the replies in order
+            conn.writer.write(b''.join(line.encode() + CRLF for line in envelope))
+            await conn.writer.drain()
+            replies = [await conn.read_reply() for _ in envelope]
+        else:
+            replies = []
+            for line in envelope[:-1]:
+                replies.append(await conn.command(line))
+                if replies[0][0] != 250:
+                    break
+            if len(replies) == len(envelope) - 1 and any(code in (250, 251) for code, _ in replies[1:]):
+                replies.append(await conn.command("DATA"))
+
+        mail_reply = replies[0]
+        refused = {addr: reply for addr, reply in zip(to_addrs, replies[1:len(envelope) - 1])
+                   if reply[0] not in (250, 251)}
+        data_reply = replies[-1] if len(replies) == len(envelope) else (554, b"DATA was not sent")
+
+        if mail_reply[0] != 250 or len(refused) == len(to_addrs) or data_reply[0] != 354:
+            if data_reply[0] == 354:
+                # The server took DATA anyway - end it empty so the session stays in sync
+                await conn.command(".")
+            await conn.command("RSET")
+            if mail_reply[0] != 250:
+                raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+            if len(refused) == len(to_addrs):
+                raise smtplib.SMTPRecipientsRefused(refused)
+            raise smtplib.SMTPDataError(*data_reply)
+
+        # Attachments are read and encoded a block at a time, off the event loop
+        chunks = smtp_data_chunks(message)
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            conn.writer.write(chunk)
+            await conn.writer.drain()
+        code, msg = await conn.read_reply()
+        if code != 250:
+            await conn.command("RSET")
+            raise smtplib.SMTPDataError(code, msg)
+        return refused
+
+    async def _checkout(self):
+        if self._idle:
+            return self._idle.pop()
+        return await self._connect()
+
+    async def _checkin(self, conn):
+        if conn.messages_sent >= self.max_messages_per_connection:
+            await conn.close()
+            return
+        self._idle.append(conn)
+
+    async def send(self, message, from_addr, to_addrs):
+        """Send a mime_stream message, reconnecting once if the server dropped us
+
+        Returns a dict of refused recipients, like smtplib.SMTP.sendmail().
+        """
+        async with self._slots:
+            conn = await self._checkout()
+            try:
+                try:
+                    refused = await self._transaction(conn, message, from_addr, to_addrs)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    conn.abort()
+                    conn = None
+                    conn = await self._connect()
+                    refused = await self._transaction(conn, message, from_addr, to_addrs)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # The server rejected this message but the session is still usable
+                if conn is not None:
+                    conn.messages_sent += 1
+                    await self._checkin(conn)
+                raise
+            except BaseException:
+                if conn is not None:
+                    conn.abort()
+                raise
+            conn.messages_sent += 1
+            await self._checkin(conn)
+            return refused
+
+    async def send_message(self, message, from_addr=None, to_addrs=None):
+        """Send an email.message.Message"""
+        from_addr = from_addr or message['From'] or self.email
+        to_addrs = to_addrs or [addr.strip() for addr in message['To'].split(',')]
+        data = message.as_bytes(policy=message.policy.clone(linesep='\r\n'))
+        return await self.send(RawMessage(data), from_addr, to_addrs)
+
+    async def close(self):
+        """Close all idle connections"""
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+
+class DrainStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.sent = 0
+        self.failed = 0
+        self.bytes_sent = 0
+
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        elapsed = max(self.elapsed(), 1e-9)
+        return (f"{self.sent} sent, {self.failed} failed in {elapsed:.1f}s - "
+                f"{self.sent / elapsed:.1f} messages/sec, "
+                f"{self.bytes_sent / elapsed / 1024 / 1024:.2f} MB/sec")
+
+
+async def drain(jobs, send_fn, concurrency=4, on_result=None):
+    """Feed jobs from an iterable to `concurrency` senders and return DrainStats
+
+    send_fn(job) is a coroutine that sends one job and returns the number of
+    bytes sent. on_result(job, error) is called after each job (error is None
+    on success). The iterable is read in a worker thread, so it may do file
+    I/O, and at most 2 * concurrency jobs are read ahead.
+    """
+    stats = DrainStats()
+    jobs_queue = asyncio.Queue(maxsize=2 * concurrency)
+    done = object()
+
+    async def produce():
+        iterator = iter(jobs)
+        while True:
+            job = await asyncio.to_thread(next, iterator, done)
+            await jobs_queue.put(job)
+            if job is done:
+                break
+
+    async def consume():
+        while True:
+            job = await jobs_queue.get()
+            if job is done:
+                await jobs_queue.put(done)  # Let the other consumers see it too
+                return
+            try:
+                size = await send_fn(job)
+            except Exception as e:
+                stats.failed += 1
+                error = e
+            else:
+                stats.sent += 1
+                stats.bytes_sent += size
+                error = None
+            if on_result:
+                on_result(job, error)
+
+    await asyncio.gather(produce(), *(consume() for _ in range(concurrency)))
+    stats.finished = time.monotonic()
+    return stats
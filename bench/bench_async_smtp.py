@@ -0,0 +1,187 @@
+"""
+Benchmark for the asyncio archive sender in async_smtp.py.
+
+Starts a local asyncio SMTP sink that answers every command after a
+simulated network round trip, builds an archive of zips and sends them:
+
+- one after another over a single pooled smtplib connection (SMTPConnectionPool,
+  how the archive used to be drained)
+- with AsyncSMTPSender and drain() at several concurrency levels, with and
+  without the sink advertising PIPELINING
+
+Reports messages/sec and MB/sec for each. No STARTTLS, so it runs on any
+Python that can run the sender.
+
+    python bench/bench_async_smtp.py                 # 150 zips of 200 KB, 20 ms round trips
+    python bench/bench_async_smtp.py 300 --rtt 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_smtp import AsyncSMTPSender, drain
+from mime_stream import StreamingMessage
+from smtp_pool import SMTPConnectionPool
+
+SENDER = 'booth@example.com'
+
+
+class Sink:
+    """asyncio SMTP server that delays every reply by rtt seconds (replies keep their order)"""
+
+    def __init__(self, rtt, pipelining):
+        self.rtt = rtt
+        self.pipelining = pipelining
+        self.messages = 0
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        replies = asyncio.Queue()
+
+        async def write_replies():
+            while True:
+                received, data = await replies.get()
+                if data is None:
+                    return
+                delay = received + self.rtt - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+
+        def reply(data):
+            replies.put_nowait((time.monotonic(), data + b'\r\n'))
+
+        writer_task = asyncio.create_task(write_replies())
+        reply(b'220 sink ESMTP')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.strip().upper()
+                if command.startswith(b'EHLO'):
+                    reply(b'250-sink\r\n' + (b'250-PIPELINING\r\n' if self.pipelining else b'')
+                          + b'250-AUTH PLAIN LOGIN\r\n250 SIZE 100000000')
+                elif command.startswith(b'AUTH'):
+                    reply(b'235 2.7.0 Accepted')
+                elif command == b'DATA':
+                    reply(b'354 End data with <CR><LF>.<CR><LF>')
+                    while True:
+                        line = await reader.readline()
+                        if not line or line == b'.\r\n':
+                            break
+                    self.messages += 1
+                    reply(b'250 OK queued')
+                elif command == b'QUIT':
+                    reply(b'221 Bye')
+                    break
+                else:
+                    reply(b'250 OK')
+        finally:
+            replies.put_nowait((0, None))
+            await writer_task
+            writer.close()
+
+    def start(self):
+        """Serve on a background event loop - returns the port"""
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        port = []
+
+        async def serve():
+            server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+            port.append(server.sockets[0].getsockname()[1])
+            started.set()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(serve())
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return port[0]
+
+
+def make_archive(directory, count, size):
+    paths = []
+    for i in range(count):
+        paths.append(os.path.join(directory, f'photos_guest{i}.zip'))
+        with open(paths[-1], 'wb') as f:
+            f.write(os.urandom(size))
+    return paths
+
+
+def message(path, i):
+    return StreamingMessage(SENDER, f'guest{i}@example.com', 'Your Photo Booth Pictures!',
+                            'Thank you for using our photo booth!', [path])
+
+
+def report(name, count, nbytes, elapsed, sink):
+    print(f"{name:<37} {count / elapsed:7.1f} msg/s {nbytes / elapsed / 1024 / 1024:7.2f} MB/s "
+          f"({sink.messages} received, {sink.connections} connections)")
+
+
+def bench_sequential(paths, rtt):
+    sink = Sink(rtt, pipelining=False)
+    pool = SMTPConnectionPool('127.0.0.1', sink.start(), SENDER, 'secret', starttls=False)
+    nbytes = 0
+    started = time.monotonic()
+    for i, path in enumerate(paths):
+        msg = message(path, i)
+        pool.send_stream(msg, SENDER, [msg.to_addr])
+        nbytes += msg.size()
+    elapsed = time.monotonic() - started
+    pool.close()
+    report("sequential smtplib (pooled)", len(paths), nbytes, elapsed, sink)
+
+
+def bench_async(paths, rtt, concurrency, pipelining):
+    sink = Sink(rtt, pipelining)
+    port = sink.start()
+
+    async def run():
+        sender = AsyncSMTPSender('127.0.0.1', port, SENDER, 'secret', concurrency=concurrency, starttls=False)
+
+        async def send(job):
+            i, path = job
+            msg = message(path, i)
+            await sender.send(msg, SENDER, [msg.to_addr])
+            return msg.size()
+
+        stats = await drain(enumerate(paths), send, concurrency)
+        await sender.close()
+        return stats
+
+    stats = asyncio.run(run())
+    report(f"async concurrency={concurrency} pipelining={'on' if pipelining else 'off'}",
+           stats.sent, stats.bytes_sent, stats.elapsed(), sink)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('count', nargs='?', type=int, default=150, help="number of zips to send")
+    parser.add_argument('--size', type=int, default=200_000, help="bytes per zip")
+    parser.add_argument('--rtt', type=float, default=0.02, help="simulated round trip in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_archive(directory, args.count, args.size)
+        print(f"{args.count} zips of {args.size // 1000} KB, {args.rtt * 1000:.0f} ms round trips\n")
+        bench_sequential(paths, args.rtt)
+        for pipelining in (False, True):
+            for concurrency in (1, 4, 8, 16):
+                bench_async(paths, args.rtt, concurrency, pipelining)
+
+
+if __name__ == '__main__':
+    main()
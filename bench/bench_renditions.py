@@ -0,0 +1,76 @@
+"""
+Benchmark for delivery renditions (renditions.py) across worker counts.
+
+Renders the same batch of photos with RenditionService using 1, 2, 4, ...
+worker processes (up to the CPU count) and reports photos/second, the speedup
+over one worker and how much smaller the renditions are than the originals.
+On a machine with N cores throughput should grow roughly linearly up to N
+workers.
+
+    python bench/bench_renditions.py                 # synthetic 24 MP photos
+    python bench/bench_renditions.py photos/*.jpg    # your own camera's photos
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import renditions
+
+SAMPLE_PHOTOS = 12
+SAMPLE_SIZE = (6000, 4000)
+
+
+def make_samples(directory):
+    paths = []
+    for i in range(SAMPLE_PHOTOS):
+        img = Image.blend(Image.effect_noise(SAMPLE_SIZE, 30).convert('RGB'),
+                          Image.linear_gradient('L').resize(SAMPLE_SIZE).convert('RGB'), 0.6)
+        paths.append(os.path.join(directory, f'sample_{i}.jpg'))
+        img.save(paths[-1], quality=92)
+    return paths
+
+
+def worker_counts():
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpus:
+        counts.append(cpus)
+    return counts
+
+
+def main(paths):
+    with tempfile.TemporaryDirectory() as directory:
+        if not paths:
+            print(f"Generating {SAMPLE_PHOTOS} {SAMPLE_SIZE[0]}x{SAMPLE_SIZE[1]} sample photos...")
+            paths = make_samples(directory)
+        original = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} photos, {original / 1e6:.1f} MB, {os.cpu_count()} CPUs, "
+              f"long edge {renditions.DEFAULT_LONG_EDGE}, quality {renditions.DEFAULT_QUALITY}")
+
+        print(f"{'workers':>7s} {'photos/s':>9s} {'speedup':>8s} {'size':>9s}")
+        baseline = None
+        for workers in worker_counts():
+            service = renditions.RenditionService(workers=workers)
+            try:
+                started = time.perf_counter()
+                for path in paths:
+                    service.submit(path)
+                rendered = service.collect(paths)
+                rate = len(paths) / (time.perf_counter() - started)
+                size = sum(os.path.getsize(path) for path in rendered)
+            finally:
+                service.shutdown()
+            baseline = baseline or rate
+            print(f"{workers:7d} {rate:9.2f} {rate / baseline:7.2f}x {size / 1e6:6.1f} MB")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
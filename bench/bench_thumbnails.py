@@ -0,0 +1,99 @@
+"""
+Micro-benchmark for the preview thumbnail strategies in photo_preview.py.
+
+Decodes each sample photo to a 150x150 thumbnail with the embedded EXIF
+thumbnail, a draft-mode (reduced scale) decode and a full decode, and
+reports the time per photo and the peak RSS. Every strategy runs in its own
+process so the peak RSS of one doesn't hide the others.
+
+    python bench/bench_thumbnails.py                  # synthetic 24 MP photos
+    python bench/bench_thumbnails.py photos/*.jpg     # your own camera's photos
+
+Peak RSS needs the resource module (Linux/macOS).
+"""
+
+import io
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import photo_preview
+
+STRATEGIES = {
+    'exif': ('exif', 'draft', 'full'),  # What the app does
+    'draft': ('draft', 'full'),
+    'full': ('full',),
+}
+SAMPLE_PHOTOS = 5
+SAMPLE_SIZE = (6000, 4000)
+
+
+def exif_with_thumbnail(thumbnail_jpeg):
+    """An APP1 EXIF block whose IFD1 holds thumbnail_jpeg, like a camera writes it"""
+    ifd1_offset = 8 + 2 + 4
+    data_offset = ifd1_offset + 2 + 2 * 12 + 4
+    return (b'Exif\x00\x00' + b'II*\x00' + struct.pack('<I', 8)
+            + struct.pack('<HI', 0, ifd1_offset)  # Empty IFD0, then IFD1
+            + struct.pack('<H', 2)
+            + struct.pack('<HHII', photo_preview.JPEG_INTERCHANGE_FORMAT, 4, 1, data_offset)
+            + struct.pack('<HHII', photo_preview.JPEG_INTERCHANGE_FORMAT_LENGTH, 4, 1, len(thumbnail_jpeg))
+            + struct.pack('<I', 0) + thumbnail_jpeg)
+
+
+def make_samples(directory):
+    paths = []
+    for i in range(SAMPLE_PHOTOS):
+        img = Image.blend(Image.effect_noise(SAMPLE_SIZE, 40).convert('RGB'),
+                          Image.linear_gradient('L').resize(SAMPLE_SIZE).convert('RGB'), 0.5)
+        thumbnail = io.BytesIO()
+        img.resize((160, 107)).save(thumbnail, 'JPEG')
+        path = os.path.join(directory, f'sample_{i}.jpg')
+        img.save(path, 'JPEG', quality=92, exif=exif_with_thumbnail(thumbnail.getvalue()))
+        paths.append(path)
+    return paths
+
+
+def run_strategy(name, paths):
+    """Runs in the child process: prints 'seconds per photo, peak RSS in MB'"""
+    started = time.perf_counter()
+    for path in paths:
+        photo_preview.load_thumbnail(path, strategies=STRATEGIES[name]).load()
+    per_photo = (time.perf_counter() - started) / len(paths)
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mb = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        peak_mb = float('nan')
+    print(f"{per_photo} {peak_mb}")
+
+
+def main(paths):
+    with tempfile.TemporaryDirectory() as directory:
+        if not paths:
+            # In a child process too: Linux carries the peak RSS over into processes started from here
+            print(f"Generating {SAMPLE_PHOTOS} {SAMPLE_SIZE[0]}x{SAMPLE_SIZE[1]} sample photos...")
+            paths = subprocess.run([sys.executable, __file__, '--generate', directory],
+                                   capture_output=True, text=True, check=True).stdout.split()
+        print(f"{'strategy':10s} {'ms/photo':>10s} {'peak RSS':>10s}")
+        for name in STRATEGIES:
+            output = subprocess.run([sys.executable, __file__, '--strategy', name] + paths,
+                                    capture_output=True, text=True, check=True).stdout.split()
+            per_photo, peak_mb = float(output[-2]), float(output[-1])
+            print(f"{name:10s} {per_photo * 1000:10.1f} {peak_mb:8.0f} MB")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--strategy':
+        run_strategy(sys.argv[2], sys.argv[3:])
+    elif len(sys.argv) == 3 and sys.argv[1] == '--generate':
+        print('\n'.join(make_samples(sys.argv[2])))
+    else:
+        main(sys.argv[1:])
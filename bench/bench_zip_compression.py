@@ -0,0 +1,82 @@
+"""
+Benchmark for the adaptive zip compression in session_zip.py.
+
+Builds a mixed session (camera JPEGs, uncompressed BMP frames, a PNG strip
+and text sidecars) and zips it three ways: everything stored, everything
+deflated at level 6, and member by member with choose_compression(). Reports
+the zip size, bytes saved and the CPU time spent, plus how long sampling all
+members in parallel with plan_compression() takes.
+
+    python bench/bench_zip_compression.py               # synthetic session
+    python bench/bench_zip_compression.py session/*     # your own files
+"""
+
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import session_zip
+
+COMPRESSION_NAMES = {zipfile.ZIP_STORED: 'stored', zipfile.ZIP_DEFLATED: 'deflate', zipfile.ZIP_LZMA: 'lzma'}
+
+
+def make_session(directory):
+    paths = []
+    for i in range(20):
+        img = Image.blend(Image.effect_noise((3000, 2000), 40).convert('RGB'),
+                          Image.linear_gradient('L').resize((3000, 2000)).convert('RGB'), 0.5)
+        paths.append(os.path.join(directory, f'photo_{i}.jpg'))
+        img.save(paths[-1], quality=92)
+    for i in range(3):
+        paths.append(os.path.join(directory, f'frame_{i}.bmp'))
+        Image.linear_gradient('L').resize((2000, 1500)).convert('RGB').save(paths[-1])
+    paths.append(os.path.join(directory, 'strip.png'))
+    Image.effect_noise((1200, 1800), 20).convert('RGB').save(paths[-1])
+    for i in range(3):
+        paths.append(os.path.join(directory, f'sidecar_{i}.txt'))
+        with open(paths[-1], 'w') as f:
+            f.writelines(f'frame {j} iso=200 shutter=1/125 f=2.8\n' for j in range(20000))
+    return paths
+
+
+def zip_with(paths, zip_path, choose):
+    """Zip paths choosing each member's compression with choose(path) - returns (size, CPU seconds)"""
+    started = time.process_time()
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        for path in paths:
+            compress_type, compresslevel = choose(path)
+            z.write(path, os.path.basename(path), compress_type, compresslevel)
+    return os.path.getsize(zip_path), time.process_time() - started
+
+
+def main(paths):
+    with tempfile.TemporaryDirectory() as directory:
+        if not paths:
+            print("Generating a mixed sample session...")
+            paths = make_session(directory)
+        total = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} files, {total / 1e6:.1f} MB")
+
+        print(f"{'policy':10s} {'zip size':>10s} {'saved':>10s} {'CPU':>8s}")
+        for name, choose in (('stored', lambda path: session_zip.STORED),
+                             ('deflate6', lambda path: (zipfile.ZIP_DEFLATED, 6)),
+                             ('adaptive', session_zip.choose_compression)):
+            size, cpu = zip_with(paths, os.path.join(directory, f'{name}.zip'), choose)
+            print(f"{name:10s} {size / 1e6:7.1f} MB {(total - size) / 1e6:7.1f} MB {cpu:7.2f}s")
+
+        started = time.perf_counter()
+        plan = session_zip.plan_compression(paths)
+        print(f"Sampling all members in parallel: {(time.perf_counter() - started) * 1000:.0f} ms")
+        choices = Counter(f"{COMPRESSION_NAMES[t]}{f' {level}' if level else ''}" for t, level in plan.values())
+        print("Chosen: " + ', '.join(f"{count} {choice}" for choice, count in choices.most_common()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
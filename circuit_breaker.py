@@ -0,0 +1,162 @@
+"""
+Circuit breaker around the mail backend.
+
+When the venue network or the mail server goes down, every send used to
+wait for a full connect timeout before the session was archived, so each
+guest paid for the outage again. The breaker counts consecutive sends that
+failed because the server could not be reached. After failure_threshold of
+them it opens: sends fail at once with CircuitOpen (the apps archive the
+session and queue it in the outbox) without touching the network.
+
+While open, a background thread runs a cheap probe every probe_interval
+seconds (EHLO/NOOP for SMTP, a small authorized request for the Gmail API).
+When a probe succeeds the breaker is half-open: the next send is let
+through as a trial, and if it works the breaker closes again. A trial that
+fails opens it again.
+
+Only errors that mean the network or the server is down count as failures
+(see is_network_error()). A missing photo or a permission error while the
+message is built says nothing about the server and leaves the state alone.
+"""
+
+import errno
+import socket
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_FAILURE_THRESHOLD = 2
+DEFAULT_PROBE_INTERVAL = 15.0
+
+# OSErrors that are about the network rather than a local file
+NETWORK_ERRNOS = (errno.ENETDOWN, errno.ENETUNREACH, errno.EHOSTUNREACH)
+
+
+def is_network_error(e):
+    """True if e means the server could not be reached or stopped answering (refused, reset, timed out, no DNS)"""
+    if isinstance(e, (ConnectionError, socket.timeout, TimeoutError, socket.gaierror)):
+        return True
+    return isinstance(e, OSError) and e.errno in NETWORK_ERRNOS
+
+
+class CircuitOpen(Exception):
+    """Raised instead of sending while the mail backend is known to be unreachable.
+
+    retry_at (a time.time() value) is when the next probe runs; the outbox
+    uses it as the batch's next retry time.
+    """
+
+    def __init__(self, message, retry_at=None):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+class CircuitBreaker:
+    """Wraps sends with call(); probe() must raise if the backend is unreachable.
+
+    is_failure(e) decides whether an exception means the backend is down
+    (connection refused, timeout, server error). Other exceptions, e.g. a
+    refused recipient, don't change the state. on_change(state, error) is
+    called from the thread that caused the change.
+    """
+
+    def __init__(self, probe, is_failure, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 probe_interval=DEFAULT_PROBE_INTERVAL, on_change=None):
+        self.probe = probe
+        self.is_failure = is_failure
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0  # Consecutive failures while closed
+        self.last_error = None
+        self.next_probe_at = 0.0  # time.time() of the next probe while open
+        self._trial = False  # A half-open trial send is in progress
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="circuit-probe", daemon=True)
+        self._thread.start()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless the breaker is open (raises CircuitOpen then)"""
+        with self._lock:
+            if self.state == OPEN or (self.state == HALF_OPEN and self._trial):
+                raise CircuitOpen(f"Mail server unreachable, not trying until it answers again "
+                                  f"(last error: {self.last_error})", self.next_probe_at)
+            trial = self.state == HALF_OPEN
+            if trial:
+                self._trial = True
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self._failed(e, trial)
+            elif trial:
+                with self._lock:
+                    self._trial = False  # Says nothing about the server, let the next send try
+            raise
+        self._succeeded()
+        return result
+
+    def _succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            changed = self.state != CLOSED
+            self.state = CLOSED
+        if changed:
+            print("Mail server is working again, circuit closed")
+            self._notify(CLOSED, None)
+
+    def _failed(self, error, trial):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if trial:
+                self._trial = False
+            opened = self.state != OPEN and (trial or self.failures >= self.failure_threshold)
+            if opened:
+                self.state = OPEN
+                self.next_probe_at = time.time() + self.probe_interval
+        if opened:
+            print(f"Mail server unreachable, circuit open: {error}")
+            self._notify(OPEN, error)
+            self._wake.set()
+
+    def _notify(self, state, error):
+        if self.on_change:
+            try:
+                self.on_change(state, error)
+            except Exception as e:
+                print(f"Error reporting circuit state {state}: {e}")
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                wait = self.next_probe_at - time.time() if self.state == OPEN else None
+            if wait is None or wait > 0:
+                self._wake.wait(wait)
+                self._wake.clear()
+                continue
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self.last_error = str(e)
+                    self.next_probe_at = time.time() + self.probe_interval
+                continue
+            with self._lock:
+                if self.state != OPEN:
+                    continue
+                self.state = HALF_OPEN
+            print("Mail server answered a probe, circuit half-open")
+            self._notify(HALF_OPEN, None)
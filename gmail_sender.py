@@ -0,0 +1,197 @@
+"""
+Concurrent Gmail API sender for draining the archive.
+
+send_archived_photos.py used to send one batch at a time and embedded every
+zip, base64-encoded, in the JSON request body. GmailSender runs sends on a
+thread pool with one authorized HTTP connection (and API client) per worker,
+because httplib2 connections are not thread-safe. Messages go through the
+media upload endpoint as raw RFC 822 instead of being base64-encoded into
+the JSON body. Messages above RESUMABLE_THRESHOLD are sent as a resumable
+upload, read from a mime_stream message one chunk at a time.
+
+Rate limit errors (429, 403 rateLimitExceeded/userRateLimitExceeded) and
+server errors are retried with backoff that depends on the error, honoring
+Retry-After. While one worker is backing off from a rate limit the other
+workers wait too, rather than making it worse. Other errors (including
+dailyLimitExceeded) are raised right away.
+
+api_endpoint points the client at another server, e.g. a local stand-in
+for testing.
+"""
+
+import json
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, build_http
+
+from async_smtp import DrainStats
+
+# Messages at least this large are sent as a resumable media upload
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+
+# Backoff per kind of error: (first delay, maximum delay) in seconds
+BACKOFF = {
+    'rateLimitExceeded': (1.0, 32.0),
+    'userRateLimitExceeded': (1.0, 32.0),
+    429: (2.0, 64.0),  # Too many concurrent requests for the account
+    500: (1.0, 16.0),
+    502: (1.0, 16.0),
+    503: (1.0, 16.0),
+    504: (1.0, 16.0),
+}
+SERVER_ERRORS = (500, 502, 503, 504)
+MAX_RETRIES = 6
+
+
+def error_reason(e):
+    """The 'reason' of a Gmail API HttpError, e.g. 'rateLimitExceeded' (None if unknown)"""
+    try:
+        content = e.content.decode() if isinstance(e.content, bytes) else e.content
+        return json.loads(content)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def _backoff_key(e):
+    """The BACKOFF entry for a retryable error, or None if the error should not be retried"""
+    if not isinstance(e, HttpError):
+        return None
+    status = e.resp.status
+    if status == 403:
+        reason = error_reason(e)
+        return reason if reason in BACKOFF else None
+    return status if status in BACKOFF else None
+
+
+def send_request(messages, message, resumable_threshold=RESUMABLE_THRESHOLD, api_endpoint=None):
+    """A users.messages.send() request that uploads a mime_stream message as media"""
+    media = MediaIoBaseUpload(message.reader(), mimetype='message/rfc822', chunksize=UPLOAD_CHUNK_SIZE,
+                              resumable=message.size() >= resumable_threshold)
+    request = messages.send(userId='me', media_body=media)
+    if api_endpoint:
+        # The client only moves upload URLs to the endpoint's host, not its scheme
+        endpoint = urllib.parse.urlparse(api_endpoint)
+        request.uri = urllib.parse.urlparse(request.uri)._replace(
+            scheme=endpoint.scheme, netloc=endpoint.netloc).geturl()
+    return request
+
+
+class GmailSender:
+    def __init__(self, creds, api_endpoint=None, resumable_threshold=RESUMABLE_THRESHOLD,
+                 max_retries=MAX_RETRIES, timeout=None):
+        self.creds = creds
+        self.api_endpoint = api_endpoint
+        self.timeout = timeout  # Socket timeout of each request (None: build_http()'s default)
+        self.resumable_threshold = resumable_threshold
+        self.max_retries = max_retries
+        self.retries = 0  # Number of requests that were retried after backing off
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._paused_until = 0.0  # Shared by all workers after a rate limit error
+
+    def service(self):
+        """This thread's Gmail API client, with its own HTTP connection"""
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            # build_http() keeps 308 responses away from httplib2's redirect handling,
+            # resumable uploads use them to report progress
+            http = build_http()
+            if self.timeout:
+                http.timeout = self.timeout
+            http = AuthorizedHttp(self.creds, http=http)
+            client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+            service = build('gmail', 'v1', http=http, cache_discovery=False,
+                            client_options=client_options)
+            self._local.service = service
+        return service
+
+    def _wait_if_paused(self):
+        while True:
+            with self._lock:
+                delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _back_off(self, e, key, attempt):
+        base, cap = BACKOFF[key]
+        retry_after = e.resp.get('retry-after')
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+        with self._lock:
+            self.retries += 1
+            if key not in SERVER_ERRORS:
+                # Rate limits apply to the whole account, so everyone waits
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        print(f"Gmail API {key}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    def send(self, message):
+        """Send a mime_stream message - returns the API response"""
+        request = send_request(self.service().users().messages(), message,
+                               self.resumable_threshold, self.api_endpoint)
+
+        attempt = 0
+        while True:
+            self._wait_if_paused()
+            try:
+                # Executing the same request again resumes an interrupted upload
+                result = request.execute()
+                break
+            except HttpError as e:
+                key = _backoff_key(e)
+                if key is None or attempt >= self.max_retries:
+                    raise
+                self._back_off(e, key, attempt)
+                attempt += 1
+
+        if not result or 'id' not in result:
+            raise Exception("Gmail API did not return a valid message ID")
+        return result
+
+
+def drain(jobs, send_fn, workers=4, on_result=None):
+    """Run send_fn(job) for every job on `workers` threads and return DrainStats
+
+    send_fn returns the number of bytes sent. on_result(job, error) is called
+    after each job, one at a time (error is None on success). At most
+    2 * workers jobs are read ahead from the iterable.
+    """
+    stats = DrainStats()
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(2 * workers)
+
+    def run(job):
+        try:
+            try:
+                size = send_fn(job)
+                error = None
+            except Exception as e:
+                error = e
+            with lock:
+                if error:
+                    stats.failed += 1
+                else:
+                    stats.sent += 1
+                    stats.bytes_sent += size
+                if on_result:
+                    on_result(job, error)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gmail-send') as executor:
+        for job in jobs:
+            slots.acquire()
+            executor.submit(run, job)
+    stats.finished = time.monotonic()
+    return stats
@@ -0,0 +1,211 @@
+"""
+Streaming MIME messages that never hold a whole attachment in memory.
+
+Building the email with MIMEBase.set_payload(f.read()) + encode_base64()
+keeps the zip, its base64 encoding and the serialized message in memory at
+the same time (and the Gmail API path base64-encodes all of that once more).
+StreamingMessage writes the headers and text part up front and then reads
+each attachment from disk in fixed-size blocks, base64-encoding it into
+76-character lines as it goes, so memory use does not depend on the size of
+the attachment.
+
+The exact size of the message is known before anything is read, so it can
+also be exposed as a seekable file (reader()) for resumable HTTP uploads.
+smtp_data_chunks() turns any message into a dot-stuffed SMTP DATA stream.
+"""
+
+import base64
+import io
+import os
+import re
+import uuid
+from email import policy
+from email.mime.text import MIMEText
+
+CRLF = b'\r\n'
+LINE_BYTES = 57  # Raw bytes per base64 line
+LINE_LENGTH = 78  # 76 base64 characters + CRLF
+BLOCK_LINES = 1024  # Lines encoded per read, about 56 KB of the attachment
+
+
+def encoded_size(n):
+    """Size of n bytes base64-encoded into CRLF-terminated 76-character lines"""
+    lines = -(-n // LINE_BYTES)
+    return 4 * -(-n // 3) + 2 * lines
+
+
+class _Attachment:
+    def __init__(self, path, filename=None):
+        self.path = path
+        self.filename = filename or os.path.basename(path)
+        self.file_size = os.path.getsize(path)
+        self.size = encoded_size(self.file_size)
+
+    def encode_lines(self, f, first_line, last_line):
+        """Encode lines first_line..last_line (inclusive) of the attachment"""
+        f.seek(first_line * LINE_BYTES)
+        raw = f.read((last_line - first_line + 1) * LINE_BYTES)
+        return base64.encodebytes(raw).replace(b'\n', CRLF)
+
+    def read(self, start, end):
+        """Bytes start..end of the encoded attachment"""
+        first_line, last_line = start // LINE_LENGTH, (end - 1) // LINE_LENGTH
+        with open(self.path, 'rb') as f:
+            encoded = self.encode_lines(f, first_line, last_line)
+        offset = first_line * LINE_LENGTH
+        return encoded[start - offset:end - offset]
+
+    def iter_blocks(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                raw = f.read(BLOCK_LINES * LINE_BYTES)
+                if not raw:
+                    return
+                yield base64.encodebytes(raw).replace(b'\n', CRLF)
+
+
+class StreamingMessage:
+    """A text body plus file attachments, encoded on the fly.
+
+    Every chunk from iter_chunks() starts at the beginning of a line and
+    ends with CRLF.
+    """
+
+    def __init__(self, from_addr, to_addr, subject, body, attachments=(), message_id=None):
+        self.from_addr = from_addr
+        self.to_addr = to_addr
+        self.boundary = f"=_photo_booth_{uuid.uuid4().hex}"
+        self.attachments = [_Attachment(path) for path in attachments]
+
+        headers = []
+        if from_addr:
+            headers.append(('From', from_addr))
+        headers += [('To', to_addr), ('Subject', subject)]
+        if message_id:
+            headers.append(('Message-ID', message_id))
+        headers += [('MIME-Version', '1.0'),
+                    ('Content-Type', f'multipart/mixed; boundary="{self.boundary}"')]
+        text = MIMEText(body, 'plain').as_bytes(policy=policy.SMTP)
+        if not text.endswith(CRLF):
+            text += CRLF
+        delimiter = b'--' + self.boundary.encode()
+
+        # The message as a list of literal byte strings and attachments
+        self._segments = [self._fold(headers) + CRLF + delimiter + CRLF + text]
+        for attachment in self.attachments:
+            self._segments.append(CRLF + delimiter + CRLF + self._fold([
+                ('Content-Type', 'application/octet-stream'),
+                ('Content-Transfer-Encoding', 'base64'),
+                ('Content-Disposition', f'attachment; filename="{attachment.filename}"'),
+            ]) + CRLF)
+            self._segments.append(attachment)
+        self._segments.append(delimiter + b'--' + CRLF)
+
+    @staticmethod
+    def _fold(headers):
+        # Header objects take care of folding and of encoding non-ASCII text (RFC 2047)
+        return b''.join(policy.SMTP.header_factory(name, value).fold(policy=policy.SMTP).encode('ascii')
+                        for name, value in headers)
+
+    def _segment_size(self, segment):
+        return segment.size if isinstance(segment, _Attachment) else len(segment)
+
+    def size(self):
+        """Exact size of the encoded message in bytes"""
+        return sum(self._segment_size(segment) for segment in self._segments)
+
+    def iter_chunks(self):
+        """Yield the encoded message in blocks of at most about 57 KB"""
+        for segment in self._segments:
+            if isinstance(segment, _Attachment):
+                yield from segment.iter_blocks()
+            else:
+                yield segment
+
+    def read_range(self, start, end):
+        """Bytes start..end of the encoded message"""
+        parts = []
+        offset = 0
+        for segment in self._segments:
+            size = self._segment_size(segment)
+            lo, hi = max(start, offset), min(end, offset + size)
+            if lo < hi:
+                if isinstance(segment, _Attachment):
+                    parts.append(segment.read(lo - offset, hi - offset))
+                else:
+                    parts.append(segment[lo - offset:hi - offset])
+            offset += size
+            if offset >= end:
+                break
+        return b''.join(parts)
+
+    def reader(self):
+        """A seekable, read-only file over the encoded message"""
+        return MessageReader(self)
+
+
+class RawMessage:
+    """An already serialized message with the same interface as StreamingMessage"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def size(self):
+        return len(self.data)
+
+    def iter_chunks(self):
+        yield self.data
+
+    def read_range(self, start, end):
+        return self.data[start:end]
+
+    def reader(self):
+        return io.BytesIO(self.data)
+
+
+class MessageReader(io.RawIOBase):
+    def __init__(self, message):
+        self.message = message
+        self._size = message.size()
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(0, offset)
+        return self._position
+
+    def read(self, size=-1):
+        end = self._size if size is None or size < 0 else min(self._size, self._position + size)
+        if self._position >= end:
+            return b''
+        data = self.message.read_range(self._position, end)
+        self._position = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def smtp_data_chunks(message):
+    """The DATA section for SMTP: dot-stuffed chunks followed by the terminating '.'"""
+    last = CRLF
+    for chunk in message.iter_chunks():
+        if chunk:
+            # Chunks start at the beginning of a line, so each one can be stuffed on its own
+            yield re.sub(br'(?m)^\.', b'..', chunk)
+            last = chunk
+    yield (b'' if last.endswith(CRLF) else CRLF) + b'.' + CRLF
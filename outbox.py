@@ -0,0 +1,185 @@
+"""
+Crash-safe outbox for photo batches that could not be sent.
+
+When a send fails the batch is archived as before (zip + SEND_TO.txt), and
+it is also recorded in a small SQLite database in WAL mode with its attempt
+count, last error and next retry time. An OutboxRetrier thread drains the
+outbox with exponential backoff and jitter, so photos go out on their own
+once the venue network or mail provider comes back - including after the
+app has been restarted.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+SENT = 'sent'
+MISSING = 'missing'  # Zip disappeared, e.g. sent by hand with the helper script
+
+# Retry delays: 15s, 30s, 60s, ... capped at 5 minutes, +/- 50% jitter
+RETRY_BASE_DELAY = 15.0
+RETRY_MAX_DELAY = 300.0
+RETRY_JITTER = 0.5
+
+
+def backoff_delay(attempts, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY, jitter=RETRY_JITTER):
+    """Seconds to wait before the next attempt after `attempts` failures"""
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+class Outbox:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                zip_path TEXT NOT NULL,
+                folder TEXT,
+                photo_count INTEGER,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_retry_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending'
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_retry_at)")
+
+    def add(self, recipient, zip_path, photo_count, folder=None, attempts=0, last_error=None,
+            next_retry_at=None):
+        """Record a batch that still has to be delivered - returns its outbox id"""
+        now = time.time()
+        if next_retry_at is None:
+            next_retry_at = now + backoff_delay(attempts) if attempts else now
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (recipient, zip_path, folder, photo_count, created_at, "
+                "attempts, last_error, next_retry_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (recipient, os.path.abspath(zip_path), folder, photo_count, now,
+                 attempts, last_error, next_retry_at))
+            return cursor.lastrowid
+
+    def due(self, limit=10, now=None):
+        """Pending batches whose retry time has come, oldest first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outbox WHERE status = ? AND next_retry_at <= ? "
+                "ORDER BY next_retry_at LIMIT ?", (PENDING, now, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_done(self, entry_id, status=SENT):
+        with self._lock:
+            self._conn.execute("UPDATE outbox SET status = ? WHERE id = ?", (status, entry_id))
+
+    def mark_failed(self, entry_id, error, next_retry_at=None):
+        """Record a failed attempt and schedule the next one (with backoff unless given)"""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+            attempts = (row['attempts'] if row else 0) + 1
+            if next_retry_at is None:
+                next_retry_at = time.time() + backoff_delay(attempts)
+            self._conn.execute(
+                "UPDATE outbox SET attempts = ?, last_error = ?, next_retry_at = ? WHERE id = ?",
+                (attempts, str(error), next_retry_at, entry_id))
+
+    def retry_all_now(self):
+        """Make every pending batch due immediately, e.g. after a send just succeeded"""
+        with self._lock:
+            self._conn.execute("UPDATE outbox SET next_retry_at = ? WHERE status = ?",
+                               (time.time(), PENDING))
+
+    def zip_paths(self):
+        """Set of the zip paths of every batch ever added (whatever its status)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT zip_path FROM outbox").fetchall()
+        return {row[0] for row in rows}
+
+    def pending_count(self):
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = ?",
+                                     (PENDING,)).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxRetrier:
+    """Background thread that keeps retrying the outbox until it is empty.
+
+    send_fn(recipient, zip_path) must raise on failure. on_sent(entry) and
+    on_failed(entry, error) are called from the retrier thread. With a
+    throttle (an archive_drain.LatencyBudget), each retry waits until it
+    won't hold up live sends.
+    """
+
+    def __init__(self, outbox, send_fn, on_sent=None, on_failed=None, poll_interval=5.0,
+                 throttle=None):
+        self.outbox = outbox
+        self.throttle = throttle
+        self.send_fn = send_fn
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="outbox-retrier", daemon=True)
+        self._thread.start()
+
+    def wake(self, retry_now=False):
+        """Check the outbox right away, optionally ignoring backoff"""
+        if retry_now:
+            self.outbox.retry_all_now()
+        self._wake.set()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while self._running:
+            for entry in self.outbox.due():
+                # Stop at the first failure, the rest would most likely fail the same way
+                if not self._running or not self._attempt(entry):
+                    break
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _attempt(self, entry):
+        """Try to deliver one outbox entry - returns False if sending failed"""
+        if not os.path.exists(entry['zip_path']):
+            print(f"Outbox: {entry['zip_path']} no longer exists, dropping it")
+            self.outbox.mark_done(entry['id'], MISSING)
+            return True
+        size = os.path.getsize(entry['zip_path'])
+        if self.throttle and not self.throttle.wait(size, lambda: not self._running):
+            return False
+        started = time.monotonic()
+        try:
+            self.send_fn(entry['recipient'], entry['zip_path'])
+        except Exception as e:
+            print(f"Outbox: retry {entry['attempts'] + 1} for {entry['recipient']} failed: {e}")
+            # Errors that know when sending will work again (e.g. QuotaExceeded) say so
+            self.outbox.mark_failed(entry['id'], e, getattr(e, 'retry_at', None))
+            if self.on_failed:
+                self.on_failed(entry, e)
+            return False
+        if self.throttle:
+            self.throttle.drain_finished(time.monotonic() - started, size)
+        self.outbox.mark_done(entry['id'])
+        if self.on_sent:
+            self.on_sent(entry)
+        return True
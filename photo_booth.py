@@ -8,20 +8,108 @@ from watchdog.events import FileSystemEventHandler
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import threading
-import zipfile
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-import base64
+from google.auth.exceptions import RefreshError, TransportError
+from googleapiclient.errors import HttpError
+import httplib2
 import json
+from photo_ingest import FileReadyDetector, IngestPool
+from renditions import RenditionService, keep_originals
+from ui_updates import UIUpdateBus, STATUS, CAPTURED, SENDING, SENT, ARCHIVED, ERROR
+import send_pipeline
+from session_zip import STORED, SessionArchive, choose_compression, part_label, session_zip_path
+from outbox import Outbox, OutboxRetrier
+from archive_drain import LatencyBudget, import_archive, ledger_send
+from archive_manifest import ArchiveManifest
+from send_quota import QuotaExceeded, QuotaTracker, SendLimiter, TokenBucket
+from sender_accounts import AccountRouter, SenderAccount
+from mime_stream import StreamingMessage
+from gmail_sender import GmailSender
+from circuit_breaker import CircuitBreaker, CircuitOpen, OPEN, HALF_OPEN, is_network_error
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
+# One token file per sender account. Add e.g. 'token_2.json' to send from a
+# second Gmail account - you will be asked to log in to it on the next start.
+GMAIL_TOKEN_FILES = ['token.json']
+
+# Seconds to wait for the camera to finish writing a photo before giving up on it
+FILE_READY_TIMEOUT = 10.0
+
+# Ingest stage: photos wait in a bounded queue for a fixed pool of workers.
+# When the queue is full the observer blocks (INGEST_BLOCK_WHEN_FULL = True)
+# or new photos are dropped (False).
+INGEST_WORKERS = 4
+INGEST_QUEUE_SIZE = 100
+INGEST_BLOCK_WHEN_FULL = True
+
+# Unsent batches are recorded here and retried automatically, even across restarts
+OUTBOX_DB = 'outbox.sqlite3'
+
+# Sending limits - sends are deferred to the outbox before these are hit
+# (per sender account)
+DAILY_SEND_LIMIT = 100  # Unverified Gmail API app
+SENDS_PER_MINUTE = 20
+SEND_BURST = 5
+QUOTA_FILE = 'send_quota_{account}.json'
+
+# Sessions are split into several emails that each stay under this size (after base64
+# encoding). Up to PART_SEND_WORKERS parts are sent at once.
+MAX_MESSAGE_SIZE = 25 * 1024 * 1024  # Gmail's limit
+PART_SEND_WORKERS = 3
+
+# A session for an email address whose previous session has not started sending yet
+# (e.g. the guest comes back) goes out in the same email. Sessions can also wait this
+# many seconds before they are sent, to catch more of those. 0 sends them right away.
+COALESCE_WINDOW = 0
+
+# Delivery renditions: email a resized copy of each photo instead of the camera original.
+# The originals are kept in a folder next to the session's zip. None sends the originals.
+DELIVERY_LONG_EDGE = None  # e.g. 2048 pixels
+DELIVERY_QUALITY = 85
+DELIVERY_PROGRESSIVE = True
+
+# Archived batches are retried in the background, but only while no guest's photos are
+# being sent and only if the retry should be done within LIVE_LATENCY_BUDGET seconds
+# (so a guest arriving meanwhile isn't held up much longer). Larger batches wait until
+# nobody has used the booth for DRAIN_QUIET_PERIOD seconds.
+LIVE_LATENCY_BUDGET = 30
+DRAIN_QUIET_PERIOD = 120
+
+# Seconds to wait for Gmail to answer a request (httplib2 has one timeout for connecting and reading)
+GMAIL_TIMEOUT = 60
+
+# After BREAKER_FAILURE_THRESHOLD sends in a row fail because the Gmail API can't be reached,
+# sessions go straight to the outbox without trying. The Gmail API is probed every
+# BREAKER_PROBE_INTERVAL seconds and sending resumes once it answers.
+BREAKER_FAILURE_THRESHOLD = 2
+BREAKER_PROBE_INTERVAL = 15
+
+# Gmail API error reasons that mean the account (not the network) is the problem
+ACCOUNT_ERROR_REASONS = ('dailyLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'authError')
+
+
+def is_account_error(e):
+    """True if a send failed because of the sender account (login, sending limit), not the network"""
+    if isinstance(e, RefreshError):
+        return True
+    if isinstance(e, HttpError):
+        if e.resp.status == 401:
+            return True
+        content = e.content.decode(errors='replace') if isinstance(e.content, bytes) else str(e.content)
+        return e.resp.status in (403, 429) and any(reason in content for reason in ACCOUNT_ERROR_REASONS)
+    return False
+
+
+def is_connection_error(e):
+    """True if a send failed because Gmail could not be reached or had a server error"""
+    if isinstance(e, HttpError):
+        return e.resp.status >= 500
+    return isinstance(e, (httplib2.HttpLib2Error, TransportError)) or is_network_error(e)
+
 class PhotoBoothApp:
     def __init__(self, root):
         self.root = root
@@ -35,12 +123,40 @@ class PhotoBoothApp:
         self.observer = None
         self.photo_files = []
         self.file_counter = 0
+        self.session_archive = None  # The current session's zip, filled as photos arrive
+        self.renditions = None  # Renders delivery copies as photos arrive (if DELIVERY_LONG_EDGE is set)
+        if DELIVERY_LONG_EDGE:
+            self.renditions = RenditionService(DELIVERY_LONG_EDGE, DELIVERY_QUALITY, DELIVERY_PROGRESSIVE)
         self.timer = None
-        self.gmail_service = None
+        self.accounts = None  # Routes each email to the Gmail account with the most quota left
         self.storage_mode = False  # Tracks if we're in fallback storage mode
+        self.file_ready = FileReadyDetector(timeout=FILE_READY_TIMEOUT)
+        self.session_lock = threading.RLock()  # Guards photo_files and file_counter
+        self.ingest = IngestPool(self.prepare_new_photo, self.handle_new_photo,
+                                 workers=INGEST_WORKERS, max_queued=INGEST_QUEUE_SIZE,
+                                 block_when_full=INGEST_BLOCK_WHEN_FULL)
         
         self.setup_ui()
+        self.ui = UIUpdateBus(self.root, self.status_label)
         self.setup_gmail_api()
+        self.update_quota_label()
+        # Package -> send -> cleanup, so the next session is zipped while the previous one uploads.
+        # One send worker per account so sessions upload in parallel.
+        send_workers = max(1, len(self.accounts.accounts) if self.accounts else 1)
+        self.sender = send_pipeline.SessionPipeline([
+            send_pipeline.Stage('package', self.package_session, workers=1),
+            send_pipeline.Stage('send', self.send_session, workers=send_workers,
+                                queue_size=2 * send_workers),
+            send_pipeline.Stage('cleanup', self.cleanup_session, workers=1),
+        ], on_progress=self.on_send_progress, on_error=self.on_session_error,
+           coalesce_window=COALESCE_WINDOW, merge_until='send')
+        self.breaker = CircuitBreaker(self.probe_mail_server, is_connection_error, BREAKER_FAILURE_THRESHOLD,
+                                      BREAKER_PROBE_INTERVAL, on_change=self.on_breaker_change)
+        self.outbox = Outbox(OUTBOX_DB)
+        self.drain_budget = LatencyBudget(LIVE_LATENCY_BUDGET, lambda: self.sender.pending() > 0,
+                                          DRAIN_QUIET_PERIOD)
+        self.retrier = OutboxRetrier(self.outbox, ledger_send(self.send_email_with_attachment),
+                                     on_sent=self.on_outbox_sent, throttle=self.drain_budget)
         
     def setup_ui(self):
         # Directory selection
@@ -91,6 +207,9 @@ class PhotoBoothApp:
                                      font=("Arial", 10), fg="blue")
         self.status_label.pack(pady=10)
         
+        self.quota_label = tk.Label(self.root, text="", font=("Arial", 9), fg="gray")
+        self.quota_label.pack()
+        
     def select_directory(self):
         directory = filedialog.askdirectory(title="Select Directory to Monitor")
         if directory:
@@ -110,12 +229,51 @@ class PhotoBoothApp:
             self.archive_directory = directory
             self.archive_label.config(text=f"...{directory[-30:]}", fg="black")
             
+            # Send whatever is already waiting in the archive in the background. Indexing
+            # a big archive can take a while, so it happens off the Tk thread too.
+            threading.Thread(target=self.load_archive, args=(directory,), name="archive-import",
+                             daemon=True).start()
+            
+    def load_archive(self, directory):
+        """Queue the archive's unsent batches for the retrier (runs on a worker thread)"""
+        try:
+            added = import_archive(self.outbox, directory)
+        except Exception as e:
+            print(f"Error reading archive {directory}: {e}")
+            self.ui.post(ERROR, text=f"Could not read the archive: {e}", fg="red")
+            return
+        if added:
+            self.storage_mode = True
+            self.retrier.wake()
+            self.ui.post(
+                ARCHIVED,
+                text=f"{added} archived batch(es) found - they will be sent between guests",
+                fg="orange"
+            )
+    
     def setup_gmail_api(self):
-        """Set up Gmail API authentication"""
+        """Set up a Gmail API client for every sender account"""
+        accounts = []
+        for token_file in GMAIL_TOKEN_FILES:
+            creds = self.load_gmail_credentials(token_file)
+            if not creds:
+                continue
+            limiter = SendLimiter(QuotaTracker(QUOTA_FILE.format(account=os.path.splitext(token_file)[0]),
+                                               DAILY_SEND_LIMIT),
+                                  TokenBucket(SENDS_PER_MINUTE, burst=SEND_BURST))
+            # One API client (and HTTP connection) per thread, so the parts of a session upload
+            # side by side. Live sends are not retried here, failures go to the outbox.
+            client = GmailSender(creds, max_retries=0, timeout=GMAIL_TIMEOUT)
+            accounts.append(SenderAccount(token_file, client, limiter))
+        if accounts:
+            self.accounts = AccountRouter(accounts, is_account_error)
+    
+    def load_gmail_credentials(self, token_file):
+        """Load (or log in and save) the OAuth credentials for one account"""
         creds = None
         # Token file stores the user's access and refresh tokens
-        if os.path.exists('token.json'):
-            with open('token.json', 'r') as token:
+        if os.path.exists(token_file):
+            with open(token_file, 'r') as token:
                 token_data = json.load(token)
                 creds = Credentials.from_authorized_user_info(token_data, SCOPES)
         
@@ -133,13 +291,13 @@ class PhotoBoothApp:
                 else:
                     messagebox.showerror("Error", 
                         "credentials.json not found. Please set up Gmail API credentials.")
-                    return
+                    return None
             
             # Save the credentials for the next run
-            with open('token.json', 'w') as token:
+            with open(token_file, 'w') as token:
                 token.write(creds.to_json())
         
-        self.gmail_service = build('gmail', 'v1', credentials=creds)
+        return creds
         
     def update_email(self):
         new_email = self.email_entry.get().strip()
@@ -152,13 +310,14 @@ class PhotoBoothApp:
             messagebox.showwarning("Warning", "Please enter a valid email address")
             return
         
-        # If email changed and we have pending photos, send them first
-        if self.current_email and self.current_email != new_email and self.photo_files:
-            self.status_label.config(text=f"Email changed. Sending photos to {self.current_email}...")
-            self.send_photos()
-        
-        self.current_email = new_email
-        self.status_label.config(text=f"Monitoring for: {self.current_email}")
+        with self.session_lock:
+            # If email changed and we have pending photos, send them in the background first
+            if self.current_email and self.current_email != new_email and self.photo_files:
+                self.ui.post(SENDING, text=f"Email changed. Sending photos to {self.current_email}...")
+                self.send_photos()
+            
+            self.current_email = new_email
+        self.ui.post(STATUS, text=f"Monitoring for: {self.current_email}")
         
     def start_monitoring(self):
         if self.observer:
@@ -169,7 +328,7 @@ class PhotoBoothApp:
         self.observer = Observer()
         self.observer.schedule(event_handler, self.watch_directory, recursive=False)
         self.observer.start()
-        self.status_label.config(text="Monitoring directory for new photos...")
+        self.ui.post(STATUS, text="Monitoring directory for new photos...")
         
     def reset_timer(self):
         """Reset the 20-second timer"""
@@ -183,125 +342,291 @@ class PhotoBoothApp:
     def on_timer_expire(self):
         """Called when 20 seconds pass with no new photos"""
         if self.photo_files:
-            self.status_label.config(text="Timer expired. Sending photos...")
+            self.ui.post(SENDING, text="Timer expired. Sending photos...")
             self.send_photos()
     
-    def handle_new_photo(self, filepath):
-        """Handle a new photo file"""
+    def prepare_new_photo(self, filepath):
+        """Wait until the camera has finished writing the file (runs on an ingest worker)
+        
+        Returns how the photo should be compressed in the session zip, or False
+        """
+        if not self.file_ready.wait_until_ready(filepath):
+            self.ui.post(
+                ERROR,
+                text=f"Photo was not fully written in time: {os.path.basename(filepath)}", 
+                fg="red"
+            )
+            return False
+        try:
+            return choose_compression(filepath)
+        except OSError:
+            return STORED  # Storing is always safe, just not as small
+    
+    def handle_new_photo(self, filepath, compression=None):
+        """Handle a new photo file (called by the ingest pool in capture order)"""
         if not self.current_email:
-            self.status_label.config(text="Please enter an email address first!", fg="red")
+            self.ui.post(ERROR, text="Please enter an email address first!", fg="red")
             return
         
         if not self.zip_output_directory:
-            self.status_label.config(text="Please select a zip output directory first!", fg="red")
+            self.ui.post(ERROR, text="Please select a zip output directory first!", fg="red")
             return
         
         if not self.archive_directory:
-            self.status_label.config(text="Please select an archive directory first!", fg="red")
+            self.ui.post(ERROR, text="Please select an archive directory first!", fg="red")
             return
         
-        # Extract username from email
-        username = self.current_email.split('@')[0]
-        
-        # Generate new filename with counter to avoid duplicates
-        self.file_counter += 1
-        new_filename = f"{username}_{self.file_counter}.jpg"
-        new_filepath = os.path.join(self.watch_directory, new_filename)
-        
-        # Wait a moment to ensure file is fully written
-        time.sleep(0.5)
-        
-        # Rename the file
-        try:
-            os.rename(filepath, new_filepath)
-            self.photo_files.append(new_filepath)
-            self.status_label.config(
-                text=f"Captured photo {self.file_counter} for {self.current_email}", 
-                fg="green"
-            )
+        with self.session_lock:
+            # Extract username from email
+            username = self.current_email.split('@')[0]
             
-            # Reset the 20-second timer
-            self.reset_timer()
+            # Generate new filename with counter to avoid duplicates
+            self.file_counter += 1
+            new_filename = f"{username}_{self.file_counter}.jpg"
+            new_filepath = os.path.join(self.watch_directory, new_filename)
+            while os.path.exists(new_filepath):
+                self.file_counter += 1
+                new_filename = f"{username}_{self.file_counter}.jpg"
+                new_filepath = os.path.join(self.watch_directory, new_filename)
             
+            # Rename the file
+            try:
+                os.rename(filepath, new_filepath)
+                self.photo_files.append(new_filepath)
+                if self.renditions:
+                    self.renditions.submit(new_filepath)  # Zipped when the session is sent
+                else:
+                    self.add_to_session_archive(new_filepath, compression)
+                self.ui.post(
+                    CAPTURED,
+                    text=f"Captured photo {self.file_counter} for {self.current_email}", 
+                    fg="green"
+                )
+                
+                # Reset the 20-second timer
+                self.reset_timer()
+                
+            except Exception as e:
+                self.ui.notify("Error", f"Failed to rename file: {str(e)}")
+    
+    def add_to_session_archive(self, photo_path, compression=None):
+        """Append a photo to the session zip, so it is ready as soon as the session ends"""
+        try:
+            if self.session_archive is None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                self.session_archive = SessionArchive(
+                    session_zip_path(self.zip_output_directory, self.current_email, timestamp),
+                    MAX_MESSAGE_SIZE)
+            self.session_archive.add(photo_path, compression)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to rename file: {str(e)}")
+            # The photo is added when the session is sent instead
+            print(f"Error adding {os.path.basename(photo_path)} to the session zip: {e}")
     
     def send_photos(self):
-        """Zip photos and send via Gmail, or archive if sending fails"""
-        if not self.photo_files or not self.current_email:
-            return
+        """Hand the current session to the background sender and start a new one"""
+        with self.session_lock:
+            if not self.photo_files or not self.current_email:
+                return
+            
+            session = send_pipeline.snapshot_session(self.current_email, self.photo_files,
+                                                     self.session_archive)
+            
+            # Reset for next session
+            self.photo_files = []
+            self.session_archive = None
+            self.file_counter = 0
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
         
-        try:
-            # Create zip file
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            zip_filename = f"photos_{self.current_email.split('@')[0]}_{timestamp}.zip"
-            zip_path = os.path.join(self.zip_output_directory, zip_filename)
+        self.sender.submit(session)
+    
+    def package_session(self, session, value, report):
+        """Finish the session's zip(s) (package stage)"""
+        # Finish the zip - the photos were added as they arrived, so this is quick
+        report(session, send_pipeline.ZIPPING)
+        photo_files = session.photo_files
+        if self.renditions:
+            # Rendering started as each photo came in, so this rarely has to wait
+            photo_files = self.renditions.collect(session.photo_files)
+        # A session merged with a later one after it was packaged comes back with its old zip(s)
+        archive = session.archive or (value[0] if value else None) or SessionArchive(
+            session_zip_path(self.zip_output_directory, session.recipient, session.timestamp),
+            MAX_MESSAGE_SIZE)
+        if value and value[0] is not archive:
+            value[0].discard()
+        parts = archive.finalize(photo_files)
+        return archive, parts
+    
+    def send_session(self, session, value, report):
+        """Send the zip(s) via Gmail, or archive the ones that fail (send stage)"""
+        archive, parts = value
+        
+        # Attempt to send email via Gmail API - the parts of a split session are sent side by side
+        report(session, send_pipeline.SENDING)
+        size = sum(os.path.getsize(part.path) for part in parts)
+        started = time.monotonic()
+        failures = send_pipeline.send_all(
+            parts, lambda part: self.send_email_with_attachment(session.recipient, part.path),
+            workers=PART_SEND_WORKERS)
+        if not failures:
+            report(session, send_pipeline.SENT)
+            self.drain_budget.live_finished(time.monotonic() - started, size)
             
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for photo in self.photo_files:
-                    zipf.write(photo, os.path.basename(photo))
+            # Sending works again - retry anything waiting in the outbox right away
+            if self.outbox.pending_count():
+                self.retrier.wake(retry_now=True)
             
-            # Attempt to send email via Gmail API
-            send_success = False
-            try:
-                self.send_email_with_attachment(self.current_email, zip_path)
-                send_success = True
-                
-                # If we were in storage mode but this send succeeded, try to recover
-                if self.storage_mode:
-                    self.status_label.config(
-                        text=f"Gmail API recovered! Sent to {self.current_email}. Check archive for unsent photos.",
-                        fg="green"
-                    )
-                    self.storage_mode = False
-                else:
-                    self.status_label.config(
-                        text=f"Sent {len(self.photo_files)} photos to {self.current_email}!", 
-                        fg="blue"
-                    )
-                
-            except Exception as e:
-                # Gmail API failed - enter storage mode
-                print(f"Gmail API Error: {str(e)}")
-                self.storage_mode = True
-                
-                # Archive the zip file with metadata
-                self.archive_unsent_photos(zip_path, self.current_email)
-                
-                self.status_label.config(
-                    text=f"Gmail API limit reached! Photos archived for {self.current_email}. Storage mode active.",
-                    fg="orange"
+            # If we were in storage mode but this send succeeded, try to recover
+            if self.storage_mode:
+                self.ui.post(
+                    SENT,
+                    text=f"Gmail API recovered! Sent to {session.recipient}. Retrying archived photos now.",
+                    fg="green"
                 )
-                
-                messagebox.showwarning(
+                self.storage_mode = False
+            else:
+                self.ui.post(
+                    SENT,
+                    text=f"Sent {len(session.photo_files)} photos to {session.recipient}"
+                         f"{f' in {len(parts)} emails' if len(parts) > 1 else ''}!", 
+                    fg="blue"
+                )
+            
+        else:
+            # Gmail API failed - enter storage mode
+            e = next(iter(failures.values()))
+            print(f"Gmail API Error: {str(e)}")
+            self.storage_mode = True
+            
+            # Archive the zips that were not sent with metadata and queue them for automatic retries
+            for part, error in failures.items():
+                archive_zip_path = self.archive_unsent_photos(part.path, session.recipient,
+                                                              part.photo_count)
+                if archive_zip_path:
+                    self.outbox.add(session.recipient, archive_zip_path, part.photo_count,
+                                    folder=os.path.dirname(archive_zip_path),
+                                    attempts=1, last_error=str(error),
+                                    next_retry_at=getattr(error, 'retry_at', None))
+            report(session, send_pipeline.ARCHIVED)
+            
+            self.ui.post(
+                ARCHIVED,
+                text=f"Gmail API limit reached! Photos archived for {session.recipient}. Storage mode active.",
+                fg="orange"
+            )
+            
+            # While the circuit breaker is open every session ends up here - don't pop up a dialog each time
+            if not isinstance(e, CircuitOpen):
+                self.ui.notify(
                     "Storage Mode Active",
                     f"Gmail API quota exceeded. Photos have been archived to:\n{self.archive_directory}\n\n"
-                    f"Email address and metadata saved. You'll need to manually send these later."
+                    f"Email address and metadata saved. They will be sent automatically once the Gmail API works again."
                 )
-            
-            # Clean up: delete original photos from watch directory
-            for photo in self.photo_files:
+        return archive
+    
+    def cleanup_session(self, session, archive, report):
+        """Remove the sent session's photos from the watch directory (cleanup stage)"""
+        # The originals are in the zip, so delete them from the watch directory.
+        # With delivery renditions they are kept next to the zip instead.
+        if self.renditions:
+            self.renditions.discard(session.photo_files)
+            keep_originals(session.photo_files, os.path.splitext(archive.zip_path)[0] + '_originals')
+        else:
+            for photo in session.photo_files:
                 try:
                     os.remove(photo)
                 except Exception as e:
                     print(f"Error deleting {photo}: {e}")
-            
-            # If send was successful, we can also delete the zip from output directory
-            # and keep only in the sent location, but let's keep it as specified
-            
-            # Reset for next session
-            self.photo_files = []
-            self.file_counter = 0
-            if self.timer:
-                self.timer.cancel()
-                self.timer = None
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to process photos: {str(e)}")
-            self.status_label.config(text=f"Error processing photos: {str(e)}", fg="red")
+        
+        # If send was successful, we can also delete the zip from output directory
+        # and keep only in the sent location, but let's keep it as specified
+    
+    def on_session_error(self, session, e):
+        """A pipeline stage failed for a session"""
+        self.ui.notify("Error", f"Failed to process photos: {str(e)}")
+        self.ui.post(ERROR, text=f"Error processing photos: {str(e)}", fg="red")
+    
+    def update_quota_label(self):
+        """Show how many emails can still be sent today (runs on the Tk thread)"""
+        if not self.accounts:
+            return
+        remaining = self.accounts.remaining()
+        daily_limit = self.accounts.daily_limit()
+        text = f"Emails left today: {remaining} of {daily_limit}"
+        if len(self.accounts.accounts) > 1:
+            text += f" ({len(self.accounts.accounts)} accounts"
+            cold = sum(1 for account in self.accounts.accounts if account.is_cold())
+            text += f", {cold} paused)" if cold else ")"
+        self.quota_label.config(text=text, fg="orange" if remaining < daily_limit // 10 else "gray")
+    
+    def on_send_progress(self, session, state):
+        """Show background send progress in the status bar"""
+        if state in (send_pipeline.QUEUED, send_pipeline.ZIPPING, send_pipeline.SENDING):
+            self.ui.post(
+                SENDING,
+                text=f"Sending photos to {session.recipient} in the background "
+                     f"({self.sender.pending()} session(s) in progress)..."
+            )
+        elif state == send_pipeline.MERGED:
+            self.ui.post(
+                SENDING,
+                text=f"More photos for {session.recipient} - they will be sent in the same email"
+            )
+    
+    def on_outbox_sent(self, entry):
+        """Move a batch delivered by the outbox retrier out of the archive (runs on the retrier)"""
+        folder = entry['folder']
+        if folder and os.path.isdir(folder):
+            sent_dir = os.path.join(os.path.dirname(folder), '_sent')
+            try:
+                os.makedirs(sent_dir, exist_ok=True)
+                shutil.move(folder, os.path.join(sent_dir, os.path.basename(folder)))
+                ArchiveManifest(os.path.dirname(folder)).mark_sent([os.path.basename(folder)])
+            except Exception as e:
+                print(f"Error moving {folder} to {sent_dir}: {e}")
+        
+        remaining = self.outbox.pending_count()
+        if not remaining:
+            self.storage_mode = False
+        self.ui.post(
+            SENT,
+            text=f"Delivered archived photos to {entry['recipient']} ({remaining} still waiting)", 
+            fg="green" if not remaining else "orange"
+        )
     
-    def archive_unsent_photos(self, zip_path, email_address):
-        """Archive unsent photos with metadata about recipient"""
+    def probe_mail_server(self):
+        """Cheap check that the Gmail API answers again (runs on the circuit breaker's probe thread)"""
+        if not self.accounts:
+            raise Exception("Gmail API is not set up")
+        account = self.accounts.accounts[0]
+        try:
+            account.client.service().users().getProfile(userId='me').execute()
+        except HttpError as e:
+            # The send-only scope isn't allowed to read the profile: Gmail answered and accepted
+            # the token, so it is reachable. Anything else (401 bad token, 429 rate limited,
+            # server errors) means sends would still fail.
+            details = f"{getattr(e, 'reason', '')} {e.error_details}".lower()
+            if e.resp.status != 403 or 'insufficient' not in details:
+                raise
+    
+    def on_breaker_change(self, state, error):
+        """The mail API went down or came back (runs on whichever thread noticed)"""
+        if state == OPEN:
+            self.storage_mode = True
+            self.ui.post(
+                ARCHIVED,
+                text="Gmail unreachable - photos are saved and will be sent automatically once it is back",
+                fg="orange"
+            )
+        elif state == HALF_OPEN:
+            # Let the outbox try one batch right away - if it works, sending is back to normal
+            self.retrier.wake(retry_now=True)
+        else:
+            self.ui.post(SENT, text="Gmail is working again!", fg="green")
+    
+    def archive_unsent_photos(self, zip_path, email_address, photo_count):
+        """Archive unsent photos with metadata about recipient - returns the archived zip path"""
         try:
             # Create a unique archive folder for this batch
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -309,6 +634,9 @@ class PhotoBoothApp:
                 self.archive_directory, 
                 f"unsent_{email_address.split('@')[0]}_{timestamp}"
             )
+            label = part_label(zip_path)
+            if label:
+                archive_batch_folder += '_' + label.replace(' ', '')  # e.g. _part2of3
             os.makedirs(archive_batch_folder, exist_ok=True)
             
             # Move zip file to archive
@@ -321,22 +649,39 @@ class PhotoBoothApp:
                 f.write(f"RECIPIENT EMAIL: {email_address}\n")
                 f.write(f"TIMESTAMP: {timestamp}\n")
                 f.write(f"ZIP FILE: {os.path.basename(zip_path)}\n")
-                f.write(f"NUMBER OF PHOTOS: {len(self.photo_files)}\n")
+                f.write(f"NUMBER OF PHOTOS: {photo_count}\n")
                 f.write(f"\nINSTRUCTIONS:\n")
                 f.write(f"Gmail API quota was exceeded when trying to send these photos.\n")
-                f.write(f"Please manually send the zip file to: {email_address}\n")
+                f.write(f"The photo booth retries these automatically while it is running.\n")
+                f.write(f"If it is closed for good, please manually send the zip file to: {email_address}\n")
+            
+            # Index it so the archive scripts don't have to scan every folder. The batch is
+            # archived either way (an unindexed folder is picked up when the manifest is read).
+            try:
+                ArchiveManifest(self.archive_directory).add(
+                    os.path.basename(archive_batch_folder), email_address, os.path.basename(zip_path),
+                    photo_count, "Gmail API", timestamp)
+            except Exception as e:
+                print(f"Error adding {archive_batch_folder} to the archive manifest: {str(e)}")
             
             print(f"Archived unsent photos to: {archive_batch_folder}")
+            return archive_zip_path
             
         except Exception as e:
             print(f"Error archiving photos: {str(e)}")
-            messagebox.showerror("Archive Error", f"Failed to archive photos: {str(e)}")
+            self.ui.notify("Archive Error", f"Failed to archive photos: {str(e)}")
+            return None
     
-    def send_email_with_attachment(self, to_email, attachment_path):
+    def send_email_with_attachment(self, to_email, attachment_path, message_id=None):
         """Send email using Gmail API with attachment - raises exception on failure"""
+        if not self.accounts:
+            raise Exception("Gmail API is not set up. Check credentials.json and restart.")
         
         # TODO: Customize your email subject here
         subject = "Your Photo Booth Pictures!"
+        label = part_label(attachment_path)
+        if label:
+            subject += f" ({label})"
         
         # TODO: Customize your email body here
         body = """Thank you for using our photo booth!
@@ -346,36 +691,24 @@ Your photos are attached to this email.
 Best regards,
 The Photo Booth Team"""
         
-        message = MIMEMultipart()
-        message['to'] = to_email
-        message['subject'] = subject
+        # The zip is read and encoded while uploading (in chunks for large zips), never loaded whole
+        message = StreamingMessage(None, to_email, subject, body, [attachment_path], message_id)
         
-        # Add body
-        from email.mime.text import MIMEText
-        message.attach(MIMEText(body, 'plain'))
+        def send(account):
+            # This will raise an exception if it fails (quota exceeded, network issues, etc.)
+            # or if the response has no message ID
+            return account.client.send(message)
         
-        # Add attachment
-        with open(attachment_path, 'rb') as f:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(f.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', 
-                          f'attachment; filename={os.path.basename(attachment_path)}')
-            message.attach(part)
-        
-        # Send the email
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        send_message = {'raw': raw_message}
-        
-        # This will raise an exception if it fails (quota exceeded, network issues, etc.)
-        result = self.gmail_service.users().messages().send(
-            userId='me', body=send_message).execute()
-        
-        # Verify we got a successful response
-        if not result or 'id' not in result:
-            raise Exception("Gmail API did not return a valid message ID")
+        # The router defers (QuotaExceeded) instead of sending if every account is at its limit.
+        # The breaker fails at once (CircuitOpen) while Gmail is known to be unreachable.
+        try:
+            account, result = self.breaker.call(self.accounts.send, send)
+        except QuotaExceeded:
+            self.ui.call(self.update_quota_label)
+            raise
         
-        print(f"Email sent successfully to {to_email}, message ID: {result['id']}")
+        print(f"Email sent successfully to {to_email} ({account.name}), message ID: {result['id']}")
+        self.ui.call(self.update_quota_label)
         return result
     
     def on_closing(self):
@@ -383,8 +716,19 @@ The Photo Booth Team"""
         if self.observer:
             self.observer.stop()
             self.observer.join()
+        self.ingest.stop()
+        if self.session_archive:
+            self.session_archive.close()  # Keep the unsent session's zip readable
+        self.sender.stop()  # Finish sessions that are still uploading
+        print(self.sender.summary())
+        if self.renditions:
+            self.renditions.shutdown()
+        self.retrier.stop()
+        self.breaker.stop()
+        self.outbox.close()
         if self.timer:
             self.timer.cancel()
+        self.ui.stop()
         self.root.destroy()
 
 
@@ -394,9 +738,13 @@ class PhotoEventHandler(FileSystemEventHandler):
         
     def on_created(self, event):
         if not event.is_directory and event.src_path.lower().endswith('.jpg'):
-            # Run in a separate thread to avoid blocking the observer
-            threading.Thread(target=self.app.handle_new_photo, 
-                           args=(event.src_path,)).start()
+            # Hand off to the ingest pool to avoid blocking the observer
+            self.app.ingest.submit(event.src_path)
+    
+    def on_closed(self, event):
+        # Close-after-write events (inotify IN_CLOSE_WRITE) mean the camera is done with the file
+        if not event.is_directory and event.src_path.lower().endswith('.jpg'):
+            self.app.file_ready.mark_closed(event.src_path)
 
 
 def main():
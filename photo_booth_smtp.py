@@ -8,14 +8,76 @@ from watchdog.events import FileSystemEventHandler
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import threading
-import zipfile
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
 import json
-from PIL import Image, ImageTk
+from PIL import ImageTk
+from photo_ingest import FileReadyDetector, IngestPool
+from renditions import RenditionService, keep_originals
+from ui_updates import UIUpdateBus, STATUS, CAPTURED, SENDING, SENT, ARCHIVED, ERROR
+import send_pipeline
+from session_zip import STORED, SessionArchive, choose_compression, part_label, session_zip_path
+from outbox import Outbox, OutboxRetrier
+from archive_drain import LatencyBudget, import_archive, ledger_send
+from archive_manifest import ArchiveManifest
+from send_quota import QuotaExceeded, QuotaTracker, SendLimiter, TokenBucket
+from smtp_pool import SMTPConnectionPool, is_account_error, is_connection_error
+from circuit_breaker import CircuitBreaker, CircuitOpen, OPEN, HALF_OPEN
+from mime_stream import StreamingMessage
+from sender_accounts import AccountRouter, SenderAccount
+from photo_preview import ThumbnailService
+
+# Seconds to wait for the camera to finish writing a photo before giving up on it
+FILE_READY_TIMEOUT = 10.0
+
+# Ingest stage: photos wait in a bounded queue for a fixed pool of workers.
+# When the queue is full the observer blocks (INGEST_BLOCK_WHEN_FULL = True)
+# or new photos are dropped (False).
+INGEST_WORKERS = 4
+INGEST_QUEUE_SIZE = 100
+INGEST_BLOCK_WHEN_FULL = True
+
+# Unsent batches are recorded here and retried automatically, even across restarts
+OUTBOX_DB = 'outbox.sqlite3'
+
+# Sending limits - sends are deferred to the outbox before these are hit
+# (per sender account - add more accounts to smtp_config.json to send more)
+DAILY_SEND_LIMIT = 500  # Gmail SMTP; use 2000 for Google Workspace
+SENDS_PER_MINUTE = 20
+SEND_BURST = 5
+QUOTA_FILE = 'send_quota_{account}.json'
+
+# Sessions are split into several emails that each stay under this size (after base64
+# encoding), unless smtp_config.json sets "max_message_size". Up to PART_SEND_WORKERS parts are sent at once.
+MAX_MESSAGE_SIZE = 25 * 1024 * 1024  # Gmail's limit
+PART_SEND_WORKERS = 3
+
+# A session for an email address whose previous session has not started sending yet
+# (e.g. the guest comes back) goes out in the same email. Sessions can also wait this
+# many seconds before they are sent, to catch more of those. 0 sends them right away.
+COALESCE_WINDOW = 0
+
+# Delivery renditions: email a resized copy of each photo instead of the camera original.
+# The originals are kept in a folder next to the session's zip. None sends the originals.
+DELIVERY_LONG_EDGE = None  # e.g. 2048 pixels
+DELIVERY_QUALITY = 85
+DELIVERY_PROGRESSIVE = True
+
+# Archived batches are retried in the background, but only while no guest's photos are
+# being sent and only if the retry should be done within LIVE_LATENCY_BUDGET seconds
+# (so a guest arriving meanwhile isn't held up much longer). Larger batches wait until
+# nobody has used the booth for DRAIN_QUIET_PERIOD seconds.
+LIVE_LATENCY_BUDGET = 30
+DRAIN_QUIET_PERIOD = 120
+
+# Mail server timeouts in seconds: for connecting, and for each reply once connected
+SMTP_CONNECT_TIMEOUT = 10
+SMTP_READ_TIMEOUT = 60
+
+# After BREAKER_FAILURE_THRESHOLD sends in a row fail because the mail server can't be reached,
+# sessions go straight to the outbox without trying. The mail server is probed every
+# BREAKER_PROBE_INTERVAL seconds and sending resumes once it answers.
+BREAKER_FAILURE_THRESHOLD = 2
+BREAKER_PROBE_INTERVAL = 15
 
 class PhotoBoothApp:
     def __init__(self, root):
@@ -31,20 +93,56 @@ class PhotoBoothApp:
         self.observer = None
         self.photo_files = []
         self.file_counter = 0
+        self.session_archive = None  # The current session's zip, filled as photos arrive
+        self.renditions = None  # Renders delivery copies as photos arrive (if DELIVERY_LONG_EDGE is set)
+        if DELIVERY_LONG_EDGE:
+            self.renditions = RenditionService(DELIVERY_LONG_EDGE, DELIVERY_QUALITY, DELIVERY_PROGRESSIVE)
         self.timer = None
         self.storage_mode = False  # Tracks if we're in fallback storage mode
+        self.file_ready = FileReadyDetector(timeout=FILE_READY_TIMEOUT)
+        self.session_lock = threading.RLock()  # Guards photo_files and file_counter
+        self.ingest = IngestPool(self.prepare_new_photo, self.handle_new_photo,
+                                 workers=INGEST_WORKERS, max_queued=INGEST_QUEUE_SIZE,
+                                 block_when_full=INGEST_BLOCK_WHEN_FULL)
         
         # SMTP configuration
         self.smtp_email = None
         self.smtp_password = None
         self.smtp_server = "smtp.gmail.com"
         self.smtp_port = 587
+        self.smtp_accounts = []  # Sender accounts from smtp_config.json
+        self.accounts = None  # Routes each email to the sender account with the most quota left
+        self.max_message_size = MAX_MESSAGE_SIZE
         
-        # Photo preview
+        # Photo preview - one thumbnail widget per photo in the current session
         self.photo_labels = []
+        self.preview_session = 0  # Bumped on reset so late thumbnails from old sessions are dropped
         
         self.load_smtp_config()
+        if self.smtp_accounts:
+            self.accounts = AccountRouter([self.create_sender_account(account)
+                                           for account in self.smtp_accounts], is_account_error)
+        # Package -> send -> cleanup, so the next session is zipped while the previous one uploads.
+        # One send worker per account so sessions upload in parallel.
+        send_workers = max(1, len(self.smtp_accounts))
+        self.sender = send_pipeline.SessionPipeline([
+            send_pipeline.Stage('package', self.package_session, workers=1),
+            send_pipeline.Stage('send', self.send_session, workers=send_workers,
+                                queue_size=2 * send_workers),
+            send_pipeline.Stage('cleanup', self.cleanup_session, workers=1),
+        ], on_progress=self.on_send_progress, on_error=self.on_session_error,
+           coalesce_window=COALESCE_WINDOW, merge_until='send')
         self.setup_ui()
+        self.ui = UIUpdateBus(self.root, self.status_label)
+        self.update_quota_label()
+        self.thumbnails = ThumbnailService(self.root)
+        self.breaker = CircuitBreaker(self.probe_mail_server, is_connection_error, BREAKER_FAILURE_THRESHOLD,
+                                      BREAKER_PROBE_INTERVAL, on_change=self.on_breaker_change)
+        self.outbox = Outbox(OUTBOX_DB)
+        self.drain_budget = LatencyBudget(LIVE_LATENCY_BUDGET, lambda: self.sender.pending() > 0,
+                                          DRAIN_QUIET_PERIOD)
+        self.retrier = OutboxRetrier(self.outbox, ledger_send(self.send_email_with_attachment),
+                                     on_sent=self.on_outbox_sent, throttle=self.drain_budget)
         
     def setup_ui(self):
         # Header
@@ -157,6 +255,10 @@ class PhotoBoothApp:
                                      relief=tk.SOLID, borderwidth=1)
         self.status_label.pack(fill=tk.X)
         
+        self.quota_label = tk.Label(status_frame, text="", font=("Arial", 9),
+                                    fg="#666", bg="#f0f0f0", anchor='e')
+        self.quota_label.pack(fill=tk.X)
+        
         # Check SMTP config on startup
         if not self.smtp_email or not self.smtp_password:
             self.status_label.config(
@@ -200,6 +302,7 @@ class PhotoBoothApp:
                 self.smtp_password = config.get('password')
                 self.smtp_server = config.get('server', 'smtp.gmail.com')
                 self.smtp_port = config.get('port', 587)
+                self.max_message_size = config.get('max_message_size', MAX_MESSAGE_SIZE)
                 print(config)
                 
                 # Check if still using template values
@@ -208,9 +311,30 @@ class PhotoBoothApp:
                     self.smtp_email = None
                     self.smtp_password = None
                 
+                # Extra sender accounts share the load once the main one is busy or out of quota
+                if self.smtp_email and self.smtp_password:
+                    self.smtp_accounts.append({'email': self.smtp_email, 'password': self.smtp_password,
+                                               'server': self.smtp_server, 'port': self.smtp_port})
+                for account in config.get('accounts', []):
+                    if account.get('email') and account.get('password'):
+                        self.smtp_accounts.append(account)
+                if self.smtp_accounts and not self.smtp_email:
+                    self.smtp_email = self.smtp_accounts[0]['email']
+                    self.smtp_password = self.smtp_accounts[0]['password']
+                
         except Exception as e:
             print(f"Error loading SMTP config: {e}")
     
+    def create_sender_account(self, account):
+        """Set up pooled connections and send limits for one sender account"""
+        limiter = SendLimiter(QuotaTracker(QUOTA_FILE.format(account=account['email']),
+                                           account.get('daily_limit', DAILY_SEND_LIMIT)),
+                              TokenBucket(SENDS_PER_MINUTE, burst=SEND_BURST))
+        # One connection per part that may be sent at the same time
+        return SenderAccount(account['email'], SMTPConnectionPool.from_config(
+            account, size=PART_SEND_WORKERS, timeout=SMTP_READ_TIMEOUT,
+            connect_timeout=SMTP_CONNECT_TIMEOUT), limiter)
+    
     def select_directory(self):
         directory = filedialog.askdirectory(title="Select Directory to Monitor")
         if directory:
@@ -230,6 +354,28 @@ class PhotoBoothApp:
             self.archive_directory = directory
             self.archive_label.config(text=f"...{directory[-30:]}", fg="black")
             
+            # Send whatever is already waiting in the archive in the background. Indexing
+            # a big archive can take a while, so it happens off the Tk thread too.
+            threading.Thread(target=self.load_archive, args=(directory,), name="archive-import",
+                             daemon=True).start()
+            
+    def load_archive(self, directory):
+        """Queue the archive's unsent batches for the retrier (runs on a worker thread)"""
+        try:
+            added = import_archive(self.outbox, directory)
+        except Exception as e:
+            print(f"Error reading archive {directory}: {e}")
+            self.ui.post(ERROR, text=f"Could not read the archive: {e}", fg="red")
+            return
+        if added:
+            self.storage_mode = True
+            self.retrier.wake()
+            self.ui.post(
+                ARCHIVED,
+                text=f"{added} archived batch(es) found - they will be sent between guests",
+                fg="orange"
+            )
+    
     def update_email(self):
         new_email = self.email_entry.get().strip()
         
@@ -241,13 +387,14 @@ class PhotoBoothApp:
             messagebox.showwarning("Warning", "Please enter a valid email address")
             return
         
-        # If email changed and we have pending photos, send them first
-        if self.current_email and self.current_email != new_email and self.photo_files:
-            self.status_label.config(text=f"Email changed. Sending photos to {self.current_email}...")
-            self.send_photos()
-        
-        self.current_email = new_email
-        self.status_label.config(text=f"Monitoring for: {self.current_email}")
+        with self.session_lock:
+            # If email changed and we have pending photos, send them in the background first
+            if self.current_email and self.current_email != new_email and self.photo_files:
+                self.ui.post(SENDING, text=f"Email changed. Sending photos to {self.current_email}...")
+                self.send_photos()
+            
+            self.current_email = new_email
+        self.ui.post(STATUS, text=f"Monitoring for: {self.current_email}")
         
     def start_monitoring(self):
         if self.observer:
@@ -258,7 +405,7 @@ class PhotoBoothApp:
         self.observer = Observer()
         self.observer.schedule(event_handler, self.watch_directory, recursive=False)
         self.observer.start()
-        self.status_label.config(text="Monitoring directory for new photos...")
+        self.ui.post(STATUS, text="Monitoring directory for new photos...")
         
     def reset_timer(self):
         """Reset the 20-second timer"""
@@ -272,172 +419,347 @@ class PhotoBoothApp:
     def on_timer_expire(self):
         """Called when 20 seconds pass with no new photos"""
         if self.photo_files:
-            self.status_label.config(text="Timer expired. Sending photos...")
+            self.ui.post(SENDING, text="Timer expired. Sending photos...")
             self.send_photos()
     
-    def update_photo_preview(self):
-        """Update the photo preview section with current photos"""
-        # Clear existing previews
+    def clear_photo_preview(self):
+        """Remove this session's thumbnails and show the placeholder"""
         for widget in self.preview_frame.winfo_children():
             widget.destroy()
+        self.photo_labels = []
         
-        if not self.photo_files:
-            tk.Label(self.preview_frame, text="No photos yet - waiting for captures...", 
-                    font=("Arial", 11), fg="gray", bg="white",
-                    padx=20, pady=20).pack()
+        tk.Label(self.preview_frame, text="No photos yet - waiting for captures...", 
+                font=("Arial", 11), fg="gray", bg="white",
+                padx=20, pady=20).pack()
+    
+    def add_photo_preview(self, photo_path, img, session):
+        """Append a decoded thumbnail to the preview strip (runs on the Tk thread)"""
+        if img is None or session != self.preview_session:
             return
         
-        # Display each photo as a thumbnail
-        for i, photo_path in enumerate(self.photo_files):
-            try:
-                # Create a frame for each photo
-                photo_container = tk.Frame(self.preview_frame, bg="white", 
-                                          relief=tk.SOLID, borderwidth=1,
-                                          padx=5, pady=5)
-                photo_container.pack(side=tk.LEFT, padx=5, pady=5)
-                
-                # Load and resize image
-                img = Image.open(photo_path)
-                img.thumbnail((150, 150), Image.Resampling.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
-                
-                # Keep a reference to prevent garbage collection
-                label = tk.Label(photo_container, image=photo, bg="white")
-                label.image = photo  # Keep reference!
-                label.pack()
-                
-                # Add filename label
-                filename = os.path.basename(photo_path)
-                tk.Label(photo_container, text=filename, font=("Arial", 8),
-                        bg="white", fg="#666").pack()
-                
-            except Exception as e:
-                print(f"Error loading preview for {photo_path}: {e}")
+        # First photo of the session replaces the placeholder
+        if not self.photo_labels:
+            for widget in self.preview_frame.winfo_children():
+                widget.destroy()
+        
+        try:
+            # Create a frame for the photo
+            photo_container = tk.Frame(self.preview_frame, bg="white", 
+                                      relief=tk.SOLID, borderwidth=1,
+                                      padx=5, pady=5)
+            photo_container.pack(side=tk.LEFT, padx=5, pady=5)
+            
+            photo = ImageTk.PhotoImage(img)
+            
+            # Keep a reference to prevent garbage collection
+            label = tk.Label(photo_container, image=photo, bg="white")
+            label.image = photo  # Keep reference!
+            label.pack()
+            
+            # Add filename label
+            filename = os.path.basename(photo_path)
+            tk.Label(photo_container, text=filename, font=("Arial", 8),
+                    bg="white", fg="#666").pack()
+            
+            # Thumbnails stay until the session resets, so each photo is decoded once
+            self.photo_labels.append(photo_container)
+            
+        except Exception as e:
+            print(f"Error loading preview for {photo_path}: {e}")
+    
+    def prepare_new_photo(self, filepath):
+        """Wait until the camera has finished writing the file (runs on an ingest worker)
+        
+        Returns how the photo should be compressed in the session zip, or False
+        """
+        if not self.file_ready.wait_until_ready(filepath):
+            self.ui.post(
+                ERROR,
+                text=f"Photo was not fully written in time: {os.path.basename(filepath)}", 
+                fg="red"
+            )
+            return False
+        try:
+            return choose_compression(filepath)
+        except OSError:
+            return STORED  # Storing is always safe, just not as small
     
-    def handle_new_photo(self, filepath):
-        """Handle a new photo file"""
+    def handle_new_photo(self, filepath, compression=None):
+        """Handle a new photo file (called by the ingest pool in capture order)"""
         if not self.current_email:
-            self.status_label.config(text="Please enter an email address first!", fg="red")
+            self.ui.post(ERROR, text="Please enter an email address first!", fg="red")
             return
         
         if not self.zip_output_directory:
-            self.status_label.config(text="Please select a zip output directory first!", fg="red")
+            self.ui.post(ERROR, text="Please select a zip output directory first!", fg="red")
             return
         
         if not self.archive_directory:
-            self.status_label.config(text="Please select an archive directory first!", fg="red")
+            self.ui.post(ERROR, text="Please select an archive directory first!", fg="red")
             return
         
         if not self.smtp_email or not self.smtp_password:
-            self.status_label.config(text="Please configure SMTP settings first!", fg="red")
+            self.ui.post(ERROR, text="Please configure SMTP settings first!", fg="red")
             return
         
-        # Extract username from email
-        username = self.current_email.split('@')[0]
-        
-        # Generate new filename with counter to avoid duplicates
-        self.file_counter += 1
-        new_filename = f"{username}_{self.file_counter}.jpg"
-        new_filepath = os.path.join(self.watch_directory, new_filename)
-        
-        # Wait a moment to ensure file is fully written
-        time.sleep(0.5)
-        
-        # Rename the file
-        try:
-            os.rename(filepath, new_filepath)
-            self.photo_files.append(new_filepath)
-            self.status_label.config(
-                text=f"✓ Captured photo {self.file_counter} for {self.current_email}", 
-                fg="green"
-            )
+        with self.session_lock:
+            # Extract username from email
+            username = self.current_email.split('@')[0]
             
-            # Update photo preview
-            self.update_photo_preview()
+            # Generate new filename with counter to avoid duplicates
+            self.file_counter += 1
+            new_filename = f"{username}_{self.file_counter}.jpg"
+            new_filepath = os.path.join(self.watch_directory, new_filename)
+            while os.path.exists(new_filepath):
+                self.file_counter += 1
+                new_filename = f"{username}_{self.file_counter}.jpg"
+                new_filepath = os.path.join(self.watch_directory, new_filename)
             
-            # Reset the 20-second timer
-            self.reset_timer()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to rename file: {str(e)}")
-    
-    def send_photos(self):
-        """Zip photos and send via SMTP, or archive if sending fails"""
-        if not self.photo_files or not self.current_email:
-            return
-        
-        try:
-            # Create zip file
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            zip_filename = f"photos_{self.current_email.split('@')[0]}_{timestamp}.zip"
-            zip_path = os.path.join(self.zip_output_directory, zip_filename)
-            
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for photo in self.photo_files:
-                    zipf.write(photo, os.path.basename(photo))
-            
-            # Attempt to send email via SMTP
-            send_success = False
+            # Rename the file
             try:
-                self.send_email_with_attachment(self.current_email, zip_path)
-                send_success = True
-                
-                # If we were in storage mode but this send succeeded, try to recover
-                if self.storage_mode:
-                    self.status_label.config(
-                        text=f"SMTP recovered! Sent to {self.current_email}. Check archive for unsent photos.",
-                        fg="green"
-                    )
-                    self.storage_mode = False
+                os.rename(filepath, new_filepath)
+                self.photo_files.append(new_filepath)
+                if self.renditions:
+                    self.renditions.submit(new_filepath)  # Zipped when the session is sent
                 else:
-                    self.status_label.config(
-                        text=f"Sent {len(self.photo_files)} photos to {self.current_email}!", 
-                        fg="blue"
-                    )
-                
-            except Exception as e:
-                # SMTP failed - enter storage mode
-                print(f"SMTP Error: {str(e)}")
-                self.storage_mode = True
-                
-                # Archive the zip file with metadata
-                self.archive_unsent_photos(zip_path, self.current_email)
-                
-                self.status_label.config(
-                    text=f"SMTP failed! Photos archived for {self.current_email}. Storage mode active.",
-                    fg="orange"
+                    self.add_to_session_archive(new_filepath, compression)
+                self.ui.post(
+                    CAPTURED,
+                    text=f"✓ Captured photo {self.file_counter} for {self.current_email}", 
+                    fg="green"
                 )
                 
-                messagebox.showwarning(
-                    "Storage Mode Active",
-                    f"SMTP sending failed. Photos have been archived to:\n{self.archive_directory}\n\n"
-                    f"Email address and metadata saved. You'll need to manually send these later.\n\n"
-                    f"Error: {str(e)}"
+                # Decode the thumbnail in the background, then add it to the preview strip
+                session = self.preview_session
+                self.thumbnails.request(
+                    new_filepath,
+                    lambda path, img: self.add_photo_preview(path, img, session)
                 )
+                
+                # Reset the 20-second timer
+                self.reset_timer()
+                
+            except Exception as e:
+                self.ui.notify("Error", f"Failed to rename file: {str(e)}")
+    
+    def add_to_session_archive(self, photo_path, compression=None):
+        """Append a photo to the session zip, so it is ready as soon as the session ends"""
+        try:
+            if self.session_archive is None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                self.session_archive = SessionArchive(
+                    session_zip_path(self.zip_output_directory, self.current_email, timestamp),
+                    self.max_message_size)
+            self.session_archive.add(photo_path, compression)
+        except Exception as e:
+            # The photo is added when the session is sent instead
+            print(f"Error adding {os.path.basename(photo_path)} to the session zip: {e}")
+    
+    def send_photos(self):
+        """Hand the current session to the background sender and start a new one"""
+        with self.session_lock:
+            if not self.photo_files or not self.current_email:
+                return
             
-            # Clean up: delete original photos from watch directory
-            for photo in self.photo_files:
-                try:
-                    os.remove(photo)
-                except Exception as e:
-                    print(f"Error deleting {photo}: {e}")
+            session = send_pipeline.snapshot_session(self.current_email, self.photo_files,
+                                                     self.session_archive)
             
             # Reset for next session
             self.photo_files = []
+            self.session_archive = None
             self.file_counter = 0
             if self.timer:
                 self.timer.cancel()
                 self.timer = None
             
             # Clear photo preview
-            self.update_photo_preview()
+            self.preview_session += 1
+            self.thumbnails.call_soon(self.clear_photo_preview)
+        
+        self.sender.submit(session)
+    
+    def package_session(self, session, value, report):
+        """Finish the session's zip(s) (package stage)"""
+        # Finish the zip - the photos were added as they arrived, so this is quick
+        report(session, send_pipeline.ZIPPING)
+        photo_files = session.photo_files
+        if self.renditions:
+            # Rendering started as each photo came in, so this rarely has to wait
+            photo_files = self.renditions.collect(session.photo_files)
+        # A session merged with a later one after it was packaged comes back with its old zip(s)
+        archive = session.archive or (value[0] if value else None) or SessionArchive(
+            session_zip_path(self.zip_output_directory, session.recipient, session.timestamp),
+            self.max_message_size)
+        if value and value[0] is not archive:
+            value[0].discard()
+        parts = archive.finalize(photo_files)
+        return archive, parts
+    
+    def send_session(self, session, value, report):
+        """Send the zip(s) via SMTP, or archive the ones that fail (send stage)"""
+        archive, parts = value
+        
+        # Attempt to send email via SMTP - the parts of a split session are sent side by side
+        report(session, send_pipeline.SENDING)
+        size = sum(os.path.getsize(part.path) for part in parts)
+        started = time.monotonic()
+        failures = send_pipeline.send_all(
+            parts, lambda part: self.send_email_with_attachment(session.recipient, part.path),
+            workers=PART_SEND_WORKERS)
+        if not failures:
+            report(session, send_pipeline.SENT)
+            self.drain_budget.live_finished(time.monotonic() - started, size)
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to process photos: {str(e)}")
-            self.status_label.config(text=f"Error processing photos: {str(e)}", fg="red")
+            # Sending works again - retry anything waiting in the outbox right away
+            if self.outbox.pending_count():
+                self.retrier.wake(retry_now=True)
+            
+            # If we were in storage mode but this send succeeded, try to recover
+            if self.storage_mode:
+                self.ui.post(
+                    SENT,
+                    text=f"SMTP recovered! Sent to {session.recipient}. Retrying archived photos now.",
+                    fg="green"
+                )
+                self.storage_mode = False
+            else:
+                self.ui.post(
+                    SENT,
+                    text=f"Sent {len(session.photo_files)} photos to {session.recipient}"
+                         f"{f' in {len(parts)} emails' if len(parts) > 1 else ''}!", 
+                    fg="blue"
+                )
+            
+        else:
+            # SMTP failed - enter storage mode
+            e = next(iter(failures.values()))
+            print(f"SMTP Error: {str(e)}")
+            self.storage_mode = True
+            
+            # Archive the zips that were not sent with metadata and queue them for automatic retries
+            for part, error in failures.items():
+                archive_zip_path = self.archive_unsent_photos(part.path, session.recipient,
+                                                              part.photo_count)
+                if archive_zip_path:
+                    self.outbox.add(session.recipient, archive_zip_path, part.photo_count,
+                                    folder=os.path.dirname(archive_zip_path),
+                                    attempts=1, last_error=str(error),
+                                    next_retry_at=getattr(error, 'retry_at', None))
+            report(session, send_pipeline.ARCHIVED)
+            
+            self.ui.post(
+                ARCHIVED,
+                text=f"SMTP failed! Photos archived for {session.recipient}. Storage mode active.",
+                fg="orange"
+            )
+            
+            # While the circuit breaker is open every session ends up here - don't pop up a dialog each time
+            if not isinstance(e, CircuitOpen):
+                self.ui.notify(
+                    "Storage Mode Active",
+                    f"SMTP sending failed. Photos have been archived to:\n{self.archive_directory}\n\n"
+                    f"Email address and metadata saved. They will be sent automatically once SMTP works again.\n\n"
+                    f"Error: {str(e)}"
+                )
+        return archive
     
-    def archive_unsent_photos(self, zip_path, email_address):
-        """Archive unsent photos with metadata about recipient"""
+    def cleanup_session(self, session, archive, report):
+        """Remove the sent session's photos from the watch directory (cleanup stage)"""
+        # The originals are in the zip, so delete them from the watch directory.
+        # With delivery renditions they are kept next to the zip instead.
+        if self.renditions:
+            self.renditions.discard(session.photo_files)
+            keep_originals(session.photo_files, os.path.splitext(archive.zip_path)[0] + '_originals')
+        else:
+            for photo in session.photo_files:
+                try:
+                    os.remove(photo)
+                except Exception as e:
+                    print(f"Error deleting {photo}: {e}")
+    
+    def on_session_error(self, session, e):
+        """A pipeline stage failed for a session"""
+        self.ui.notify("Error", f"Failed to process photos: {str(e)}")
+        self.ui.post(ERROR, text=f"Error processing photos: {str(e)}", fg="red")
+    
+    def update_quota_label(self):
+        """Show how many emails can still be sent today (runs on the Tk thread)"""
+        if not self.accounts:
+            return
+        remaining = self.accounts.remaining()
+        daily_limit = self.accounts.daily_limit()
+        text = f"Emails left today: {remaining} of {daily_limit}"
+        if len(self.accounts.accounts) > 1:
+            text += f" ({len(self.accounts.accounts)} accounts"
+            cold = sum(1 for account in self.accounts.accounts if account.is_cold())
+            text += f", {cold} paused)" if cold else ")"
+        self.quota_label.config(text=text, fg="orange" if remaining < daily_limit // 10 else "gray")
+    
+    def on_send_progress(self, session, state):
+        """Show background send progress in the status bar"""
+        if state in (send_pipeline.QUEUED, send_pipeline.ZIPPING, send_pipeline.SENDING):
+            self.ui.post(
+                SENDING,
+                text=f"Sending photos to {session.recipient} in the background "
+                     f"({self.sender.pending()} session(s) in progress)..."
+            )
+        elif state == send_pipeline.MERGED:
+            self.ui.post(
+                SENDING,
+                text=f"More photos for {session.recipient} - they will be sent in the same email"
+            )
+    
+    def on_outbox_sent(self, entry):
+        """Move a batch delivered by the outbox retrier out of the archive (runs on the retrier)"""
+        folder = entry['folder']
+        if folder and os.path.isdir(folder):
+            sent_dir = os.path.join(os.path.dirname(folder), '_sent')
+            try:
+                os.makedirs(sent_dir, exist_ok=True)
+                shutil.move(folder, os.path.join(sent_dir, os.path.basename(folder)))
+                ArchiveManifest(os.path.dirname(folder)).mark_sent([os.path.basename(folder)])
+            except Exception as e:
+                print(f"Error moving {folder} to {sent_dir}: {e}")
+        
+        remaining = self.outbox.pending_count()
+        if not remaining:
+            self.storage_mode = False
+        self.ui.post(
+            SENT,
+            text=f"Delivered archived photos to {entry['recipient']} ({remaining} still waiting)", 
+            fg="green" if not remaining else "orange"
+        )
+    
+    def probe_mail_server(self):
+        """Cheap check that the SMTP server answers again (runs on the circuit breaker's probe thread)"""
+        if not self.accounts:
+            raise Exception("SMTP is not configured")
+        error = None
+        for account in self.accounts.accounts:
+            try:
+                account.client.probe()
+                return
+            except Exception as e:
+                error = e
+        raise error
+    
+    def on_breaker_change(self, state, error):
+        """The mail server went down or came back (runs on whichever thread noticed)"""
+        if state == OPEN:
+            self.storage_mode = True
+            self.ui.post(
+                ARCHIVED,
+                text="Mail server unreachable - photos are saved and will be sent automatically once it is back",
+                fg="orange"
+            )
+        elif state == HALF_OPEN:
+            # Let the outbox try one batch right away - if it works, sending is back to normal
+            self.retrier.wake(retry_now=True)
+        else:
+            self.ui.post(SENT, text="Mail server is working again!", fg="green")
+    
+    def archive_unsent_photos(self, zip_path, email_address, photo_count):
+        """Archive unsent photos with metadata about recipient - returns the archived zip path"""
         try:
             # Create a unique archive folder for this batch
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -445,6 +767,9 @@ class PhotoBoothApp:
                 self.archive_directory, 
                 f"unsent_{email_address.split('@')[0]}_{timestamp}"
             )
+            label = part_label(zip_path)
+            if label:
+                archive_batch_folder += '_' + label.replace(' ', '')  # e.g. _part2of3
             os.makedirs(archive_batch_folder, exist_ok=True)
             
             # Move zip file to archive
@@ -457,23 +782,38 @@ class PhotoBoothApp:
                 f.write(f"RECIPIENT EMAIL: {email_address}\n")
                 f.write(f"TIMESTAMP: {timestamp}\n")
                 f.write(f"ZIP FILE: {os.path.basename(zip_path)}\n")
-                f.write(f"NUMBER OF PHOTOS: {len(self.photo_files)}\n")
+                f.write(f"NUMBER OF PHOTOS: {photo_count}\n")
                 f.write(f"METHOD: SMTP\n")
                 f.write(f"\nINSTRUCTIONS:\n")
                 f.write(f"SMTP sending failed when trying to send these photos.\n")
-                f.write(f"Please manually send the zip file to: {email_address}\n")
+                f.write(f"The photo booth retries these automatically while it is running.\n")
+                f.write(f"If it is closed for good, please manually send the zip file to: {email_address}\n")
+            
+            # Index it so the archive scripts don't have to scan every folder. The batch is
+            # archived either way (an unindexed folder is picked up when the manifest is read).
+            try:
+                ArchiveManifest(self.archive_directory).add(
+                    os.path.basename(archive_batch_folder), email_address, os.path.basename(zip_path),
+                    photo_count, "SMTP", timestamp)
+            except Exception as e:
+                print(f"Error adding {archive_batch_folder} to the archive manifest: {str(e)}")
             
             print(f"Archived unsent photos to: {archive_batch_folder}")
+            return archive_zip_path
             
         except Exception as e:
             print(f"Error archiving photos: {str(e)}")
-            messagebox.showerror("Archive Error", f"Failed to archive photos: {str(e)}")
+            self.ui.notify("Archive Error", f"Failed to archive photos: {str(e)}")
+            return None
     
-    def send_email_with_attachment(self, to_email, attachment_path):
+    def send_email_with_attachment(self, to_email, attachment_path, message_id=None):
         """Send email using SMTP with attachment - raises exception on failure"""
         
         # TODO: Customize your email subject here
         subject = "Your Photo Booth Pictures!"
+        label = part_label(attachment_path)
+        if label:
+            subject += f" ({label})"
         
         # TODO: Customize your email body here
         body = """Thank you for using our photo booth!
@@ -483,42 +823,29 @@ Your photos are attached to this email.
 Best regards,
 The Photo Booth Team"""
         
-        # Create message
-        message = MIMEMultipart()
-        message['From'] = self.smtp_email
-        message['To'] = to_email
-        message['Subject'] = subject
-        
-        # Add body
-        message.attach(MIMEText(body, 'plain'))
-        
-        # Add attachment
-        with open(attachment_path, 'rb') as f:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(f.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', 
-                          f'attachment; filename={os.path.basename(attachment_path)}')
-            message.attach(part)
-        
-        # Send the email via SMTP
+        if not self.accounts:
+            raise Exception("SMTP is not configured. Edit smtp_config.json with your credentials.")
+        
+        def send(account):
+            # Each account sends as itself, over its own pooled connections.
+            # The zip is read and encoded straight into the connection, never loaded whole.
+            message = StreamingMessage(account.client.email, to_email, subject, body, [attachment_path], message_id)
+            account.client.send_stream(message, account.client.email, [to_email])
+        
+        # The router defers (QuotaExceeded) instead of sending if every account is at its limit.
+        # The breaker fails at once (CircuitOpen) while the server is known to be down.
         try:
-            # Connect to SMTP server
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()  # Secure the connection
-            
-            # Login
-            server.login(self.smtp_email, self.smtp_password)
-            
-            # Send email
-            server.send_message(message)
+            account, _ = self.breaker.call(self.accounts.send, send)
             
-            # Close connection
-            server.quit()
-            
-            print(f"Email sent successfully to {to_email} via SMTP")
+            print(f"Email sent successfully to {to_email} via SMTP ({account.name})")
+            self.ui.call(self.update_quota_label)
             return True
             
+        except QuotaExceeded:
+            self.ui.call(self.update_quota_label)
+            raise
+        except CircuitOpen:
+            raise
         except smtplib.SMTPAuthenticationError:
             raise Exception("SMTP Authentication failed. Check your email and app password.")
         except smtplib.SMTPRecipientsRefused:
@@ -535,8 +862,23 @@ The Photo Booth Team"""
         if self.observer:
             self.observer.stop()
             self.observer.join()
+        self.ingest.stop()
+        if self.session_archive:
+            self.session_archive.close()  # Keep the unsent session's zip readable
+        self.sender.stop()  # Finish sessions that are still uploading
+        print(self.sender.summary())
+        if self.renditions:
+            self.renditions.shutdown()
+        self.retrier.stop()
+        self.breaker.stop()
+        self.outbox.close()
+        if self.accounts:
+            for account in self.accounts.accounts:
+                account.client.close()
         if self.timer:
             self.timer.cancel()
+        self.ui.stop()
+        self.thumbnails.shutdown()
         self.root.destroy()
 
 
@@ -546,9 +888,13 @@ class PhotoEventHandler(FileSystemEventHandler):
         
     def on_created(self, event):
         if not event.is_directory and event.src_path.lower().endswith('.jpg'):
-            # Run in a separate thread to avoid blocking the observer
-            threading.Thread(target=self.app.handle_new_photo, 
-                           args=(event.src_path,)).start()
+            # Hand off to the ingest pool to avoid blocking the observer
+            self.app.ingest.submit(event.src_path)
+    
+    def on_closed(self, event):
+        # Close-after-write events (inotify IN_CLOSE_WRITE) mean the camera is done with the file
+        if not event.is_directory and event.src_path.lower().endswith('.jpg'):
+            self.app.file_ready.mark_closed(event.src_path)
 
 
 def main():
@@ -0,0 +1,184 @@
+"""
+Helpers for ingesting photos that the camera drops into the watch directory.
+
+FileReadyDetector works out when a new .jpg has been completely written so
+it can be renamed without racing the camera. It uses close-after-write
+events where the platform provides them (watchdog's FileClosedEvent, which
+is inotify IN_CLOSE_WRITE on Linux) and falls back to polling the file size
+and modification time until they stop changing. In both cases the JPEG End
+Of Image marker must be present before the file is handed on.
+"""
+
+import os
+import queue
+import threading
+import time
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
+# Some cameras pad the file after the EOI marker, so look a little way back
+EOI_SEARCH_BYTES = 64
+
+# Close events that nobody has waited on yet are only kept for this many files
+MAX_PENDING_CLOSE_EVENTS = 256
+
+
+def has_jpeg_eoi(filepath):
+    """Check that a JPEG file starts with SOI and ends with the EOI marker"""
+    try:
+        with open(filepath, 'rb') as f:
+            if f.read(2) != JPEG_SOI:
+                return False
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size < 4:
+                return False
+            f.seek(max(2, size - EOI_SEARCH_BYTES))
+            tail = f.read()
+    except OSError:
+        return False
+    return tail.rstrip(b'\x00').endswith(JPEG_EOI)
+
+
+class FileReadyDetector:
+    def __init__(self, timeout=10.0, poll_interval=0.05, stable_polls=2):
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.stable_polls = stable_polls
+        self._closed_events = {}
+        self._lock = threading.Lock()
+
+    def _get_event(self, filepath):
+        key = os.path.normpath(filepath)
+        with self._lock:
+            event = self._closed_events.get(key)
+            if event is None:
+                event = threading.Event()
+                self._closed_events[key] = event
+                # Drop the oldest entries if close events pile up unclaimed
+                while len(self._closed_events) > MAX_PENDING_CLOSE_EVENTS:
+                    del self._closed_events[next(iter(self._closed_events))]
+            return event
+
+    def _forget(self, filepath):
+        with self._lock:
+            self._closed_events.pop(os.path.normpath(filepath), None)
+
+    def mark_closed(self, filepath):
+        """Record that the writer closed filepath (called from the observer thread)"""
+        self._get_event(filepath).set()
+
+    def wait_until_ready(self, filepath):
+        """Block until filepath is fully written - returns False on timeout or if it vanished"""
+        closed = self._get_event(filepath)
+        deadline = time.monotonic() + self.timeout
+        last_signature = None
+        stable_count = 0
+
+        try:
+            while True:
+                # Fast path: the writer closed the file, so only the EOI check remains
+                if closed.is_set():
+                    if has_jpeg_eoi(filepath):
+                        return True
+                    # Closed but incomplete - the camera may reopen it, keep polling
+                    closed.clear()
+
+                try:
+                    stat = os.stat(filepath)
+                except FileNotFoundError:
+                    return False
+
+                # Fallback: size and mtime unchanged for several polls in a row
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if signature == last_signature and stat.st_size > 0:
+                    stable_count += 1
+                else:
+                    stable_count = 0
+                    last_signature = signature
+
+                if stable_count >= self.stable_polls and has_jpeg_eoi(filepath):
+                    return True
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+
+                # Wakes up early if a close event arrives
+                closed.wait(min(self.poll_interval, remaining))
+        finally:
+            self._forget(filepath)
+
+
+class IngestPool:
+    """Bounded queue feeding a fixed pool of ingest workers.
+
+    Each photo goes through prepare_fn (e.g. waiting for the write to finish)
+    in parallel, then commit_fn (renaming/numbering) strictly in the order the
+    photos were submitted, so burst captures keep their capture order.
+    commit_fn(filepath, prepared) gets whatever prepare_fn returned, and is
+    skipped if that was falsy.
+    """
+
+    def __init__(self, prepare_fn, commit_fn, workers=4, max_queued=100, block_when_full=True):
+        self.prepare_fn = prepare_fn
+        self.commit_fn = commit_fn
+        self.block_when_full = block_when_full
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._submit_lock = threading.Lock()
+        self._turn = threading.Condition()
+        self._next_seq = 0
+        self._next_commit = 0
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f"ingest-{i + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, filepath):
+        """Queue a new photo - returns False if it was shed because the queue is full"""
+        with self._submit_lock:
+            try:
+                self._queue.put((self._next_seq, filepath), block=self.block_when_full)
+            except queue.Full:
+                self.dropped += 1
+                print(f"Ingest queue full, dropping {filepath}")
+                return False
+            self._next_seq += 1
+        return True
+
+    def stop(self):
+        """Stop the workers once the already queued photos are processed"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            seq, filepath = item
+
+            try:
+                ready = self.prepare_fn(filepath)
+            except Exception as e:
+                print(f"Error preparing {filepath}: {e}")
+                ready = False
+
+            # Wait for our turn so photos are committed in capture order
+            with self._turn:
+                while self._next_commit != seq:
+                    self._turn.wait()
+            try:
+                if ready:
+                    self.commit_fn(filepath, ready)
+            except Exception as e:
+                print(f"Error ingesting {filepath}: {e}")
+            finally:
+                with self._turn:
+                    self._next_commit += 1
+                    self._turn.notify_all()
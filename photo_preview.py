@@ -0,0 +1,182 @@
+"""
+Background thumbnail decoding for the photo preview strip.
+
+ThumbnailService decodes thumbnails on a small thread pool and keeps the
+results in a memory-bounded LRU cache. Finished thumbnails are handed to the
+Tk thread through a queue that is drained with root.after, so the UI never
+waits on JPEG decoding and Tk objects are only touched from the main loop.
+"""
+
+import io
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import ExifTags, Image
+
+THUMBNAIL_SIZE = (150, 150)
+
+
+# EXIF IFD1 tags locating the embedded JPEG thumbnail
+JPEG_INTERCHANGE_FORMAT = 0x0201
+JPEG_INTERCHANGE_FORMAT_LENGTH = 0x0202
+
+# Embedded thumbnails whose aspect ratio differs more than this are letterboxed
+ASPECT_TOLERANCE = 0.02
+
+# Cheapest first: embedded EXIF thumbnail, reduced-scale DCT decode, full decode
+THUMBNAIL_STRATEGIES = ('exif', 'draft', 'full')
+
+
+def _fit_size(image_size, size):
+    """Size of image_size scaled down to fit within size, keeping the aspect ratio"""
+    width, height = image_size
+    scale = min(size[0] / width, size[1] / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _exif_thumbnail(img, size):
+    """Return the embedded EXIF thumbnail if it is large enough and not letterboxed"""
+    exif_data = img.info.get('exif')
+    if not exif_data:
+        return None
+    
+    ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset = ifd1.get(JPEG_INTERCHANGE_FORMAT)
+    length = ifd1.get(JPEG_INTERCHANGE_FORMAT_LENGTH)
+    if not offset or not length:
+        return None
+    
+    # Offsets are relative to the TIFF header, which follows the "Exif\0\0" prefix
+    if exif_data.startswith(b'Exif\x00\x00'):
+        offset += 6
+    thumb = Image.open(io.BytesIO(exif_data[offset:offset + length]))
+    
+    target = _fit_size(img.size, size)
+    if thumb.width < target[0] or thumb.height < target[1]:
+        return None
+    photo_aspect = img.width / img.height
+    if abs(thumb.width / thumb.height - photo_aspect) > ASPECT_TOLERANCE * photo_aspect:
+        return None
+    
+    thumb.thumbnail(size, Image.Resampling.LANCZOS)
+    return thumb
+
+
+def load_thumbnail(photo_path, size=THUMBNAIL_SIZE, strategies=THUMBNAIL_STRATEGIES):
+    """Decode a photo and shrink it to fit within size, using the cheapest strategy that works"""
+    img = Image.open(photo_path)
+    
+    if 'exif' in strategies:
+        try:
+            thumb = _exif_thumbnail(img, size)
+            if thumb is not None:
+                img.close()
+                return thumb
+        except Exception as e:
+            print(f"Ignoring unreadable EXIF thumbnail in {photo_path}: {e}")
+    
+    # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale, still at least the target size
+    if 'draft' in strategies and img.format == 'JPEG':
+        img.draft('RGB', _fit_size(img.size, size))
+    elif 'full' not in strategies:
+        raise ValueError(f"No thumbnail strategy applies to {photo_path}")
+    
+    img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=None)
+    return img
+
+
+class ThumbnailCache:
+    """LRU cache of decoded thumbnails, bounded by the memory their pixels use"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_bytes(img):
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, key):
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        nbytes = self.image_bytes(img)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= self.image_bytes(old)
+            self._entries[key] = img
+            self.current_bytes += nbytes
+            # Evict least recently used thumbnails until we fit the budget
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self.image_bytes(evicted)
+
+
+class ThumbnailService:
+    def __init__(self, root, size=THUMBNAIL_SIZE, workers=2,
+                 cache_bytes=32 * 1024 * 1024, poll_ms=30, max_per_tick=4):
+        self.root = root
+        self.size = size
+        self.poll_ms = poll_ms
+        self.max_per_tick = max_per_tick  # Limits Tk work per drain to keep frame time flat
+        self.cache = ThumbnailCache(cache_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._ready = queue.Queue()
+        self._running = True
+        self.root.after(self.poll_ms, self._drain)
+
+    def request(self, photo_path, callback):
+        """Decode photo_path in the background - callback(photo_path, img) runs on the Tk thread
+
+        img is None if the photo could not be decoded.
+        """
+        self._executor.submit(self._load, photo_path, callback)
+
+    def call_soon(self, fn, *args):
+        """Run fn(*args) on the Tk thread, after thumbnails already handed over"""
+        self._ready.put((lambda *_: fn(*args), None, None))
+
+    def _load(self, photo_path, callback):
+        try:
+            stat = os.stat(photo_path)
+            key = (photo_path, stat.st_mtime_ns, stat.st_size)
+            img = self.cache.get(key)
+            if img is None:
+                img = load_thumbnail(photo_path, self.size)
+                img.load()
+                self.cache.put(key, img)
+        except Exception as e:
+            print(f"Error loading preview for {photo_path}: {e}")
+            img = None
+        self._ready.put((callback, photo_path, img))
+
+    def _drain(self):
+        """Hand finished thumbnails to their callbacks (runs on the Tk thread)"""
+        for _ in range(self.max_per_tick):
+            try:
+                callback, photo_path, img = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(photo_path, img)
+            except Exception as e:
+                print(f"Error showing preview for {photo_path}: {e}")
+
+        if self._running:
+            self.root.after(self.poll_ms, self._drain)
+
+    def shutdown(self):
+        """Stop draining and discard pending decodes"""
+        self._running = False
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,115 @@
+"""
+Delivery renditions: smaller copies of the photos for emailing.
+
+Guests look at their photos on a phone, so sending camera originals mostly
+wastes upload bandwidth on the venue Wi-Fi and eats into the provider's
+message size limit. RenditionService resizes each photo to a configurable
+long edge and re-encodes it as a (by default progressive) JPEG as soon as it
+is ingested, on a process pool with one worker per CPU, so the work runs in
+parallel and is usually finished before the session is sent. The originals
+are never modified.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+DEFAULT_LONG_EDGE = 2048
+DEFAULT_QUALITY = 85
+
+
+def _fit_size(image_size, long_edge):
+    """Size of image_size scaled down so its longer side is at most long_edge"""
+    width, height = image_size
+    scale = min(long_edge / max(width, height), 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render(src, dst, long_edge=DEFAULT_LONG_EDGE, quality=DEFAULT_QUALITY, progressive=True):
+    """Write a resized JPEG copy of src to dst (runs in a worker process) - returns dst"""
+    with Image.open(src) as img:
+        # JPEG only: let libjpeg decode at a reduced scale that is still at least the target size
+        img.draft('RGB', _fit_size(img.size, long_edge))
+        icc_profile = img.info.get('icc_profile')
+        img = ImageOps.exif_transpose(img)  # Bake in the rotation so every viewer shows it upright
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((long_edge, long_edge), Image.Resampling.LANCZOS)
+
+        exif = img.getexif()
+        tmp_path = dst + '.tmp'
+        img.save(tmp_path, 'JPEG', quality=quality, progressive=progressive, optimize=True,
+                 exif=exif.tobytes() if exif else b'', icc_profile=icc_profile)
+    os.replace(tmp_path, dst)
+    return dst
+
+
+def keep_originals(photo_paths, originals_directory):
+    """Move the original photos of a session out of the watch folder into originals_directory"""
+    os.makedirs(originals_directory, exist_ok=True)
+    for photo in photo_paths:
+        try:
+            shutil.move(photo, os.path.join(originals_directory, os.path.basename(photo)))
+        except Exception as e:
+            print(f"Error moving {photo} to {originals_directory}: {e}")
+
+
+class RenditionService:
+    def __init__(self, long_edge=DEFAULT_LONG_EDGE, quality=DEFAULT_QUALITY, progressive=True,
+                 workers=None):
+        self.long_edge = long_edge
+        self.quality = quality
+        self.progressive = progressive
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_renditions_')
+        self._executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self._futures = {}  # Original path -> Future for its rendition
+        self._lock = threading.Lock()
+
+    def submit(self, photo_path):
+        """Start rendering a photo in the background"""
+        dst = os.path.join(self.directory, os.path.splitext(os.path.basename(photo_path))[0] + '.jpg')
+        future = self._executor.submit(render, photo_path, dst, self.long_edge, self.quality,
+                                       self.progressive)
+        with self._lock:
+            self._futures[photo_path] = future
+
+    def collect(self, photo_paths, timeout=None):
+        """Wait for the renditions of photo_paths and return their paths
+
+        The original is used for any photo whose rendition failed (or was
+        never submitted), so a bad file never stops a session from being sent.
+        """
+        renditions = []
+        for photo in photo_paths:
+            with self._lock:
+                future = self._futures.get(photo)
+            if future is None:
+                renditions.append(photo)
+                continue
+            try:
+                renditions.append(future.result(timeout))
+            except Exception as e:
+                print(f"Sending the original of {os.path.basename(photo)}, rendition failed: {e}")
+                renditions.append(photo)
+        return renditions
+
+    def discard(self, photo_paths):
+        """Forget a sent session's photos and delete their renditions"""
+        for photo in photo_paths:
+            with self._lock:
+                future = self._futures.pop(photo, None)
+            if future is None or not future.done() or future.exception():
+                continue
+            try:
+                os.remove(future.result())
+            except OSError:
+                pass
+
+    def shutdown(self):
+        """Stop the worker processes and delete any renditions that are left"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -14,6 +14,18 @@ fi
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 cd "$SCRIPT_DIR"
 
+# With arguments, run without prompts (for cron/systemd), e.g.
+#   ./send_archived.sh --archive-dir /path/to/archive --backend smtp --json
+# See: python archive_cli.py --help
+if [ $# -gt 0 ]; then
+    if [ ! -d "$VENV_DIR" ]; then
+        echo "ERROR: Virtual environment not found!" >&2
+        exit 2
+    fi
+    source "$VENV_DIR/bin/activate"
+    exec python archive_cli.py "$@"
+fi
+
 echo "=================================================="
 echo "Send Archived Photos - Startup"
 echo "=================================================="
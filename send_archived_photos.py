@@ -3,7 +3,8 @@
 Helper script to send archived photos after Gmail API quota recovers.
 
 This script scans the archive directory for unsent photo batches and 
-allows you to send them via Gmail API.
+allows you to send them via Gmail API. Batches are sent on several threads
+at once (SEND_WORKERS), while the archive is still being scanned.
 
 Usage:
     python send_archived_photos.py
@@ -11,24 +12,37 @@ Usage:
 
 import os
 import sys
+import itertools
 from pathlib import Path
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
-import base64
 import json
 import shutil
+from gmail_sender import GmailSender, drain
+from mime_stream import StreamingMessage
+from session_zip import part_label
+from send_pipeline import coalesce_batches
+from archive_manifest import ArchiveManifest, message_id_for
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
+# Number of batches sent at the same time
+SEND_WORKERS = 4
 
-def setup_gmail_api():
-    """Set up Gmail API authentication"""
+# Batches for the same recipient are sent as one email while it stays under this size
+MAX_MESSAGE_SIZE = 25 * 1024 * 1024
+
+# Send to another server instead of Gmail, e.g. 'http://localhost:8080/' for a local test server
+GMAIL_API_ENDPOINT = None
+
+
+def setup_gmail_api(interactive=True):
+    """Set up Gmail API authentication - returns a GmailSender
+
+    Unless interactive, returns None instead of opening the browser for the
+    OAuth consent screen when there is no usable token.json.
+    """
     creds = None
     if os.path.exists('token.json'):
         with open('token.json', 'r') as token:
@@ -39,6 +53,10 @@ def setup_gmail_api():
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
+            if not interactive:
+                print("ERROR: token.json is missing or can't be refreshed. "
+                      "Run send_archived_photos.py without arguments once to sign in.")
+                return None
             if os.path.exists('credentials.json'):
                 flow = InstalledAppFlow.from_client_secrets_file(
                     'credentials.json', SCOPES)
@@ -50,34 +68,17 @@ def setup_gmail_api():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
     
-    return build('gmail', 'v1', credentials=creds)
+    return GmailSender(creds, api_endpoint=GMAIL_API_ENDPOINT)
 
 
-def read_metadata(folder_path):
-    """Read the SEND_TO.txt metadata file"""
-    metadata_path = os.path.join(folder_path, "SEND_TO.txt")
-    
-    if not os.path.exists(metadata_path):
-        return None
-    
-    metadata = {}
-    with open(metadata_path, 'r') as f:
-        for line in f:
-            if line.startswith("RECIPIENT EMAIL:"):
-                metadata['email'] = line.split(":", 1)[1].strip()
-            elif line.startswith("ZIP FILE:"):
-                metadata['zip_file'] = line.split(":", 1)[1].strip()
-            elif line.startswith("NUMBER OF PHOTOS:"):
-                metadata['photo_count'] = line.split(":", 1)[1].strip()
-    
-    return metadata
-
-
-def send_email_with_attachment(service, to_email, attachment_path):
-    """Send email using Gmail API with attachment"""
+def build_message(to_email, attachment_paths, message_id=None):
+    """Build the email with the zips attached (they are read and encoded while sending)"""
     
     # TODO: Customize your email subject here
     subject = "Your Photo Booth Pictures!"
+    label = part_label(attachment_paths[0]) if len(attachment_paths) == 1 else None
+    if label:
+        subject += f" ({label})"
     
     # TODO: Customize your email body here  
     body = """Thank you for using our photo booth!
@@ -87,53 +88,106 @@ Your photos are attached to this email.
 Best regards,
 The Photo Booth Team"""
     
-    message = MIMEMultipart()
-    message['to'] = to_email
-    message['subject'] = subject
-    
-    message.attach(MIMEText(body, 'plain'))
-    
-    # Add attachment
-    with open(attachment_path, 'rb') as f:
-        part = MIMEBase('application', 'octet-stream')
-        part.set_payload(f.read())
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', 
-                      f'attachment; filename={os.path.basename(attachment_path)}')
-        message.attach(part)
-    
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    send_message = {'raw': raw_message}
-    
-    result = service.users().messages().send(
-        userId='me', body=send_message).execute()
-    
-    if not result or 'id' not in result:
-        raise Exception("Gmail API did not return a valid message ID")
+    # Gmail fills in the From address
+    return StreamingMessage(None, to_email, subject, body, attachment_paths, message_id)
+
+
+def send_email_with_attachment(sender, to_email, attachment_paths, message_id=None):
+    """Send email using Gmail API with the zips attached - returns the message size in bytes"""
+    message = build_message(to_email, attachment_paths, message_id)
+    sender.send(message)
+    return message.size()
+
+
+def iter_archived_batches(archive_directory):
+    """Yield unsent photo batches from the archive manifest (rebuilt from the folders if needed)"""
+    if not os.path.exists(archive_directory):
+        return
     
-    return result
+    manifest = ArchiveManifest(archive_directory)
+    manifest.reindex()  # Pick up folders archived without a manifest entry
+    for entry in manifest.unsent():
+        yield {
+            'folder': os.path.join(archive_directory, entry['folder']),
+            'folder_name': entry['folder'],
+            'metadata': entry
+        }
 
 
 def find_archived_batches(archive_directory):
     """Find all unsent photo batches in the archive directory"""
-    batches = []
-    
     if not os.path.exists(archive_directory):
         print(f"Archive directory not found: {archive_directory}")
-        return batches
-    
-    for item in os.listdir(archive_directory):
-        item_path = os.path.join(archive_directory, item)
-        if os.path.isdir(item_path) and item.startswith('unsent_'):
-            metadata = read_metadata(item_path)
-            if metadata:
-                batches.append({
-                    'folder': item_path,
-                    'folder_name': item,
-                    'metadata': metadata
-                })
-    
-    return batches
+        return []
+    
+    return list(iter_archived_batches(archive_directory))
+
+
+def send_batches(sender, batches, sent_dir, workers=SEND_WORKERS, max_messages=None, on_sent=None):
+    """Send batches concurrently, one email per recipient where they fit, moving each sent
+    batch to sent_dir - returns DrainStats
+    
+    Every batch's delivery state is recorded in the archive manifest, so an
+    interrupted run picks up where it stopped when it is started again.
+    At most max_messages emails are sent (None: all). on_sent(group, error)
+    is called after each email, with the list of batches it contained.
+    """
+    
+    manifest = ArchiveManifest(os.path.dirname(sent_dir))
+    
+    def move_to_sent(folder_names):
+        moved = []
+        for folder_name in folder_names:
+            try:
+                shutil.move(os.path.join(manifest.archive_directory, folder_name),
+                            os.path.join(sent_dir, folder_name))
+                moved.append(folder_name)
+            except Exception as e:
+                print(f"        Sent, but could not move {folder_name} to {sent_dir}: {e}")
+        if moved:
+            manifest.mark_sent(moved)
+    
+    # An earlier run may have stopped after an email was delivered but before its folders were moved
+    delivered = [entry['folder'] for entry in manifest.delivered()]
+    if delivered:
+        print(f"Moving {len(delivered)} batch(es) delivered by an earlier run to {sent_dir}")
+        move_to_sent(delivered)
+    
+    def send_batch(group):
+        # Batches for the same recipient go out together in one email
+        folder_names = [batch['folder_name'] for batch in group]
+        zip_paths = []
+        for batch in group:
+            zip_path = os.path.join(batch['folder'], batch['metadata'].get('zip_file'))
+            if not os.path.exists(zip_path):
+                raise Exception(f"Zip file not found in {batch['folder_name']}!")
+            zip_paths.append(zip_path)
+        
+        # A resend after an interrupted run keeps the Message-ID the batches were in flight
+        # with (and the same batches always get the same one), so the recipient's mailbox
+        # can tell it is a duplicate
+        message_id = message_id_for([batch['metadata'] for batch in group])
+        manifest.mark_in_flight(folder_names, message_id)
+        size = send_email_with_attachment(sender, group[0]['metadata'].get('email'), zip_paths, message_id)
+        manifest.mark_delivered(folder_names)
+        return size
+    
+    def on_result(group, error):
+        email = group[0]['metadata'].get('email')
+        folder_names = ', '.join(batch['folder_name'] for batch in group)
+        if error:
+            print(f"FAILED  {email} ({folder_names}) - {str(error)}")
+            manifest.mark_failed([batch['folder_name'] for batch in group], error)
+        else:
+            print(f"SUCCESS {email} ({folder_names})")
+            
+            # Move the folders to 'sent' subdirectory
+            move_to_sent([batch['folder_name'] for batch in group])
+        if on_sent:
+            on_sent(group, error)
+    
+    groups = itertools.islice(coalesce_batches(batches, MAX_MESSAGE_SIZE), max_messages)
+    return drain(groups, send_batch, workers=workers, on_result=on_result)
 
 
 def main():
@@ -181,9 +235,9 @@ def main():
     
     # Set up Gmail API
     print("\nSetting up Gmail API...")
-    service = setup_gmail_api()
+    sender = setup_gmail_api()
     
-    if not service:
+    if not sender:
         print("Failed to set up Gmail API!")
         return
     
@@ -191,7 +245,8 @@ def main():
     batches_to_send = []
     
     if choice == '1':
-        batches_to_send = batches
+        # Re-scan while sending, so a large archive starts going out right away
+        batches_to_send = iter_archived_batches(archive_dir)
     elif choice == '2':
         batch_num = input(f"Enter batch number (1-{len(batches)}): ").strip()
         try:
@@ -213,48 +268,26 @@ def main():
     os.makedirs(sent_dir, exist_ok=True)
     
     # Send the batches
-    print(f"\nSending {len(batches_to_send)} batch(es)...")
+    print(f"\nSending {len(batches) if choice == '1' else 1} batch(es), "
+          f"{SEND_WORKERS} at a time...")
     print()
     
-    success_count = 0
-    fail_count = 0
-    
-    for batch in batches_to_send:
-        meta = batch['metadata']
-        email = meta.get('email')
-        zip_file = meta.get('zip_file')
-        zip_path = os.path.join(batch['folder'], zip_file)
-        
-        print(f"Sending to {email}... ", end='', flush=True)
-        
-        try:
-            if not os.path.exists(zip_path):
-                print(f"FAILED - Zip file not found!")
-                fail_count += 1
-                continue
-            
-            send_email_with_attachment(service, email, zip_path)
-            print("SUCCESS!")
-            success_count += 1
-            
-            # Move the folder to 'sent' subdirectory
-            sent_folder_path = os.path.join(sent_dir, os.path.basename(batch['folder']))
-            shutil.move(batch['folder'], sent_folder_path)
-            
-        except Exception as e:
-            print(f"FAILED - {str(e)}")
-            fail_count += 1
+    stats = send_batches(sender, batches_to_send, sent_dir)
     
     print()
     print("=" * 60)
-    print(f"Results: {success_count} sent, {fail_count} failed")
+    print(f"Results: {stats.summary()}")
     print("=" * 60)
     
-    if success_count > 0:
+    if stats.sent > 0:
         print(f"\nSent batches have been moved to: {sent_dir}")
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Command line arguments: run without prompts (see archive_cli.py)
+        import archive_cli
+        sys.exit(archive_cli.main(default_backend='gmail'))
     try:
         main()
     except KeyboardInterrupt:
@@ -3,7 +3,8 @@
 Helper script to send archived photos via SMTP after sending failures.
 
 This script scans the archive directory for unsent photo batches and 
-allows you to send them via SMTP.
+allows you to send them via SMTP. Batches are sent over several connections
+at once (SEND_CONCURRENCY), while the archive is still being scanned.
 
 Usage:
     python send_archived_photos_smtp.py
@@ -11,14 +12,23 @@ Usage:
 
 import os
 import sys
+import asyncio
+import itertools
 from pathlib import Path
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
 import json
 import shutil
+from async_smtp import REQUIRED_PYTHON, AsyncSMTPSender, drain
+from mime_stream import StreamingMessage
+from session_zip import part_label
+from send_pipeline import coalesce_batches
+from archive_manifest import ArchiveManifest, message_id_for
+
+# Number of batches sent at the same time (one SMTP connection each)
+SEND_CONCURRENCY = 4
+
+# Batches for the same recipient are sent as one email while it stays under this size
+# (unless smtp_config.json sets "max_message_size")
+MAX_MESSAGE_SIZE = 25 * 1024 * 1024
 
 def load_smtp_config():
     """Load SMTP configuration from file"""
@@ -36,11 +46,14 @@ def load_smtp_config():
         return None
 
 
-def send_email_with_attachment(smtp_config, to_email, attachment_path):
-    """Send email using SMTP with attachment"""
+def build_message(from_email, to_email, attachment_paths, message_id=None):
+    """Build the email with the zips attached (they are read and encoded while sending)"""
     
     # TODO: Customize your email subject here
     subject = "Your Photo Booth Pictures!"
+    label = part_label(attachment_paths[0]) if len(attachment_paths) == 1 else None
+    if label:
+        subject += f" ({label})"
     
     # TODO: Customize your email body here  
     body = """Thank you for using our photo booth!
@@ -50,77 +63,123 @@ Your photos are attached to this email.
 Best regards,
 The Photo Booth Team"""
     
-    # Create message
-    message = MIMEMultipart()
-    message['From'] = smtp_config['email']
-    message['To'] = to_email
-    message['Subject'] = subject
-    
-    # Add body
-    message.attach(MIMEText(body, 'plain'))
-    
-    # Add attachment
-    with open(attachment_path, 'rb') as f:
-        part = MIMEBase('application', 'octet-stream')
-        part.set_payload(f.read())
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', 
-                      f'attachment; filename={os.path.basename(attachment_path)}')
-        message.attach(part)
-    
-    # Send the email via SMTP
-    server = smtplib.SMTP(smtp_config.get('server', 'smtp.gmail.com'), 
-                          smtp_config.get('port', 587))
-    server.starttls()
-    server.login(smtp_config['email'], smtp_config['password'])
-    server.send_message(message)
-    server.quit()
-    
-    return True
+    return StreamingMessage(from_email, to_email, subject, body, attachment_paths, message_id)
 
 
-def read_metadata(folder_path):
-    """Read the SEND_TO.txt metadata file"""
-    metadata_path = os.path.join(folder_path, "SEND_TO.txt")
-    
-    if not os.path.exists(metadata_path):
-        return None
-    
-    metadata = {}
-    with open(metadata_path, 'r') as f:
-        for line in f:
-            if line.startswith("RECIPIENT EMAIL:"):
-                metadata['email'] = line.split(":", 1)[1].strip()
-            elif line.startswith("ZIP FILE:"):
-                metadata['zip_file'] = line.split(":", 1)[1].strip()
-            elif line.startswith("NUMBER OF PHOTOS:"):
-                metadata['photo_count'] = line.split(":", 1)[1].strip()
-            elif line.startswith("METHOD:"):
-                metadata['method'] = line.split(":", 1)[1].strip()
+async def send_email_with_attachment(sender, to_email, attachment_paths, message_id=None):
+    """Send email using SMTP with the zips attached - returns the message size in bytes"""
+    message = build_message(sender.email, to_email, attachment_paths, message_id)
+    await sender.send(message, sender.email, [to_email])
+    return message.size()
+
+
+def iter_archived_batches(archive_directory):
+    """Yield unsent photo batches from the archive manifest (rebuilt from the folders if needed)"""
+    if not os.path.exists(archive_directory):
+        return
     
-    return metadata
+    manifest = ArchiveManifest(archive_directory)
+    manifest.reindex()  # Pick up folders archived without a manifest entry
+    for entry in manifest.unsent():
+        yield {
+            'folder': os.path.join(archive_directory, entry['folder']),
+            'folder_name': entry['folder'],
+            'metadata': entry
+        }
 
 
 def find_archived_batches(archive_directory):
     """Find all unsent photo batches in the archive directory"""
-    batches = []
-    
     if not os.path.exists(archive_directory):
         print(f"Archive directory not found: {archive_directory}")
-        return batches
+        return []
     
-    for item in os.listdir(archive_directory):
-        item_path = os.path.join(archive_directory, item)
-        if os.path.isdir(item_path) and item.startswith('unsent_'):
-            metadata = read_metadata(item_path)
-            if metadata:
-                batches.append({
-                    'folder': item_path,
-                    'folder_name': item,
-                    'metadata': metadata
-                })
+    return list(iter_archived_batches(archive_directory))
+
+
+async def send_batches(smtp_config, batches, sent_dir, concurrency=SEND_CONCURRENCY, max_messages=None,
+                       on_sent=None):
+    """Send batches concurrently, one email per recipient where they fit, moving each sent
+    batch to sent_dir - returns DrainStats
+    
+    Every batch's delivery state is recorded in the archive manifest, so an
+    interrupted run picks up where it stopped when it is started again.
+    At most max_messages emails are sent (None: all). on_sent(group, error)
+    is called after each email, with the list of batches it contained.
+    """
+    sender = AsyncSMTPSender.from_config(smtp_config, concurrency=concurrency)
+    
+    manifest = ArchiveManifest(os.path.dirname(sent_dir))
+    
+    def move_to_sent(folder_names):
+        moved = []
+        for folder_name in folder_names:
+            try:
+                shutil.move(os.path.join(manifest.archive_directory, folder_name),
+                            os.path.join(sent_dir, folder_name))
+                moved.append(folder_name)
+            except Exception as e:
+                print(f"        Sent, but could not move {folder_name} to {sent_dir}: {e}")
+        if moved:
+            manifest.mark_sent(moved)
+    
+    # An earlier run may have stopped after an email was delivered but before its folders were moved
+    delivered = [entry['folder'] for entry in manifest.delivered()]
+    if delivered:
+        print(f"Moving {len(delivered)} batch(es) delivered by an earlier run to {sent_dir}")
+        move_to_sent(delivered)
+    
+    async def send_batch(group):
+        # Batches for the same recipient go out together in one email
+        folder_names = [batch['folder_name'] for batch in group]
+        zip_paths = []
+        for batch in group:
+            zip_path = os.path.join(batch['folder'], batch['metadata'].get('zip_file'))
+            if not os.path.exists(zip_path):
+                raise Exception(f"Zip file not found in {batch['folder_name']}!")
+            zip_paths.append(zip_path)
+        
+        # A resend after an interrupted run keeps the Message-ID the batches were in flight
+        # with (and the same batches always get the same one), so the recipient's mailbox
+        # can tell it is a duplicate
+        message_id = message_id_for([batch['metadata'] for batch in group])
+        await asyncio.to_thread(manifest.mark_in_flight, folder_names, message_id)
+        size = await send_email_with_attachment(sender, group[0]['metadata'].get('email'), zip_paths,
+                                                message_id)
+        await asyncio.to_thread(manifest.mark_delivered, folder_names)
+        return size
+    
+    def on_result(group, error):
+        email = group[0]['metadata'].get('email')
+        folder_names = ', '.join(batch['folder_name'] for batch in group)
+        if error:
+            print(f"FAILED  {email} ({folder_names}) - {str(error)}")
+            manifest.mark_failed([batch['folder_name'] for batch in group], error)
+        else:
+            print(f"SUCCESS {email} ({folder_names})")
+            
+            # Move the folders to 'sent' subdirectory
+            move_to_sent([batch['folder_name'] for batch in group])
+        if on_sent:
+            on_sent(group, error)
     
-    return batches
+    try:
+        groups = coalesce_batches(batches, smtp_config.get('max_message_size', MAX_MESSAGE_SIZE))
+        groups = itertools.islice(groups, max_messages)
+        return await drain(groups, send_batch, concurrency=concurrency, on_result=on_result)
+    finally:
+        await sender.close()
+
+
+def python_supported():
+    """Whether this Python can run the asyncio sender - prints why not"""
+    if sys.version_info >= REQUIRED_PYTHON:
+        return True
+    required = '.'.join(map(str, REQUIRED_PYTHON))
+    print(f"ERROR: Sending the archive over SMTP needs Python {required} or higher "
+          f"(this is {sys.version.split()[0]}).")
+    print("The photo booth app also retries archived batches on its own while it is running.")
+    return False
 
 
 def main():
@@ -129,6 +188,9 @@ def main():
     print("=" * 60)
     print()
     
+    if not python_supported():
+        return
+    
     # Load SMTP configuration
     print("Loading SMTP configuration...")
     smtp_config = load_smtp_config()
@@ -181,7 +243,8 @@ def main():
     batches_to_send = []
     
     if choice == '1':
-        batches_to_send = batches
+        # Re-scan while sending, so a large archive starts going out right away
+        batches_to_send = iter_archived_batches(archive_dir)
     elif choice == '2':
         batch_num = input(f"Enter batch number (1-{len(batches)}): ").strip()
         try:
@@ -203,48 +266,26 @@ def main():
     os.makedirs(sent_dir, exist_ok=True)
     
     # Send the batches
-    print(f"\nSending {len(batches_to_send)} batch(es)...")
+    print(f"\nSending {len(batches) if choice == '1' else 1} batch(es), "
+          f"{SEND_CONCURRENCY} at a time...")
     print()
     
-    success_count = 0
-    fail_count = 0
-    
-    for batch in batches_to_send:
-        meta = batch['metadata']
-        email = meta.get('email')
-        zip_file = meta.get('zip_file')
-        zip_path = os.path.join(batch['folder'], zip_file)
-        
-        print(f"Sending to {email}... ", end='', flush=True)
-        
-        try:
-            if not os.path.exists(zip_path):
-                print(f"FAILED - Zip file not found!")
-                fail_count += 1
-                continue
-            
-            send_email_with_attachment(smtp_config, email, zip_path)
-            print("SUCCESS!")
-            success_count += 1
-            
-            # Move the folder to 'sent' subdirectory
-            sent_folder_path = os.path.join(sent_dir, os.path.basename(batch['folder']))
-            shutil.move(batch['folder'], sent_folder_path)
-            
-        except Exception as e:
-            print(f"FAILED - {str(e)}")
-            fail_count += 1
+    stats = asyncio.run(send_batches(smtp_config, batches_to_send, sent_dir))
     
     print()
     print("=" * 60)
-    print(f"Results: {success_count} sent, {fail_count} failed")
+    print(f"Results: {stats.summary()}")
     print("=" * 60)
     
-    if success_count > 0:
+    if stats.sent > 0:
         print(f"\nSent batches have been moved to: {sent_dir}")
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Command line arguments: run without prompts (see archive_cli.py)
+        import archive_cli
+        sys.exit(archive_cli.main(default_backend='smtp'))
     try:
         main()
     except KeyboardInterrupt:
@@ -0,0 +1,355 @@
+"""
+Background send pipeline for the photo booth apps.
+
+When a guest's session ends the app takes an immutable SessionSnapshot
+(recipient, photo files, timestamp) and hands it to a SessionPipeline, so
+the Tk thread is free to accept the next guest's email while earlier
+sessions are still uploading. Photos are ingested and rendered as they
+arrive (IngestPool, RenditionService); after that a session goes through
+the pipeline's stages, e.g. package -> send -> cleanup.
+
+Every stage has its own worker threads and a bounded queue in front of it,
+so the next session can be packaged while the previous one is still
+uploading, and a slow stage holds back the stages before it instead of
+letting work pile up. metrics() reports how busy each stage is.
+
+A session that is still waiting in the pipeline when another session for
+the same recipient arrives (a guest coming back, or the operator
+re-entering the same address) takes that session's photos, so the guest
+gets one email instead of two - as long as the send stage has not picked
+it up yet. If it was already packaged it goes back to the first stage to
+be packaged again with the new photos. With a coalescing window, sessions
+are also held back for a few seconds before they enter the pipeline, to
+catch more of those. coalesce_batches() does the same for archived batches.
+
+A session that was split into several zips sends its parts with send_all().
+"""
+
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from archive_manifest import IN_FLIGHT
+from mime_stream import encoded_size
+
+# archive is the session's SessionArchive if its zip was built while photos arrived
+SessionSnapshot = namedtuple('SessionSnapshot', ['session_id', 'recipient', 'photo_files', 'timestamp', 'archive'],
+                             defaults=(None,))
+
+# Progress states reported for each session
+QUEUED = 'queued'
+ZIPPING = 'zipping'
+SENDING = 'sending'
+SENT = 'sent'
+ARCHIVED = 'archived'
+FAILED = 'failed'
+MERGED = 'merged'  # Merged into an earlier session for the same recipient
+
+FINISHED_STATES = (SENT, ARCHIVED, FAILED, MERGED)
+
+MESSAGE_OVERHEAD = 16 * 1024  # Headers, text part and MIME boundaries around the attachments
+
+_session_ids = itertools.count(1)
+
+# One step of the pipeline. fn(session, value, report) gets what the previous
+# stage's fn returned (None for the first stage, unless the session is going
+# round again after a merge) and returns the value for the next one.
+# queue_size bounds the queue in front of the stage (0: unbounded).
+Stage = namedtuple('Stage', ['name', 'fn', 'workers', 'queue_size'], defaults=(1, 0))
+
+
+def snapshot_session(recipient, photo_files, archive=None):
+    """Freeze the current session so it can be processed in the background"""
+    return SessionSnapshot(
+        session_id=next(_session_ids),
+        recipient=recipient,
+        photo_files=tuple(photo_files),
+        timestamp=datetime.now().strftime("%Y%m%d_%H%M%S"),
+        archive=archive,
+    )
+
+
+def normalize_recipient(address):
+    """The form of an email address used to decide whether two sessions go to the same guest"""
+    return address.strip().lower()
+
+
+def merge_sessions(first, second):
+    """One session with the photos of both, keeping the first one's id and timestamp
+
+    The first session's incremental zip (if any) is kept and the other
+    session's photos are added to it when it is finalized. The second zip is
+    deleted.
+    """
+    archive = first.archive or second.archive
+    if first.archive and second.archive:
+        second.archive.discard()
+    return first._replace(photo_files=first.photo_files + second.photo_files, archive=archive)
+
+
+def coalesce_batches(batches, max_message_bytes=None):
+    """Group archived batches by recipient - yields lists of batches to send as one email each
+
+    batches are dicts as made by iter_archived_batches() in the archive
+    scripts. Batches for the same recipient are grouped as long as their zips
+    still fit in one message of max_message_bytes together. Batches that were
+    in flight when an earlier run stopped keep the group (and Message-ID)
+    they were sent with. Every batch is read before the first group is
+    yielded.
+    """
+    in_flight = {}  # Message-ID -> batches
+    groups = {}  # Recipient -> list of (list of batches, encoded size)
+    for batch in batches:
+        message_id = batch['metadata'].get('message_id')
+        if batch['metadata'].get('status') == IN_FLIGHT and message_id:
+            in_flight.setdefault(message_id, []).append(batch)
+            continue
+        zip_path = os.path.join(batch['folder'], batch['metadata'].get('zip_file') or '')
+        size = encoded_size(os.path.getsize(zip_path)) if os.path.isfile(zip_path) else None
+        recipient_groups = groups.setdefault(normalize_recipient(batch['metadata'].get('email') or ''), [])
+        for group in recipient_groups:
+            if size is not None and group[1] is not None and (
+                    not max_message_bytes or group[1] + size + MESSAGE_OVERHEAD <= max_message_bytes):
+                group[0].append(batch)
+                group[1] += size
+                break
+        else:
+            recipient_groups.append([[batch], size])
+    yield from in_flight.values()
+    for recipient_groups in groups.values():
+        for group in recipient_groups:
+            yield group[0]
+
+
+def send_all(items, send_fn, workers=3):
+    """Run send_fn(item) for all items, up to `workers` at a time
+
+    Returns {item: exception} for the items that failed (empty if all were sent).
+    """
+    if len(items) == 1:
+        try:
+            send_fn(items[0])
+            return {}
+        except Exception as e:
+            return {items[0]: e}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items))), thread_name_prefix='send-part') as executor:
+        futures = [(item, executor.submit(send_fn, item)) for item in items]
+    failures = {}
+    for item, future in futures:
+        error = future.exception()
+        if error:
+            failures[item] = error
+    return failures
+
+
+class _StageRunner:
+    def __init__(self, stage):
+        self.stage = stage
+        self.queue = queue.Queue(maxsize=stage.queue_size)
+        self.threads = []
+        self.busy = 0  # Workers currently processing a session
+        self.done = 0
+        self.busy_seconds = 0.0
+
+
+class SessionPipeline:
+    """Runs session snapshots through a list of Stages.
+
+    report(session, state) records progress and calls on_progress(session,
+    state) from whichever thread made the change. If a stage raises,
+    on_error(session, error) is called, the session is reported FAILED and
+    it goes no further. A session counts as pending from submit() until it
+    has left the last stage (or failed), whatever states the stages report.
+
+    A session submitted while another one for the same recipient is still
+    waiting for the first stage, or for any later stage up to the one named
+    merge_until, is merged into the waiting one (reported MERGED). A merged
+    session that had already left the first stage is taken out of the queue
+    it was waiting in and runs through the stages again; this time the first
+    stage gets the value it returned for the session before, so it can
+    reuse or discard it. With coalesce_window (seconds), submitted sessions
+    also wait that long before they are queued at the first stage.
+    """
+
+    def __init__(self, stages, on_progress=None, on_error=None, coalesce_window=0, merge_until=None):
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.coalesce_window = coalesce_window
+        self._merge_index = [stage.name for stage in stages].index(merge_until) if merge_until else 0
+        self.progress = {}  # session_id -> latest state
+        self._active = set()  # Ids of the sessions submitted and not finished yet
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._held = {}  # Normalized recipient -> (session waiting for the window to close, timer)
+        # Normalized recipient -> (session, index of the stage whose queue it waits in, value for that stage)
+        # for sessions that can still be merged into
+        self._queued = {}
+        self._stale = {}  # session_id -> number of outdated copies of the session left in the queues
+        self._runners = [_StageRunner(stage) for stage in stages]
+        for index, runner in enumerate(self._runners):
+            for i in range(runner.stage.workers):
+                thread = threading.Thread(target=self._run, args=(index,),
+                                          name=f"{runner.stage.name}-worker-{i + 1}", daemon=True)
+                thread.start()
+                runner.threads.append(thread)
+
+    def submit(self, session):
+        """Queue a session at the first stage (after the coalescing window)"""
+        with self._lock:
+            self._active.add(session.session_id)
+        self.report(session, QUEUED)
+
+        key = normalize_recipient(session.recipient)
+        waiting = None
+        requeue = None
+        with self._lock:
+            held = self._held.get(key)
+            if held:
+                waiting = held[0]
+                self._held[key] = (merge_sessions(held[0], session), held[1])
+            elif key in self._queued:
+                waiting, index, value = self._queued[key]
+                merged = merge_sessions(waiting, session)
+                self._queued[key] = (merged, 0, value)
+                if index:
+                    # Already past the first stage - skip the copy waiting there and start over
+                    self._stale[waiting.session_id] = self._stale.get(waiting.session_id, 0) + 1
+                    requeue = (merged, value)
+            elif self.coalesce_window:
+                timer = threading.Timer(self.coalesce_window, self._release, args=(key,))
+                timer.daemon = True
+                self._held[key] = (session, timer)
+                timer.start()
+            else:
+                self._queued[key] = (session, 0, None)
+        if waiting:
+            print(f"Merged session {session.session_id} into session {waiting.session_id} for {session.recipient}")
+            self._finish(session)
+            self.report(session, MERGED)
+            if requeue:
+                self._runners[0].queue.put(requeue)
+        elif not self.coalesce_window:
+            self._runners[0].queue.put((session, None))
+
+    def _enqueue(self, key, session):
+        with self._lock:
+            self._queued[key] = (session, 0, None)
+        # The first stage picks up the latest merged version (see _run)
+        self._runners[0].queue.put((session, None))
+
+    def _release(self, key):
+        with self._lock:
+            held = self._held.pop(key, None)
+        if held:
+            self._enqueue(key, held[0])
+
+    def flush(self):
+        """Send every session that is waiting for its coalescing window now"""
+        with self._lock:
+            held, self._held = list(self._held.items()), {}
+        for key, (session, timer) in held:
+            timer.cancel()
+            self._enqueue(key, session)
+
+    def pending(self):
+        """Number of sessions queued or in progress"""
+        with self._lock:
+            return len(self._active)
+
+    def _finish(self, session):
+        with self._lock:
+            self._active.discard(session.session_id)
+
+    def report(self, session, state):
+        with self._lock:
+            self.progress[session.session_id] = state
+        if self.on_progress:
+            try:
+                self.on_progress(session, state)
+            except Exception as e:
+                print(f"Error reporting progress for session {session.session_id}: {e}")
+
+    def metrics(self):
+        """Occupancy of each stage: {name: {'workers', 'busy', 'queued', 'done', 'utilization'}}
+
+        utilization is the fraction of the stage's worker time spent
+        processing sessions since the pipeline started.
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self._lock:
+            return {runner.stage.name: {
+                'workers': runner.stage.workers,
+                'busy': runner.busy,
+                'queued': runner.queue.qsize(),
+                'done': runner.done,
+                'utilization': runner.busy_seconds / (elapsed * runner.stage.workers),
+            } for runner in self._runners}
+
+    def summary(self):
+        """One line per stage, for the log"""
+        return '\n'.join(f"{name}: {m['done']} done, {m['busy']}/{m['workers']} busy, "
+                         f"{m['queued']} queued, {m['utilization']:.0%} utilized"
+                         for name, m in self.metrics().items())
+
+    def stop(self):
+        """Finish the queued sessions, then stop the workers (one stage at a time)"""
+        self.flush()
+        for runner in self._runners:
+            for _ in runner.threads:
+                runner.queue.put(None)
+            for thread in runner.threads:
+                thread.join()
+
+    def _run(self, index):
+        runner = self._runners[index]
+        next_runner = self._runners[index + 1] if index + 1 < len(self._runners) else None
+        while True:
+            item = runner.queue.get()
+            if item is None:
+                break
+            session, value = item
+            key = normalize_recipient(session.recipient)
+            with self._lock:
+                if index and self._stale.get(session.session_id):
+                    # Merged with a later session after this copy was queued, the merged one is on its way
+                    self._stale[session.session_id] -= 1
+                    if not self._stale[session.session_id]:
+                        del self._stale[session.session_id]
+                    continue
+                queued = self._queued.get(key)
+                if queued and queued[0].session_id == session.session_id and queued[1] == index:
+                    # Later sessions for the same recipient may have been merged into it
+                    session = self._queued.pop(key)[0]
+                runner.busy += 1
+            started = time.monotonic()
+            try:
+                value = runner.stage.fn(session, value, self.report)
+                failed = False
+            except Exception as e:
+                failed = True
+                print(f"Error in {runner.stage.name} for session {session.session_id}: {e}")
+                if self.on_error:
+                    try:
+                        self.on_error(session, e)
+                    except Exception as e:
+                        print(f"Error reporting failure of session {session.session_id}: {e}")
+                self.report(session, FAILED)
+            finally:
+                with self._lock:
+                    runner.busy -= 1
+                    runner.done += 1
+                    runner.busy_seconds += time.monotonic() - started
+            if next_runner and not failed:
+                if index + 1 <= self._merge_index:
+                    with self._lock:
+                        # Still open to later sessions for the same recipient until the next stage takes it
+                        self._queued.setdefault(key, (session, index + 1, value))
+                # Blocks while the next stage is backed up
+                next_runner.queue.put((session, value))
+            else:
+                self._finish(session)
@@ -0,0 +1,150 @@
+"""
+Daily quota tracking and rate limiting for outgoing email.
+
+Gmail allows roughly 100 messages/day through the unverified Gmail API and
+500/day through SMTP (2,000 for Google Workspace). QuotaTracker remembers
+when each message was sent over a rolling 24 hour window and persists that
+to disk, so the count survives restarts. TokenBucket smooths out bursts to a
+per-minute rate. SendLimiter combines the two and raises QuotaExceeded
+*before* a send that would hit a limit, so the batch can be deferred to the
+outbox instead of burning a failed attempt against the provider.
+
+Both classes take a clock function so they can be driven by a simulated
+clock.
+"""
+
+import json
+import os
+import threading
+import time
+
+DAY = 24 * 60 * 60
+
+
+class QuotaExceeded(Exception):
+    """Raised instead of sending when a limit would be exceeded"""
+
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+class QuotaTracker:
+    def __init__(self, path, daily_limit, window=DAY, clock=time.time):
+        self.path = path
+        self.daily_limit = daily_limit
+        self.window = window
+        self.clock = clock
+        self._sent_at = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self._sent_at = sorted(float(t) for t in json.load(f).get('sent_at', []))
+        except Exception as e:
+            print(f"Error loading send quota from {self.path}: {e}")
+            self._sent_at = []
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'daily_limit': self.daily_limit, 'sent_at': self._sent_at}, f)
+        os.replace(tmp_path, self.path)
+
+    def _prune(self, now):
+        cutoff = now - self.window
+        while self._sent_at and self._sent_at[0] <= cutoff:
+            self._sent_at.pop(0)
+
+    def used(self):
+        """Messages sent in the last 24 hours"""
+        with self._lock:
+            self._prune(self.clock())
+            return len(self._sent_at)
+
+    def remaining(self):
+        return max(0, self.daily_limit - self.used())
+
+    def next_available_at(self):
+        """When the next send becomes possible (now if there is quota left)"""
+        with self._lock:
+            now = self.clock()
+            self._prune(now)
+            if len(self._sent_at) < self.daily_limit:
+                return now
+            # The oldest sends that push us over the limit have to age out first
+            return self._sent_at[len(self._sent_at) - self.daily_limit] + self.window
+
+    def record(self):
+        """Count one sent message"""
+        with self._lock:
+            now = self.clock()
+            self._prune(now)
+            self._sent_at.append(now)
+            try:
+                self._save()
+            except Exception as e:
+                print(f"Error saving send quota to {self.path}: {e}")
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst=1, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0  # Tokens per second
+        self.capacity = max(1, burst)
+        self.clock = clock
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available - otherwise return the seconds until one is"""
+        with self._lock:
+            self._refill(self.clock())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class SendLimiter:
+    """Daily quota plus per-minute rate limit in front of a send function"""
+
+    def __init__(self, quota, bucket=None, max_wait=10.0, sleep=time.sleep):
+        self.quota = quota
+        self.bucket = bucket
+        self.max_wait = max_wait
+        self.sleep = sleep
+
+    def acquire(self):
+        """Wait briefly for the rate limit, or raise QuotaExceeded if the send should be deferred"""
+        if self.quota.remaining() <= 0:
+            retry_at = self.quota.next_available_at()
+            raise QuotaExceeded(
+                f"Daily limit of {self.quota.daily_limit} emails reached", retry_at)
+
+        if self.bucket is None:
+            return
+        while True:
+            wait = self.bucket.try_acquire()
+            if wait <= 0:
+                return
+            if wait > self.max_wait:
+                raise QuotaExceeded("Sending too fast for the per-minute limit",
+                                    self.quota.clock() + wait)
+            self.sleep(wait)
+
+    def record(self):
+        self.quota.record()
+
+    def remaining(self):
+        return self.quota.remaining()
@@ -0,0 +1,131 @@
+"""
+Spread outgoing email over several sender accounts.
+
+A single Gmail account caps a busy event at a few hundred guests per day.
+AccountRouter holds a list of SenderAccounts (SMTP credentials or Gmail
+OAuth tokens, each with its own quota tracker) and sends every message
+through the healthy account with the most quota left. An account that fails
+with an authentication or quota error is marked cold for a while and the
+message moves on to the next account. Per-account stats are kept for the UI.
+"""
+
+import threading
+import time
+
+from send_quota import QuotaExceeded
+
+# How long an account is skipped after an auth or quota error
+COLD_SECONDS = 15 * 60
+
+
+class SenderAccount:
+    def __init__(self, name, client, limiter):
+        self.name = name
+        self.client = client  # SMTPConnectionPool or GmailSender
+        self.limiter = limiter
+        self.lock = threading.Lock()  # For clients that are not thread-safe
+        self.cold_until = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.last_error = None
+        self.last_used = 0.0
+
+    def is_cold(self, now=None):
+        return (time.time() if now is None else now) < self.cold_until
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'sent': self.sent,
+            'failed': self.failed,
+            'remaining': self.limiter.remaining(),
+            'cold': self.is_cold(),
+            'last_error': self.last_error,
+        }
+
+
+class AccountRouter:
+    """Sends through the healthiest account with the most remaining quota.
+
+    is_account_error(e) decides whether a failure is the account's fault
+    (bad credentials, quota exhausted) rather than the network's.
+    """
+
+    def __init__(self, accounts, is_account_error, cold_seconds=COLD_SECONDS):
+        if not accounts:
+            raise ValueError("At least one sender account is required")
+        self.accounts = list(accounts)
+        self.is_account_error = is_account_error
+        self.cold_seconds = cold_seconds
+        self._lock = threading.Lock()
+
+    def _pick(self, exclude):
+        now = time.time()
+        with self._lock:
+            candidates = [a for a in self.accounts
+                          if a not in exclude and not a.is_cold(now) and a.limiter.remaining() > 0]
+            if not candidates:
+                return None
+            # Most quota left first, least recently used breaks ties
+            account = max(candidates, key=lambda a: (a.limiter.remaining(), -a.last_used))
+            account.last_used = now
+            return account
+
+    def mark_cold(self, account, error):
+        account.cold_until = time.time() + self.cold_seconds
+        print(f"Sender account {account.name} is cold for {self.cold_seconds // 60} minutes: {error}")
+
+    def _next_available_at(self):
+        times = []
+        for account in self.accounts:
+            available_at = account.limiter.quota.next_available_at()
+            times.append(max(available_at, account.cold_until))
+        return min(times)
+
+    def send(self, send_fn):
+        """Call send_fn(account) on the best account, moving on to the next one on account errors
+
+        Returns (account, result). Raises QuotaExceeded when no account can send.
+        """
+        tried = set()
+        last_error = None
+        while True:
+            account = self._pick(tried)
+            if account is None:
+                message = "No sender account has quota left or is healthy"
+                if last_error is not None:
+                    message += f" (last error: {last_error})"
+                raise QuotaExceeded(message, self._next_available_at())
+            tried.add(account)
+
+            try:
+                account.limiter.acquire()
+            except QuotaExceeded as e:
+                last_error = e
+                continue
+
+            try:
+                result = send_fn(account)
+            except Exception as e:
+                account.failed += 1
+                account.last_error = str(e)
+                if not self.is_account_error(e):
+                    raise
+                self.mark_cold(account, e)
+                last_error = e
+                continue
+
+            account.limiter.record()
+            account.sent += 1
+            account.last_error = None
+            return account, result
+
+    def remaining(self):
+        """Quota left today across all accounts that are not cold"""
+        return sum(a.limiter.remaining() for a in self.accounts if not a.is_cold())
+
+    def daily_limit(self):
+        return sum(a.limiter.quota.daily_limit for a in self.accounts)
+
+    def stats(self):
+        return [account.stats() for account in self.accounts]
@@ -0,0 +1,227 @@
+"""
+Session zip that is built while the guest is still taking photos.
+
+Zipping after the session timer fires adds the time it takes to copy every
+photo into the archive to the guest's wait. SessionArchive opens the zip
+when the first photo of a session arrives and the ingest path appends each
+photo as soon as it has been renamed. When the session closes only the
+central directory is left to write, so the upload can start right away.
+
+Each member is stored or compressed depending on how well a sample of it
+compresses: JPEGs (already compressed) are stored, text and other
+compressible files are deflated. Sampling can run in parallel, e.g. on the
+ingest workers; zipfile only supports one writer, so the members
+themselves are written one at a time.
+
+Email providers reject messages over a size limit (about 25 MB for Gmail,
+after base64 encoding). Given max_message_bytes, SessionArchive starts a
+new part whenever the next photo would push the current one over the limit,
+so a long session ends up as photos_user_ts_part1of3.zip, ..._part2of3.zip
+and so on, each of which can be sent on its own.
+"""
+
+import os
+import re
+import threading
+import zipfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from mime_stream import encoded_size
+
+# Compression policy
+SAMPLE_BYTES = 64 * 1024  # Size of each of the (up to) 3 samples taken from a file
+MIN_SAVING = 0.05  # Store members that shrink by less than 5%
+GOOD_SAVING = 0.30  # Members that shrink by at least this get the slower, better level
+DEFLATE_LEVEL = 6
+FAST_DEFLATE_LEVEL = 1
+# LZMA compresses better, but the zips can't be opened by Windows Explorer or
+# the macOS Archive Utility, which is what most guests use
+USE_LZMA = False
+
+STORED = (zipfile.ZIP_STORED, None)
+
+# Size estimates for splitting
+ZIP_ENTRY_OVERHEAD = 30 + 46 + 64  # Local header + central directory entry (+ room for extra fields)
+ZIP_END_RECORD = 22
+MESSAGE_OVERHEAD = 16 * 1024  # Headers, text part and MIME boundaries around the attachment
+
+# One zip of a session: where it is and how many photos are in it
+ZipPart = namedtuple('ZipPart', ['path', 'photo_count'])
+
+_PART_NAME = re.compile(r'_part(\d+)of(\d+)\.zip$')
+
+
+def estimate_saving(path):
+    """Fraction of the file that deflate would save, estimated from samples"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0.0
+    with open(path, 'rb') as f:
+        if size <= 3 * SAMPLE_BYTES:
+            samples = [f.read()]
+        else:
+            samples = []
+            for offset in (0, (size - SAMPLE_BYTES) // 2, size - SAMPLE_BYTES):
+                f.seek(offset)
+                samples.append(f.read(SAMPLE_BYTES))
+    raw = sum(len(sample) for sample in samples)
+    compressed = sum(len(zlib.compress(sample, 1)) for sample in samples)
+    return max(0.0, 1 - compressed / raw)
+
+
+def choose_compression(path):
+    """(compress_type, compresslevel) for a zip member, based on how well it compresses"""
+    saving = estimate_saving(path)
+    if saving < MIN_SAVING:
+        return STORED
+    if saving >= GOOD_SAVING:
+        if USE_LZMA:
+            return (zipfile.ZIP_LZMA, None)
+        return (zipfile.ZIP_DEFLATED, DEFLATE_LEVEL)
+    return (zipfile.ZIP_DEFLATED, FAST_DEFLATE_LEVEL)
+
+
+def plan_compression(paths, workers=4):
+    """choose_compression() for several files at once - returns {path: (compress_type, compresslevel)}"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(choose_compression, paths)))
+
+
+def session_zip_path(zip_output_directory, recipient, timestamp):
+    """Where the zip for a session goes"""
+    return os.path.join(zip_output_directory, f"photos_{recipient.split('@')[0]}_{timestamp}.zip")
+
+
+def part_path(zip_path, number, total=None):
+    """photos_user_ts.zip -> photos_user_ts_part2of3.zip (or _part2.zip while the total is unknown)"""
+    base, ext = os.path.splitext(zip_path)
+    return f"{base}_part{number}{f'of{total}' if total else ''}{ext}"
+
+
+def part_label(zip_path):
+    """'part 2 of 3' for a zip that is one part of a session, otherwise None"""
+    match = _PART_NAME.search(os.path.basename(zip_path))
+    return f"part {match.group(1)} of {match.group(2)}" if match else None
+
+
+def fits_in_message(zip_bytes, max_message_bytes):
+    """Whether a zip of zip_bytes can be attached to a message of at most max_message_bytes"""
+    return encoded_size(zip_bytes) + MESSAGE_OVERHEAD <= max_message_bytes
+
+
+class _Part:
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path, 'w')
+        self.photos = []
+        self.size = ZIP_END_RECORD  # Estimated size of the finished zip
+
+    def close(self):
+        if self.zip is not None:
+            zip_file, self.zip = self.zip, None
+            zip_file.close()
+
+
+class SessionArchive:
+    def __init__(self, zip_path, max_message_bytes=None):
+        self.zip_path = zip_path
+        self.max_message_bytes = max_message_bytes  # None: never split
+        self._parts = []
+        self._added = set()  # Photo paths already in the archive
+        self._broken = False
+        self._finalized = False
+        self._lock = threading.Lock()
+
+    def _new_part(self):
+        if self._parts:
+            self._parts[-1].close()  # Finished - write its central directory now
+        number = len(self._parts) + 1
+        part = _Part(self.zip_path if number == 1 else part_path(self.zip_path, number))
+        self._parts.append(part)
+        return part
+
+    def _write(self, photo_path, compression=None):
+        compress_type, compresslevel = compression or choose_compression(photo_path)
+        arcname = os.path.basename(photo_path)
+        entry_overhead = ZIP_ENTRY_OVERHEAD + 2 * len(arcname.encode())
+        part = self._parts[-1] if self._parts else self._new_part()
+        if (self.max_message_bytes and part.photos and not fits_in_message(
+                part.size + os.path.getsize(photo_path) + entry_overhead, self.max_message_bytes)):
+            part = self._new_part()
+        part.zip.write(photo_path, arcname, compress_type, compresslevel)
+        part.photos.append(photo_path)
+        part.size += part.zip.infolist()[-1].compress_size + entry_overhead
+        self._added.add(photo_path)
+        if self.max_message_bytes and not fits_in_message(part.size, self.max_message_bytes):
+            print(f"{arcname} is too large to send by email even on its own")
+
+    def add(self, photo_path, compression=None):
+        """Append a photo to the archive, opening it (or its next part) as needed
+
+        compression is a (compress_type, compresslevel) pair from
+        choose_compression(), which is called here if it is not given.
+        """
+        with self._lock:
+            try:
+                self._write(photo_path, compression)
+            except Exception:
+                self._broken = True
+                raise
+
+    def finalize(self, photo_files):
+        """Finish the archive with exactly photo_files in it and return its ZipParts
+
+        Photos that could not be appended earlier are added now. If appending
+        failed part way through, the zip is rebuilt from scratch. A session
+        that did not need splitting is a single part at zip_path. Finalizing
+        again (e.g. with photos merged in from a later session) rebuilds it.
+        """
+        with self._lock:
+            if self._broken or self._finalized:
+                self._discard()
+            missing = [photo for photo in photo_files if photo not in self._added]
+            plan = plan_compression(missing) if len(missing) > 1 else {}
+            for photo in missing:
+                self._write(photo, plan.get(photo))
+            if not self._parts:
+                self._new_part()  # An empty session still gets a valid (empty) zip
+            for part in self._parts:
+                part.close()
+
+            total = len(self._parts)
+            if total > 1:
+                for number, part in enumerate(self._parts, 1):
+                    final_path = part_path(self.zip_path, number, total)
+                    os.replace(part.path, final_path)
+                    part.path = final_path
+            self._finalized = True
+            return [ZipPart(part.path, len(part.photos)) for part in self._parts]
+
+    def close(self):
+        """Write the central directory so whatever is in the archive stays readable"""
+        with self._lock:
+            for part in self._parts:
+                try:
+                    part.close()
+                except Exception as e:
+                    print(f"Error closing {part.path}: {e}")
+
+    def discard(self):
+        """Close the archive and delete its zip file(s), e.g. when the session was merged into another"""
+        with self._lock:
+            self._discard()
+
+    def _discard(self):
+        for part in self._parts:
+            try:
+                part.close()
+            except Exception:
+                pass
+            if os.path.exists(part.path):
+                os.remove(part.path)
+        self._parts = []
+        self._added = set()
+        self._broken = False
+        self._finalized = False
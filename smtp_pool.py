@@ -0,0 +1,224 @@
+"""
+Persistent, authenticated SMTP connections shared by the photo booth senders.
+
+Opening a connection costs a TCP connect, EHLO, STARTTLS (a full TLS
+handshake) and AUTH before the first byte of the message is sent. The pool
+keeps authenticated sessions open between messages, checks connections that
+have been idle for a while with NOOP, reconnects transparently when the
+server has dropped us, and retires a connection after a fixed number of
+messages so long-lived sessions don't hit server-side limits.
+
+Connecting gives up after connect_timeout seconds, so an unreachable server
+fails fast; once connected, a reply (or a write of the message) may take up
+to timeout seconds.
+
+Used by photo_booth_smtp.py. is_account_error()
+tells sender_accounts.AccountRouter when to move on to the next account, and
+is_connection_error() tells the circuit breaker that the server is down.
+"""
+
+import smtplib
+import threading
+import time
+
+from circuit_breaker import is_network_error
+from mime_stream import smtp_data_chunks
+
+
+class _PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    def __init__(self, server, port, email, password, size=1, max_messages_per_connection=50,
+                 keepalive_interval=30.0, timeout=60, starttls=True, connect_timeout=10):
+        self.server = server
+        self.port = port
+        self.email = email
+        self.password = password
+        self.max_messages_per_connection = max_messages_per_connection
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout  # Read/write timeout once connected
+        self.connect_timeout = connect_timeout
+        self.starttls = starttls
+        self.handshakes = 0  # Number of connections opened (connect + TLS + login)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @classmethod
+    def from_config(cls, smtp_config, **kwargs):
+        """Create a pool from a loaded smtp_config.json dictionary"""
+        return cls(smtp_config.get('server', 'smtp.gmail.com'), smtp_config.get('port', 587),
+                   smtp_config['email'], smtp_config['password'], **kwargs)
+
+    def _open(self):
+        """Connect (giving up after connect_timeout), then switch to the read/write timeout"""
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.connect_timeout)
+        smtp.timeout = self.timeout
+        smtp.sock.settimeout(self.timeout)
+        return smtp
+
+    def _connect(self):
+        smtp = self._open()
+        try:
+            if self.starttls:
+                smtp.starttls()  # Secure the connection
+            if self.password:
+                smtp.login(self.email, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self._lock:
+            self.handshakes += 1
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _is_alive(self, conn):
+        """Probe an idle connection with NOOP"""
+        try:
+            return conn.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _checkout(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            return self._connect()
+        if time.monotonic() - conn.last_used > self.keepalive_interval and not self._is_alive(conn):
+            self._close(conn.smtp)
+            return self._connect()
+        return conn
+
+    def _checkin(self, conn):
+        conn.last_used = time.monotonic()
+        if conn.messages_sent >= self.max_messages_per_connection:
+            self._close(conn.smtp)
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    def run(self, fn):
+        """Call fn(smtp) on a pooled connection, reconnecting once if the server dropped us"""
+        with self._slots:
+            conn = self._checkout()
+            try:
+                try:
+                    result = fn(conn.smtp)
+                except smtplib.SMTPServerDisconnected:
+                    self._close(conn.smtp)
+                    conn = None
+                    conn = self._connect()
+                    result = fn(conn.smtp)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # The server rejected this message but the session is still usable
+                if conn is not None:
+                    conn.messages_sent += 1
+                    self._checkin(conn)
+                raise
+            except Exception:
+                if conn is not None:
+                    self._close(conn.smtp)
+                raise
+            conn.messages_sent += 1
+            self._checkin(conn)
+            return result
+
+    def send_message(self, message, from_addr=None, to_addrs=None):
+        """Send an email.message.Message over a pooled connection"""
+        return self.run(lambda smtp: smtp.send_message(message, from_addr, to_addrs))
+
+    def send_stream(self, message, from_addr, to_addrs):
+        """Send a mime_stream message over a pooled connection without building it in memory"""
+        return self.run(lambda smtp: _send_stream(smtp, message, from_addr, to_addrs))
+
+    def probe(self):
+        """Check that the server answers EHLO and NOOP on a new connection - raises if it doesn't
+
+        Doesn't log in, so it is cheap enough to run every few seconds.
+        """
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.connect_timeout)
+        try:
+            code, resp = smtp.ehlo()
+            if code != 250:
+                raise smtplib.SMTPHeloError(code, resp)
+            code, resp = smtp.noop()
+            if code != 250:
+                raise smtplib.SMTPResponseException(code, resp)
+        finally:
+            self._close(smtp)
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn.smtp)
+
+
+def _rset(smtp):
+    try:
+        smtp.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def _send_stream(smtp, message, from_addr, to_addrs):
+    """Like smtplib.SMTP.sendmail(), but writes the DATA section chunk by chunk"""
+    smtp.ehlo_or_helo_if_needed()
+    options = [f"SIZE={message.size()}"] if smtp.does_esmtp and smtp.has_extn('size') else []
+    code, resp = smtp.mail(from_addr, options)
+    if code != 250:
+        _rset(smtp)
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for addr in to_addrs:
+        code, resp = smtp.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+    if len(refused) == len(to_addrs):
+        _rset(smtp)
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    smtp.putcmd("data")
+    code, resp = smtp.getreply()
+    if code != 354:
+        _rset(smtp)
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in smtp_data_chunks(message):
+        smtp.send(chunk)
+    code, resp = smtp.getreply()
+    if code != 250:
+        _rset(smtp)
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+def is_connection_error(e):
+    """True if a send failed because the server could not be reached or stopped answering"""
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    # Any other SMTPException means the server answered, it just didn't like this message
+    return is_network_error(e)
+
+
+def is_account_error(e):
+    """True if a send failed because of the sender account (login, sending limit), not the network"""
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException):
+        # Gmail answers "550 5.4.5 Daily user sending limit exceeded" once an account is out of quota
+        error = e.smtp_error.decode(errors='replace') if isinstance(e.smtp_error, bytes) else str(e.smtp_error)
+        error = error.lower()
+        return '5.4.5' in error or 'sending limit' in error or 'quota' in error
+    return False
@@ -50,7 +50,7 @@ echo ""
 # Check if Python is installed
 if ! command -v python3 &> /dev/null; then
     echo "ERROR: Python 3 is not installed!"
-    echo "Please install Python 3.7 or higher"
+    echo "Please install Python 3.9 or higher"
     exit 1
 fi
 
@@ -75,6 +75,11 @@ else
     echo "If you need a specific version, install it and update config.env"
 fi
 
+if ! $PYTHON_CMD -c 'import sys; sys.exit(sys.version_info < (3, 9))'; then
+    echo "ERROR: Python 3.9 or higher is required ($PYTHON_CMD is $($PYTHON_CMD --version 2>&1))"
+    exit 1
+fi
+
 echo ""
 
 # Create virtual environment if it doesn't exist
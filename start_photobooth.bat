@@ -50,7 +50,7 @@ REM Check if Python is installed
 python --version >nul 2>&1
 if errorlevel 1 (
     echo ERROR: Python is not installed or not in PATH!
-    echo Please install Python 3.7 or higher from python.org
+    echo Please install Python 3.9 or higher from python.org
     pause
     exit /b 1
 )
@@ -75,6 +75,13 @@ if not errorlevel 1 (
     echo If you need a specific version, install it and it will be auto-detected
 )
 
+%PYTHON_CMD% -c "import sys; sys.exit(sys.version_info < (3, 9))"
+if errorlevel 1 (
+    echo ERROR: Python 3.9 or higher is required
+    pause
+    exit /b 1
+)
+
 echo.
 
 REM Create virtual environment if it doesn't exist
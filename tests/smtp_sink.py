@@ -0,0 +1,102 @@
+"""
+A small SMTP server on localhost for the tests: accepts every message and
+counts what the client did. No STARTTLS, so clients connect with
+starttls=False.
+"""
+
+import socketserver
+import threading
+import time
+
+
+class SMTPSink:
+    """Accepts mail on 127.0.0.1:port until close()
+
+    delay: seconds to wait before accepting each message.
+    mail_reply: answer MAIL FROM with this line instead of 250 (e.g. '550 ...').
+    drop_after: close the connection after this many messages on it.
+    """
+
+    def __init__(self, delay=0, mail_reply=None, drop_after=None):
+        self.delay = delay
+        self.mail_reply = mail_reply
+        self.drop_after = drop_after
+        self.connections = 0
+        self.ehlos = 0
+        self.auths = 0
+        self.noops = 0
+        self.messages = []
+        self.lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', 0), _handler(self))
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def config(self, email='booth@example.com'):
+        """A smtp_config.json dictionary pointing at this sink"""
+        return {'server': '127.0.0.1', 'port': self.port, 'email': email, 'password': 'secret'}
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _handler(sink):
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode() + b'\r\n')
+
+        def handle(self):
+            sink.count('connections')
+            self.reply('220 sink ESMTP')
+            sent = 0
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command = line.decode(errors='replace').strip().upper()
+                if command.startswith('EHLO'):
+                    sink.count('ehlos')
+                    self.wfile.write(b'250-sink\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 100000000\r\n')
+                elif command.startswith('HELO'):
+                    self.reply('250 sink')
+                elif command.startswith('AUTH'):
+                    sink.count('auths')
+                    self.reply('235 2.7.0 Accepted')
+                elif command.startswith('MAIL') and sink.mail_reply:
+                    self.reply(sink.mail_reply)
+                elif command.startswith('NOOP'):
+                    sink.count('noops')
+                    self.reply('250 OK')
+                elif command.startswith(('MAIL', 'RCPT', 'RSET')):
+                    self.reply('250 OK')
+                elif command == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    data = []
+                    for line in self.rfile:
+                        if line == b'.\r\n':
+                            break
+                        data.append(line)
+                    if sink.delay:
+                        time.sleep(sink.delay)
+                    with sink.lock:
+                        sink.messages.append(b''.join(data))
+                    self.reply('250 OK queued')
+                    sent += 1
+                    if sink.drop_after and sent >= sink.drop_after:
+                        return
+                elif command == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('500 Unknown command')
+    return Handler
@@ -0,0 +1,121 @@
+"""
+The non-interactive archive command line against a local SMTP sink: exit
+codes, --dry-run, --max-messages and --since.
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from unittest import mock
+
+import archive_cli
+import send_archived_photos_smtp
+from archive_manifest import ArchiveManifest
+from async_smtp import AsyncSMTPSender
+
+from tests.smtp_sink import SMTPSink
+
+BATCHES = 4
+
+
+class ArchiveCLITest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_archive_')
+        self.sink = SMTPSink()
+        manifest = ArchiveManifest(self.directory)
+        self.folders = []
+        for i in range(BATCHES):
+            folder = f'unsent_guest{i}_2024010{i + 1}_120000'
+            os.makedirs(os.path.join(self.directory, folder))
+            with open(os.path.join(self.directory, folder, 'photos.zip'), 'wb') as f:
+                f.write(os.urandom(1024))
+            manifest.add(folder, f'guest{i}@example.com', 'photos.zip', 3, 'SMTP',
+                         timestamp=f'2024010{i + 1}_120000')
+            self.folders.append(folder)
+
+        # The sink has no STARTTLS, and smtp_config.json would be read from the working directory
+        def plain_sender(smtp_config, **kwargs):
+            return AsyncSMTPSender(smtp_config['server'], smtp_config['port'], smtp_config['email'],
+                                   smtp_config['password'], starttls=False, **kwargs)
+
+        patches = [mock.patch.object(send_archived_photos_smtp, 'load_smtp_config', return_value=self.sink.config()),
+                   mock.patch.object(AsyncSMTPSender, 'from_config', plain_sender)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.sink.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_cli(self, *args):
+        """(exit code, JSON summary)"""
+        output = io.StringIO()
+        with redirect_stdout(output), mock.patch('sys.stderr', io.StringIO()):
+            code = archive_cli.main(['--archive-dir', self.directory, '--json', *args])
+        summary = json.loads(output.getvalue())
+        self.assertEqual(summary['exit_code'], code)
+        return code, summary
+
+    def unsent(self):
+        return sorted(entry['folder'] for entry in ArchiveManifest(self.directory).unsent())
+
+    def test_sends_everything(self):
+        code, summary = self.run_cli()
+        self.assertEqual(code, archive_cli.EXIT_OK)
+        self.assertEqual((summary['sent'], summary['failed']), (BATCHES, 0))
+        self.assertEqual(len(self.sink.messages), BATCHES)
+        self.assertEqual(self.unsent(), [])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, '_sent'))), self.folders)
+
+    def test_dry_run_sends_nothing(self):
+        code, summary = self.run_cli('--dry-run')
+        self.assertEqual(code, archive_cli.EXIT_OK)
+        self.assertEqual([result['status'] for result in summary['results']], ['would_send'] * BATCHES)
+        self.assertEqual(self.sink.connections, 0)
+        self.assertEqual(self.unsent(), self.folders)
+
+    def test_max_messages(self):
+        code, summary = self.run_cli('--max-messages', '2')
+        self.assertEqual(code, archive_cli.EXIT_OK)
+        self.assertEqual(summary['sent'], 2)
+        self.assertEqual(len(self.sink.messages), 2)
+        self.assertEqual(len(self.unsent()), BATCHES - 2)
+
+    def test_since_with_utc_offset(self):
+        # An aware --since is compared with the archive's local timestamps
+        since = datetime(2024, 1, 3, 12, 0).astimezone().astimezone(timezone.utc)
+        code, summary = self.run_cli('--dry-run', '--since', since.isoformat())
+        self.assertEqual(code, archive_cli.EXIT_OK)
+        self.assertEqual([result['folders'] for result in summary['results']], [[self.folders[2]], [self.folders[3]]])
+
+    def test_send_failures(self):
+        self.sink.mail_reply = '550 5.7.1 Rejected'
+        code, summary = self.run_cli()
+        self.assertEqual(code, archive_cli.EXIT_SEND_FAILED)
+        self.assertEqual((summary['sent'], summary['failed']), (0, BATCHES))
+        self.assertEqual(self.unsent(), self.folders)
+
+    def test_bad_arguments_and_configuration(self):
+        with mock.patch('sys.stderr', io.StringIO()):
+            self.assertEqual(archive_cli.main(['--archive-dir', self.directory, '--max-messages', '-1']),
+                             archive_cli.EXIT_USAGE)
+        with mock.patch.object(send_archived_photos_smtp, 'load_smtp_config', return_value=None):
+            self.assertEqual(self.run_cli()[0], archive_cli.EXIT_USAGE)
+        self.assertEqual(len(self.sink.messages), 0)
+
+    def test_unexpected_error(self):
+        with mock.patch.object(send_archived_photos_smtp, 'iter_archived_batches',
+                               side_effect=PermissionError("archive is read-only")):
+            code, summary = self.run_cli()
+        self.assertEqual(code, archive_cli.EXIT_ERROR)
+        self.assertIn("read-only", summary['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
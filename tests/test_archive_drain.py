@@ -0,0 +1,91 @@
+"""
+Tests for draining the archive from the apps: the delivery ledger kept by
+the outbox retrier and when the latency budget lets a drain send start.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from archive_drain import LatencyBudget, ledger_send
+from archive_manifest import DELIVERED, FAILED, IN_FLIGHT, ArchiveManifest, batch_message_id
+
+
+class LedgerSendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_archive_')
+        self.manifest = ArchiveManifest(self.directory)
+        self.folder = 'unsent_guest_20240101_120000'
+        os.makedirs(os.path.join(self.directory, self.folder))
+        self.zip_path = os.path.join(self.directory, self.folder, 'photos.zip')
+        with open(self.zip_path, 'wb') as f:
+            f.write(b'zip')
+        self.manifest.add(self.folder, "guest@example.com", 'photos.zip', 3, 'SMTP')
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def send(self, recipient, zip_path, message_id):
+        # The batch is in flight while it is being sent
+        self.assertEqual(self.entry()['status'], IN_FLIGHT)
+        self.sent.append((recipient, zip_path, message_id))
+
+    def entry(self):
+        return ArchiveManifest(self.directory).entries()[self.folder]
+
+    def test_records_delivery(self):
+        ledger_send(self.send)("guest@example.com", self.zip_path)
+        self.assertEqual(self.sent, [("guest@example.com", self.zip_path, batch_message_id([self.folder]))])
+        self.assertEqual(self.entry()['status'], DELIVERED)
+
+    def test_does_not_resend_delivered(self):
+        self.manifest.mark_delivered([self.folder])
+        ledger_send(self.send)("guest@example.com", self.zip_path)
+        self.assertEqual(self.sent, [])
+
+    def test_resend_keeps_message_id(self):
+        # An archive script run stopped while this batch was in flight with another one
+        self.manifest.mark_in_flight([self.folder], '<group@photo-booth.local>')
+        ledger_send(self.send)("guest@example.com", self.zip_path)
+        self.assertEqual(self.sent[0][2], '<group@photo-booth.local>')
+
+    def test_records_failure(self):
+        def fail(recipient, zip_path, message_id):
+            raise OSError("connection refused")
+
+        with self.assertRaises(OSError):
+            ledger_send(fail)("guest@example.com", self.zip_path)
+        self.assertEqual(self.entry()['status'], FAILED)
+        self.assertEqual(self.entry()['last_error'], "connection refused")
+
+
+class LatencyBudgetTest(unittest.TestCase):
+    def test_drains_right_after_startup(self):
+        # Nothing measured yet, but no guest has been served either
+        self.assertTrue(LatencyBudget(30, quiet_period=120).may_send(10 * 1024 * 1024))
+
+    def test_waits_for_quiet_after_live_send(self):
+        budget = LatencyBudget(30, quiet_period=120)
+        budget.live_finished(20, 1024 * 1024)  # About 50 KB/s
+        self.assertTrue(budget.may_send(100 * 1024))
+        self.assertFalse(budget.may_send(10 * 1024 * 1024))
+        budget.last_live -= 120
+        self.assertTrue(budget.may_send(10 * 1024 * 1024))
+
+    def test_budget_applies_before_first_live_send(self):
+        # Drain sends since startup measured the throughput: a batch too big for the budget waits
+        budget = LatencyBudget(30, quiet_period=120)
+        budget.drain_finished(20, 1024 * 1024)  # About 50 KB/s
+        self.assertTrue(budget.may_send(100 * 1024))
+        self.assertFalse(budget.may_send(10 * 1024 * 1024))
+        budget.started -= 120
+        self.assertTrue(budget.may_send(10 * 1024 * 1024))
+
+    def test_live_sends_go_first(self):
+        self.assertFalse(LatencyBudget(30, live_pending=lambda: True).may_send(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
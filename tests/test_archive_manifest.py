@@ -0,0 +1,127 @@
+"""
+Tests for the archive manifest: folders it doesn't know about and
+recovering from damaged files without losing delivery states.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from archive_manifest import DELIVERED, IN_FLIGHT, MANIFEST_FILE, MESSAGE_ID_DOMAIN, UNSENT, ArchiveManifest
+from archive_manifest import batch_message_id, message_id_for
+
+
+class ArchiveManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_archive_')
+        self.manifest = ArchiveManifest(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def archive(self, folder, email="guest@example.com", index=True):
+        path = os.path.join(self.directory, folder)
+        os.makedirs(path)
+        with open(os.path.join(path, 'photos.zip'), 'wb') as f:
+            f.write(b'zip')
+        with open(os.path.join(path, 'SEND_TO.txt'), 'w') as f:
+            f.write(f"RECIPIENT EMAIL: {email}\nZIP FILE: photos.zip\nNUMBER OF PHOTOS: 3\nMETHOD: SMTP\n")
+        if index:
+            self.manifest.add(folder, email, 'photos.zip', 3, 'SMTP')
+
+    def statuses(self, manifest=None):
+        return {folder: entry['status'] for folder, entry in (manifest or self.manifest).entries().items()}
+
+    def test_reindex_picks_up_unindexed_folders(self):
+        self.archive('unsent_a_1')
+        self.manifest.mark_delivered(['unsent_a_1'])
+        # The app could not write to the manifest when it archived this one
+        self.archive('unsent_b_2', email="other@example.com", index=False)
+
+        self.assertEqual(self.statuses(), {'unsent_a_1': DELIVERED})
+        self.assertEqual(self.manifest.reindex(), 1)
+        self.assertEqual(self.statuses(), {'unsent_a_1': DELIVERED, 'unsent_b_2': UNSENT})
+        entry = ArchiveManifest(self.directory).entries()['unsent_b_2']
+        self.assertEqual((entry['email'], entry['zip_file'], entry['photo_count']),
+                         ("other@example.com", 'photos.zip', 3))
+        # Recorded, so it isn't added again
+        self.assertEqual(self.manifest.reindex(), 0)
+        with open(os.path.join(self.directory, MANIFEST_FILE)) as f:
+            self.assertEqual(sum('unsent_b_2' in line for line in f), 1)
+
+    def test_read_does_not_list_folders(self):
+        for i in range(3):
+            self.archive(f'unsent_guest_{i}')
+        self.manifest.mark_in_flight(['unsent_guest_0'], '<id@photo-booth.local>')
+        with mock.patch('archive_manifest.os.scandir', wraps=os.scandir) as scandir:
+            for _ in range(5):
+                self.manifest.entries()
+            self.manifest.unsent()
+        self.assertEqual(scandir.call_count, 0)
+
+        # Only a missing manifest is rebuilt from the folders
+        os.remove(os.path.join(self.directory, MANIFEST_FILE))
+        with mock.patch('archive_manifest.os.scandir', wraps=os.scandir) as scandir:
+            self.assertEqual(len(self.manifest.entries()), 3)
+            self.manifest.entries()
+        self.assertEqual(scandir.call_count, 1)
+
+    def test_torn_last_line_keeps_states(self):
+        self.archive('unsent_a_1')
+        self.archive('unsent_b_2')
+        self.manifest.mark_delivered(['unsent_a_1'])
+        self.manifest.mark_in_flight(['unsent_b_2'], '<id@photo-booth.local>')
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        size = os.path.getsize(path)
+        with open(path, 'a') as f:
+            f.write('{"folder": "unsent_b_2", "sta')  # Crash in the middle of a write
+
+        self.assertEqual(self.statuses(), {'unsent_a_1': DELIVERED, 'unsent_b_2': IN_FLIGHT})
+        self.assertEqual(self.manifest.entries()['unsent_b_2']['message_id'], '<id@photo-booth.local>')
+        self.assertEqual(os.path.getsize(path), size)
+        # Appends after the cut start on a line of their own
+        self.manifest.mark_delivered(['unsent_b_2'])
+        self.assertEqual(self.statuses(ArchiveManifest(self.directory)),
+                         {'unsent_a_1': DELIVERED, 'unsent_b_2': DELIVERED})
+
+    def test_corrupt_line_keeps_states(self):
+        self.archive('unsent_a_1')
+        self.archive('unsent_b_2')
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path, 'a') as f:
+            f.write('not json\n')
+        self.manifest.mark_delivered(['unsent_a_1'])
+
+        self.assertEqual(self.statuses(), {'unsent_a_1': DELIVERED, 'unsent_b_2': UNSENT})
+        with open(path) as f:
+            self.assertNotIn('not json', f.read())
+        self.assertEqual(self.manifest.entries()['unsent_a_1']['email'], "guest@example.com")
+
+    def test_append_after_torn_line(self):
+        self.archive('unsent_a_1')
+        with open(os.path.join(self.directory, MANIFEST_FILE), 'a') as f:
+            f.write('{"folder": "unsent_a_1", "sta')
+        self.manifest.mark_delivered(['unsent_a_1'])
+        self.assertEqual(self.statuses(), {'unsent_a_1': DELIVERED})
+
+
+    def test_resend_keeps_in_flight_message_id(self):
+        for folder in ('unsent_a_1', 'unsent_a_2', 'unsent_a_3'):
+            self.archive(folder)
+        group = ['unsent_a_1', 'unsent_a_2']
+        self.manifest.mark_in_flight(group, batch_message_id(group))
+        entries = self.manifest.entries()
+
+        # Interrupted run: the group is sent again with the ID it had
+        self.assertEqual(message_id_for([entries[folder] for folder in group]), batch_message_id(group))
+        # The first run sent a_1 as part of this group, so the same ID is kept on its own too
+        self.assertEqual(message_id_for([entries['unsent_a_1']]), batch_message_id(group))
+        # Not all in flight with the same ID: a fresh one for exactly these batches
+        everything = [entries[folder] for folder in sorted(entries)]
+        self.assertEqual(message_id_for(everything), batch_message_id(sorted(entries)))
+        self.assertTrue(batch_message_id(group).endswith(f'@{MESSAGE_ID_DOMAIN}>'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Circuit breaker state changes (closed -> open -> half-open -> closed), the
+probe loop while it is open, and which errors count as the server being
+down.
+"""
+
+import errno
+import smtplib
+import socket
+import threading
+import time
+import unittest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from smtp_pool import is_connection_error
+
+PROBE_INTERVAL = 0.05
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def refused():
+    raise ConnectionRefusedError(errno.ECONNREFUSED, "Connection refused")
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.server_up = threading.Event()
+        self.probes = 0
+        self.changes = []
+        self.breaker = CircuitBreaker(self.probe, is_connection_error, failure_threshold=2,
+                                      probe_interval=PROBE_INTERVAL,
+                                      on_change=lambda state, error: self.changes.append(state))
+
+    def tearDown(self):
+        self.breaker.stop()
+
+    def probe(self):
+        self.probes += 1
+        if not self.server_up.is_set():
+            refused()
+
+    def open_breaker(self):
+        for _ in range(2):
+            with self.assertRaises(ConnectionRefusedError):
+                self.breaker.call(refused)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_opens_after_threshold(self):
+        with self.assertRaises(ConnectionRefusedError):
+            self.breaker.call(refused)
+        self.assertEqual(self.breaker.state, CLOSED)
+        with self.assertRaises(ConnectionRefusedError):
+            self.breaker.call(refused)
+        self.assertEqual(self.breaker.state, OPEN)
+
+        # Open: fails at once, without calling the send
+        calls = []
+        with self.assertRaises(CircuitOpen) as raised:
+            self.breaker.call(calls.append, 1)
+        self.assertEqual(calls, [])
+        self.assertGreater(raised.exception.retry_at, time.time() - 1)
+
+    def test_probes_until_server_answers_then_closes(self):
+        self.open_breaker()
+        # The probe keeps failing every probe_interval while the server is down
+        wait_for(lambda: self.probes >= 3)
+        self.assertEqual(self.breaker.state, OPEN)
+
+        self.server_up.set()
+        wait_for(lambda: self.breaker.state == HALF_OPEN)
+        # The trial send goes through and closes the breaker
+        self.assertEqual(self.breaker.call(lambda: 'sent'), 'sent')
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.changes, [OPEN, HALF_OPEN, CLOSED])
+
+    def test_only_one_trial_while_half_open(self):
+        self.open_breaker()
+        self.server_up.set()
+        wait_for(lambda: self.breaker.state == HALF_OPEN)
+        self.breaker.stop()  # No more probes, so the state only changes through call()
+
+        in_trial = threading.Event()
+        release = threading.Event()
+
+        def slow_send():
+            in_trial.set()
+            release.wait(5)
+
+        trial = threading.Thread(target=self.breaker.call, args=(slow_send,))
+        trial.start()
+        in_trial.wait(5)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.call(lambda: None)
+        release.set()
+        trial.join()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_trial_opens_again(self):
+        self.open_breaker()
+        self.server_up.set()
+        wait_for(lambda: self.breaker.state == HALF_OPEN)
+        self.server_up.clear()
+        with self.assertRaises(ConnectionRefusedError):
+            self.breaker.call(refused)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.changes, [OPEN, HALF_OPEN, OPEN])
+
+    def test_local_errors_dont_count(self):
+        # Building the message failed, the server was never contacted
+        def missing_photo():
+            open('/nonexistent/photo.jpg', 'rb')
+
+        for _ in range(5):
+            with self.assertRaises(FileNotFoundError):
+                self.breaker.call(missing_photo)
+        self.assertEqual((self.breaker.state, self.breaker.failures), (CLOSED, 0))
+
+
+class ConnectionErrorTest(unittest.TestCase):
+    def test_network_errors(self):
+        for e in (ConnectionRefusedError(), ConnectionResetError(), socket.timeout(), TimeoutError(),
+                  socket.gaierror(socket.EAI_NONAME, "Name or service not known"),
+                  OSError(errno.ENETUNREACH, "Network is unreachable"),
+                  smtplib.SMTPServerDisconnected("Connection unexpectedly closed"),
+                  smtplib.SMTPConnectError(421, b"Service not available")):
+            self.assertTrue(is_connection_error(e), repr(e))
+
+    def test_other_errors(self):
+        for e in (FileNotFoundError(errno.ENOENT, "No such file"), PermissionError(errno.EACCES, "Permission denied"),
+                  OSError("disk full"), smtplib.SMTPRecipientsRefused({}),
+                  smtplib.SMTPDataError(552, b"Message too large"), ValueError("bad address")):
+            self.assertFalse(is_connection_error(e), repr(e))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+"""
+GmailSender against a local HTTP stand-in for the Gmail API: simple and
+resumable media uploads, resuming after a failed chunk, and backing off on
+rate limits and server errors.
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+import gmail_sender
+from gmail_sender import GmailSender
+from mime_stream import StreamingMessage
+
+CHUNK = 256 * 1024  # Smallest chunk size resumable uploads allow
+
+
+class GmailStandIn:
+    """Accepts users.messages.send media uploads on 127.0.0.1:port until close()
+
+    failures is a list of (method, status, reason) answered instead of the
+    next request with that method ('POST' starts an upload, 'PUT' sends a
+    chunk), e.g. ('PUT', 503, None). A status of None lets that request
+    through.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = []
+        self.messages = []  # Complete uploaded messages
+        self.received = 0  # Bytes of media received, counting resent chunks
+        self.errors = []  # Statuses of the failures answered
+        self.sessions = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self.server.daemon_threads = True
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def take_failure(self, method):
+        with self.lock:
+            for i, failure in enumerate(self.failures):
+                if failure[0] == method:
+                    del self.failures[i]
+                    if failure[1] is None:
+                        return None
+                    self.errors.append(failure[1])
+                    return failure
+        return None
+
+
+def _handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body=None, headers=()):
+            data = json.dumps(body).encode() if body is not None else b''
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def fail(self, failure):
+            _, status, reason = failure
+            error = {'code': status, 'message': 'stand-in error', 'errors': [{'reason': reason or 'backendError'}]}
+            self.reply(status, {'error': error}, [('Retry-After', '0')] if status == 429 else ())
+
+        def do_POST(self):
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            failure = standin.take_failure('POST')
+            if failure:
+                return self.fail(failure)
+            with standin.lock:
+                if 'uploadType=resumable' in self.path:
+                    session = len(standin.sessions) + 1
+                    standin.sessions[session] = bytearray()
+                    location = f"http://{self.headers['Host']}/upload/session/{session}"
+                    return self.reply(200, {}, [('Location', location)])
+                standin.received += len(data)
+                standin.messages.append(bytes(data))
+                message_id = str(len(standin.messages))
+            self.reply(200, {'id': message_id})
+
+        def do_PUT(self):
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            failure = standin.take_failure('PUT')
+            if failure:
+                return self.fail(failure)  # The chunk is lost
+            upload = standin.sessions[int(self.path.rsplit('/', 1)[1])]
+            match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', self.headers.get('Content-Range', ''))
+            with standin.lock:
+                if match:
+                    upload[int(match.group(1)):] = data
+                    standin.received += len(data)
+                    if match.group(2) != '*' and len(upload) == int(match.group(2)):
+                        standin.messages.append(bytes(upload))
+                        return self.reply(200, {'id': str(len(standin.messages))})
+                # A chunk that is not the last one, or a status query after an error
+                headers = [('Range', f'bytes=0-{len(upload) - 1}')] if upload else []
+            self.reply(308, None, headers)
+    return Handler
+
+
+class GmailSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_gmail_')
+        self.standin = GmailStandIn()
+        self.sender = GmailSender(Credentials(token='test-token'), api_endpoint=self.standin.endpoint,
+                                  resumable_threshold=2 * CHUNK)
+        # Small chunks and quick backoff, so the test doesn't upload or wait for long
+        patches = [mock.patch.object(gmail_sender, 'UPLOAD_CHUNK_SIZE', CHUNK),
+                   mock.patch.dict(gmail_sender.BACKOFF, {key: (0.01, 0.05) for key in gmail_sender.BACKOFF})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.sender.service().close()
+        self.standin.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def message(self, size):
+        path = os.path.join(self.directory, f'photos_{size}.zip')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        return StreamingMessage(None, 'guest@example.com', 'Your Photo Booth Pictures!',
+                                'Thank you for using our photo booth!', [path])
+
+    def assertDelivered(self, message):
+        self.assertEqual(len(self.standin.messages), 1)
+        self.assertEqual(self.standin.messages[0], b''.join(message.iter_chunks()))
+
+    def test_small_message_single_request(self):
+        message = self.message(100 * 1024)
+        self.assertEqual(self.sender.send(message), {'id': '1'})
+        self.assertDelivered(message)
+        self.assertEqual(self.standin.sessions, {})
+
+    def test_resumes_after_failed_chunk(self):
+        message = self.message(5 * CHUNK)
+        # The second chunk gets lost behind a server error
+        self.standin.failures = [('PUT', None, None), ('PUT', 503, None)]
+        self.sender.send(message)
+
+        self.assertDelivered(message)
+        self.assertEqual(self.standin.errors, [503])
+        self.assertEqual(self.sender.retries, 1)
+        self.assertEqual(len(self.standin.sessions), 1)  # Resumed, not started over
+        self.assertLess(self.standin.received, message.size() + 2 * CHUNK)
+
+    def test_backs_off_on_rate_limits_and_server_errors(self):
+        message = self.message(100 * 1024)
+        self.standin.failures = [('POST', 429, 'rateLimitExceeded'),
+                                 ('POST', 403, 'userRateLimitExceeded'),
+                                 ('POST', 500, None)]
+        self.sender.send(message)
+
+        self.assertDelivered(message)
+        self.assertEqual(self.standin.errors, [429, 403, 500])
+        self.assertEqual(self.sender.retries, 3)
+
+    def test_daily_limit_is_not_retried(self):
+        self.standin.failures = [('POST', 403, 'dailyLimitExceeded')]
+        with self.assertRaises(HttpError) as raised:
+            self.sender.send(self.message(100 * 1024))
+        self.assertEqual(raised.exception.resp.status, 403)
+        self.assertEqual(self.sender.retries, 0)
+        self.assertEqual(self.standin.messages, [])
+
+    def test_gives_up_after_max_retries(self):
+        self.sender.max_retries = 2
+        self.standin.failures = [('POST', 503, None)] * 3
+        with self.assertRaises(HttpError):
+            self.sender.send(self.message(100 * 1024))
+        self.assertEqual(self.sender.retries, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Stress test for photo ingestion: hundreds of JPEGs dropped into the watch
+directory in a burst must all be renamed, in capture order, with no gaps or
+duplicate numbers.
+
+Runs the real watchdog observer, PhotoEventHandler, IngestPool and
+PhotoBoothApp.handle_new_photo; only the Tk parts of the app are left out.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+
+from watchdog.observers import Observer
+
+import photo_booth_smtp
+from photo_ingest import FileReadyDetector, IngestPool
+
+PHOTOS = 300
+RECIPIENT = 'guest@example.com'
+
+
+def fake_jpeg(index):
+    """Smallest file the ingest path accepts as a complete JPEG, tagged with its capture index"""
+    return b'\xff\xd8' + f'capture {index:05d}'.encode() + b'\x00' * 2000 + b'\xff\xd9'
+
+
+class _UI:
+    def __init__(self):
+        self.errors = []
+
+    def post(self, kind, **fields):
+        if kind == photo_booth_smtp.ERROR:
+            self.errors.append(fields.get('text'))
+
+    def notify(self, title, message):
+        self.errors.append(f"{title}: {message}")
+
+    def call(self, fn, *args):
+        pass
+
+
+class _Thumbnails:
+    def request(self, photo_path, callback):
+        pass
+
+
+def make_app(watch_directory, zip_directory):
+    """A PhotoBoothApp without a window, set up the way the UI would leave it"""
+    app = photo_booth_smtp.PhotoBoothApp.__new__(photo_booth_smtp.PhotoBoothApp)
+    app.watch_directory = watch_directory
+    app.zip_output_directory = zip_directory
+    app.archive_directory = zip_directory
+    app.current_email = RECIPIENT
+    app.smtp_email = 'booth@example.com'
+    app.smtp_password = 'secret'
+    app.photo_files = []
+    app.file_counter = 0
+    app.session_archive = None
+    app.renditions = None
+    app.max_message_size = photo_booth_smtp.MAX_MESSAGE_SIZE
+    app.preview_session = 0
+    app.session_lock = threading.RLock()
+    app.ui = _UI()
+    app.thumbnails = _Thumbnails()
+    app.reset_timer = lambda: None  # Sessions are never sent in this test
+    app.file_ready = FileReadyDetector(timeout=10.0)
+    app.ingest = IngestPool(app.prepare_new_photo, app.handle_new_photo, workers=4, max_queued=50,
+                            block_when_full=True)
+    return app
+
+
+class IngestStressTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_ingest_')
+        self.watch = os.path.join(self.directory, 'watch')
+        self.zips = os.path.join(self.directory, 'zips')
+        os.makedirs(self.watch)
+        os.makedirs(self.zips)
+        self.app = make_app(self.watch, self.zips)
+        self.observer = Observer()
+        self.observer.schedule(photo_booth_smtp.PhotoEventHandler(self.app), self.watch, recursive=False)
+        self.observer.start()
+
+    def tearDown(self):
+        self.observer.stop()
+        self.observer.join()
+        self.app.ingest.stop()
+        if self.app.session_archive:
+            self.app.session_archive.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def wait_for(self, count, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.app.session_lock:
+                if len(self.app.photo_files) >= count:
+                    return
+            time.sleep(0.05)
+
+    def test_burst_keeps_every_photo_in_order(self):
+        # Written the way a camera does it: create, write, close - as fast as possible
+        for index in range(PHOTOS):
+            with open(os.path.join(self.watch, f'IMG_{index:05d}.jpg'), 'wb') as f:
+                f.write(fake_jpeg(index))
+        self.wait_for(PHOTOS)
+        time.sleep(0.5)  # Anything extra (duplicates) would show up by now
+
+        self.assertEqual(self.app.ui.errors, [])
+        self.assertEqual(self.app.ingest.dropped, 0)
+        self.assertEqual(self.app.file_counter, PHOTOS)
+        expected = [os.path.join(self.watch, f'guest_{n}.jpg') for n in range(1, PHOTOS + 1)]
+        self.assertEqual(self.app.photo_files, expected)
+
+        # guest_N.jpg is the N-th photo taken, and no original was left behind
+        for number, path in enumerate(expected):
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), fake_jpeg(number))
+        self.assertEqual(sorted(os.listdir(self.watch)), sorted(os.path.basename(p) for p in expected))
+
+        # Every photo also made it into the session zip as it arrived
+        self.app.session_archive.close()
+        with zipfile.ZipFile(self.app.session_archive.zip_path) as z:
+            self.assertEqual(z.namelist(), [os.path.basename(p) for p in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
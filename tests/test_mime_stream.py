@@ -0,0 +1,109 @@
+"""
+Streaming MIME messages: the encoded output is a valid email with the
+attachment intact, and peak memory while producing it (measured with
+tracemalloc) stays the same whether the attachment is 2 MB or 40 MB.
+"""
+
+import email
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from email import policy
+
+from mime_stream import StreamingMessage, smtp_data_chunks
+
+SMALL = 2 * 1024 * 1024
+LARGE = 40 * 1024 * 1024
+# Python allocations while streaming may not exceed this, whatever the attachment size
+PEAK_LIMIT = 1024 * 1024
+UPLOAD_CHUNK = 256 * 1024  # Read size for the HTTP upload path, which holds a few copies of a chunk
+UPLOAD_PEAK_LIMIT = 8 * UPLOAD_CHUNK
+
+
+def write_random_file(path, size):
+    with open(path, 'wb') as f:
+        for _ in range(size // (1024 * 1024)):
+            f.write(os.urandom(1024 * 1024))
+        f.write(os.urandom(size % (1024 * 1024)))
+
+
+def peak_while(fn):
+    """Peak traced memory (bytes) allocated while fn() runs"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+class StreamingMessageTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix='photo_booth_mime_')
+        cls.small = os.path.join(cls.directory, 'small.zip')
+        cls.large = os.path.join(cls.directory, 'large.zip')
+        write_random_file(cls.small, SMALL + 123)  # Not a multiple of the base64 line length
+        write_random_file(cls.large, LARGE)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def message(self, path, message_id=None):
+        return StreamingMessage('booth@example.com', 'guest@example.com', 'Your photos', 'Thanks!',
+                                [path], message_id=message_id)
+
+    def test_round_trip(self):
+        message = self.message(self.small, message_id='<abc@photo-booth.local>')
+        data = b''.join(message.iter_chunks())
+        self.assertEqual(len(data), message.size())
+
+        parsed = email.message_from_bytes(data, policy=policy.default)
+        self.assertEqual(parsed['To'], 'guest@example.com')
+        self.assertEqual(parsed['Message-ID'], '<abc@photo-booth.local>')
+        attachments = list(parsed.iter_attachments())
+        self.assertEqual([a.get_filename() for a in attachments], ['small.zip'])
+        with open(self.small, 'rb') as f:
+            self.assertEqual(attachments[0].get_content(), f.read())
+
+        # The upload path reads the same bytes, in any chunk size and from any offset
+        reader = message.reader()
+        self.assertEqual(b''.join(iter(lambda: reader.read(100_003), b'')), data)
+        reader.seek(len(data) // 2)
+        self.assertEqual(reader.read(5000), data[len(data) // 2:len(data) // 2 + 5000])
+
+    def test_smtp_data_is_dot_stuffed_and_terminated(self):
+        message = StreamingMessage('a@example.com', 'b@example.com', 'Hi', '.starts with a dot\n.\nend')
+        data = b''.join(smtp_data_chunks(message))
+        self.assertIn(b'\r\n..starts with a dot\r\n..\r\nend', data)
+        self.assertTrue(data.endswith(b'\r\n.\r\n'))
+
+    def assert_bounded(self, consume, limit):
+        peaks = {}
+        for path in (self.small, self.large):
+            peaks[path] = peak_while(lambda: consume(self.message(path)))
+        self.assertLess(peaks[self.large], limit, peaks)
+        # 20x the attachment, about the same peak
+        self.assertLess(peaks[self.large], peaks[self.small] + 256 * 1024, peaks)
+
+    def test_smtp_path_memory_is_bounded(self):
+        def consume(message):
+            for chunk in smtp_data_chunks(message):
+                pass
+        self.assert_bounded(consume, PEAK_LIMIT)
+
+    def test_upload_path_memory_is_bounded(self):
+        def consume(message):
+            reader = message.reader()
+            while reader.read(UPLOAD_CHUNK):
+                pass
+        self.assert_bounded(consume, UPLOAD_PEAK_LIMIT)
+
+
+if __name__ == '__main__':
+    unittest.main()
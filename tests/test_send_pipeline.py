@@ -0,0 +1,188 @@
+"""
+Wall-time and bookkeeping tests for the background send pipeline, with
+stages that sleep instead of zipping and sending.
+"""
+
+import threading
+import time
+import unittest
+
+from send_pipeline import FAILED, MERGED, QUEUED, SENT, SessionPipeline, Stage, snapshot_session
+
+STAGE_SECONDS = 0.2
+SESSIONS = 5
+
+
+def sleeping_stage(seconds):
+    def fn(session, value, report):
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+class SessionPipelineTest(unittest.TestCase):
+    def test_stages_overlap(self):
+        # package -> send -> cleanup: back-to-back sessions should take about
+        # one session's time plus one slowest stage per extra session, not
+        # the sum of every stage for every session.
+        pipeline = SessionPipeline([
+            Stage('package', sleeping_stage(STAGE_SECONDS)),
+            Stage('send', sleeping_stage(STAGE_SECONDS)),
+            Stage('cleanup', sleeping_stage(STAGE_SECONDS)),
+        ])
+        started = time.monotonic()
+        for i in range(SESSIONS):
+            pipeline.submit(snapshot_session(f"guest{i}@example.com", [f"photo{i}.jpg"]))
+        pipeline.stop()
+        elapsed = time.monotonic() - started
+
+        serial = SESSIONS * 3 * STAGE_SECONDS
+        pipelined = (SESSIONS + 2) * STAGE_SECONDS
+        self.assertLess(elapsed, (serial + pipelined) / 2)
+        self.assertGreaterEqual(elapsed, pipelined - 0.05)
+        metrics = pipeline.metrics()
+        self.assertEqual([m['done'] for m in metrics.values()], [SESSIONS] * 3)
+        self.assertEqual(pipeline.pending(), 0)
+
+    def test_pending_without_final_states(self):
+        # The stages never report a finished state, the pipeline counts them done anyway
+        release = threading.Event()
+
+        def blocked(session, value, report):
+            release.wait(5)
+
+        pipeline = SessionPipeline([Stage('package', sleeping_stage(0)), Stage('send', blocked, 2)])
+        sessions = [snapshot_session(f"guest{i}@example.com", []) for i in range(10)]
+        for session in sessions:
+            pipeline.submit(session)
+        self.assertEqual(pipeline.pending(), 10)
+        release.set()
+        pipeline.stop()
+        self.assertEqual(pipeline.pending(), 0)
+        self.assertEqual({pipeline.progress[s.session_id] for s in sessions}, {QUEUED})
+
+    def test_failed_stage_stops_session(self):
+        reached = []
+
+        def package(session, value, report):
+            if session.session_id % 2:
+                raise ValueError("zip failed")
+
+        def send(session, value, report):
+            reached.append(session.session_id)
+            report(session, SENT)
+
+        errors = []
+        pipeline = SessionPipeline([Stage('package', package), Stage('send', send)],
+                                   on_error=lambda session, e: errors.append(session.session_id))
+        sessions = [snapshot_session(f"guest{i}@example.com", []) for i in range(4)]
+        for session in sessions:
+            pipeline.submit(session)
+        pipeline.stop()
+
+        odd = [s.session_id for s in sessions if s.session_id % 2]
+        self.assertEqual(sorted(errors), odd)
+        self.assertEqual(sorted(reached), [s.session_id for s in sessions if not s.session_id % 2])
+        for session in sessions:
+            self.assertEqual(pipeline.progress[session.session_id], FAILED if session.session_id % 2 else SENT)
+        self.assertEqual(pipeline.pending(), 0)
+
+    def test_merges_sessions_still_queued(self):
+        # No coalescing window: only a session that has not been picked up yet takes in a later one
+        started = threading.Event()
+        release = threading.Event()
+        packaged = []
+
+        def package(session, value, report):
+            packaged.append(session)
+            started.set()
+            release.wait(5)
+
+        pipeline = SessionPipeline([Stage('package', package)])
+        busy = snapshot_session("first@example.com", ["a.jpg"])
+        pipeline.submit(busy)
+        started.wait(5)
+        queued = snapshot_session("guest@example.com", ["b.jpg"])
+        returning = snapshot_session(" Guest@Example.com", ["c.jpg"])
+        again = snapshot_session("first@example.com", ["d.jpg"])
+        for session in (queued, returning, again):
+            pipeline.submit(session)
+        self.assertEqual(pipeline.progress[returning.session_id], MERGED)
+        self.assertEqual(pipeline.progress[again.session_id], QUEUED)
+        release.set()
+        pipeline.stop()
+
+        self.assertEqual([(s.session_id, s.photo_files) for s in packaged], [
+            (busy.session_id, ("a.jpg",)),
+            (queued.session_id, ("b.jpg", "c.jpg")),
+            (again.session_id, ("d.jpg",)),
+        ])
+        self.assertEqual(pipeline.pending(), 0)
+
+    def test_merges_sessions_waiting_to_be_sent(self):
+        # The earlier session was packaged and waits behind a busy send worker: it is packaged
+        # again with the later session's photos and sent once
+        sending = threading.Event()
+        release = threading.Event()
+        packaged = []
+        sent = []
+
+        def package(session, value, report):
+            packaged.append((session.photo_files, value))
+            return session.photo_files
+
+        def send(session, value, report):
+            sending.set()
+            release.wait(5)
+            sent.append((session.session_id, value))
+            report(session, SENT)
+
+        pipeline = SessionPipeline([Stage('package', package), Stage('send', send),
+                                    Stage('cleanup', sleeping_stage(0))], merge_until='send')
+        busy = snapshot_session("first@example.com", ["a.jpg"])
+        pipeline.submit(busy)
+        sending.wait(5)
+        waiting = snapshot_session("guest@example.com", ["b.jpg"])
+        pipeline.submit(waiting)
+        deadline = time.monotonic() + 5
+        while pipeline.metrics()['send']['queued'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        returning = snapshot_session("guest@example.com", ["c.jpg"])
+        pipeline.submit(returning)
+        self.assertEqual(pipeline.progress[returning.session_id], MERGED)
+        release.set()
+        pipeline.stop()
+
+        self.assertEqual(packaged, [
+            (("a.jpg",), None),
+            (("b.jpg",), None),
+            (("b.jpg", "c.jpg"), ("b.jpg",)),  # Gets what it returned the first time
+        ])
+        self.assertEqual(sent, [(busy.session_id, ("a.jpg",)), (waiting.session_id, ("b.jpg", "c.jpg"))])
+        self.assertEqual(pipeline.progress[waiting.session_id], SENT)
+        self.assertEqual(pipeline.pending(), 0)
+
+    def test_sessions_being_sent_are_not_merged(self):
+        sending = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        def send(session, value, report):
+            sending.set()
+            release.wait(5)
+            sent.append(session.photo_files)
+
+        pipeline = SessionPipeline([Stage('package', sleeping_stage(0)), Stage('send', send)], merge_until='send')
+        pipeline.submit(snapshot_session("guest@example.com", ["a.jpg"]))
+        sending.wait(5)
+        later = snapshot_session("guest@example.com", ["b.jpg"])
+        pipeline.submit(later)
+        release.set()
+        pipeline.stop()
+
+        self.assertEqual(sent, [("a.jpg",), ("b.jpg",)])
+        self.assertEqual(pipeline.progress[later.session_id], QUEUED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Simulated-clock tests for the daily quota tracker, the token bucket and the
+sender account router: no test waits for real time to pass.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from send_quota import DAY, QuotaExceeded, QuotaTracker, SendLimiter, TokenBucket
+from sender_accounts import AccountRouter, SenderAccount
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class QuotaTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_quota_')
+        self.path = os.path.join(self.directory, 'quota.json')
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_rolling_window(self):
+        quota = QuotaTracker(self.path, 3, clock=self.clock)
+        start = self.clock.now
+        for _ in range(3):
+            quota.record()
+            self.clock.sleep(60)
+        self.assertEqual(quota.remaining(), 0)
+        # The first send ages out exactly one day after it was made
+        self.assertEqual(quota.next_available_at(), start + DAY)
+        self.clock.now = start + DAY - 1
+        self.assertEqual(quota.remaining(), 0)
+        self.clock.now = start + DAY
+        self.assertEqual(quota.remaining(), 1)
+        self.clock.now = start + DAY + 120
+        self.assertEqual(quota.remaining(), 3)
+
+    def test_survives_restart(self):
+        QuotaTracker(self.path, 5, clock=self.clock).record()
+        self.clock.sleep(3600)
+        restarted = QuotaTracker(self.path, 5, clock=self.clock)
+        self.assertEqual(restarted.used(), 1)
+        self.clock.sleep(DAY)
+        self.assertEqual(restarted.used(), 0)
+
+    def test_corrupt_file_starts_empty(self):
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(QuotaTracker(self.path, 5, clock=self.clock).used(), 0)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        clock = Clock()
+        bucket = TokenBucket(6, burst=2, clock=clock)  # One token every 10 seconds
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertAlmostEqual(bucket.try_acquire(), 10.0)
+        clock.sleep(4)
+        self.assertAlmostEqual(bucket.try_acquire(), 6.0)
+        clock.sleep(6)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        # Idle time never builds up more than the burst
+        clock.sleep(3600)
+        for _ in range(2):
+            self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertGreater(bucket.try_acquire(), 0.0)
+
+
+class SendLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def limiter(self, daily_limit, rate_per_minute=60, burst=1, max_wait=10.0):
+        return SendLimiter(QuotaTracker(None, daily_limit, clock=self.clock),
+                           TokenBucket(rate_per_minute, burst=burst, clock=self.clock),
+                           max_wait=max_wait, sleep=self.clock.sleep)
+
+    def test_defers_before_the_daily_limit(self):
+        limiter = self.limiter(2)
+        start = self.clock.now
+        for _ in range(2):
+            limiter.acquire()
+            limiter.record()
+        with self.assertRaises(QuotaExceeded) as raised:
+            limiter.acquire()
+        self.assertEqual(raised.exception.retry_at, start + DAY)
+
+    def test_waits_out_short_rate_limits(self):
+        limiter = self.limiter(100, rate_per_minute=12)  # One every 5 seconds
+        start = self.clock.now
+        for _ in range(3):
+            limiter.acquire()
+            limiter.record()
+        self.assertAlmostEqual(self.clock.now - start, 10.0)
+
+    def test_defers_long_rate_limits(self):
+        limiter = self.limiter(100, rate_per_minute=2, max_wait=10.0)  # One every 30 seconds
+        limiter.acquire()
+        with self.assertRaises(QuotaExceeded) as raised:
+            limiter.acquire()
+        self.assertAlmostEqual(raised.exception.retry_at, self.clock.now + 30.0)
+
+
+class AccountRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def account(self, name, daily_limit):
+        limiter = SendLimiter(QuotaTracker(None, daily_limit, clock=self.clock))
+        return SenderAccount(name, client=None, limiter=limiter)
+
+    def test_spreads_sends_and_defers_when_all_are_used_up(self):
+        first, second = self.account('first', 2), self.account('second', 1)
+        router = AccountRouter([first, second], is_account_error=lambda e: False)
+        used = [router.send(lambda account: None)[0].name for _ in range(3)]
+        self.assertEqual(sorted(used), ['first', 'first', 'second'])
+        self.assertEqual(router.remaining(), 0)
+        with self.assertRaises(QuotaExceeded) as raised:
+            router.send(lambda account: None)
+        self.assertEqual(raised.exception.retry_at, self.clock.now + DAY)
+
+    def test_account_errors_move_on_to_the_next_account(self):
+        broken, healthy = self.account('broken', 10), self.account('healthy', 5)
+        router = AccountRouter([broken, healthy], is_account_error=lambda e: isinstance(e, PermissionError))
+
+        def send(account):
+            if account is broken:
+                raise PermissionError("login failed")
+            return 'sent'
+
+        account, result = router.send(send)
+        self.assertEqual((account.name, result), ('healthy', 'sent'))
+        self.assertTrue(broken.is_cold())
+        self.assertEqual(broken.limiter.quota.used(), 0)  # Failed sends don't use up quota
+
+    def test_other_errors_are_raised(self):
+        router = AccountRouter([self.account('only', 10)], is_account_error=lambda e: False)
+
+        def send(account):
+            raise ConnectionError("network down")
+
+        with self.assertRaises(ConnectionError):
+            router.send(send)
+
+
+if __name__ == '__main__':
+    unittest.main()
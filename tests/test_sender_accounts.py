@@ -0,0 +1,98 @@
+"""
+Routing across sender accounts against local SMTP sinks, one per account:
+sends are spread over the accounts, throughput grows with the number of
+accounts, and a cold account's messages go to the others.
+"""
+
+import threading
+import time
+import unittest
+from email.message import EmailMessage
+
+from send_quota import QuotaTracker, SendLimiter
+from sender_accounts import AccountRouter, SenderAccount
+from smtp_pool import SMTPConnectionPool, is_account_error
+
+from tests.smtp_sink import SMTPSink
+
+MESSAGES = 24
+WORKERS = 4
+SERVER_DELAY = 0.05  # Seconds each sink takes to accept a message
+
+
+def message(i):
+    msg = EmailMessage()
+    msg['From'] = 'booth@example.com'
+    msg['To'] = f'guest{i}@example.com'
+    msg['Subject'] = 'Your Photo Booth Pictures!'
+    msg.set_content('Thank you for using our photo booth!')
+    return msg
+
+
+class AccountRouterSMTPTest(unittest.TestCase):
+    def setUp(self):
+        self.sinks = []
+
+    def tearDown(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def router(self, count, **sink_options):
+        accounts = []
+        for i in range(count):
+            sink = SMTPSink(delay=SERVER_DELAY, **sink_options)
+            self.sinks.append(sink)
+            # One connection per account, like the apps' default pool
+            pool = SMTPConnectionPool('127.0.0.1', sink.port, f'booth{i}@example.com', 'secret', starttls=False)
+            accounts.append(SenderAccount(f'booth{i}@example.com', pool, SendLimiter(QuotaTracker(None, 500))))
+        return AccountRouter(accounts, is_account_error)
+
+    def send_all(self, router):
+        """Send MESSAGES emails from WORKERS threads - returns the seconds it took"""
+        numbers = iter(range(MESSAGES))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    i = next(numbers, None)
+                if i is None:
+                    return
+                router.send(lambda account: account.client.send_message(message(i)))
+
+        threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        for account in router.accounts:
+            account.client.close()
+        return elapsed
+
+    def test_throughput_scales_with_accounts(self):
+        one = self.send_all(self.router(1))
+        router = self.router(2)
+        two = self.send_all(router)
+
+        self.assertEqual(sum(len(sink.messages) for sink in self.sinks), 2 * MESSAGES)
+        self.assertEqual([account.sent for account in router.accounts], [MESSAGES // 2] * 2)
+        self.assertLess(two, one * 0.75)
+
+    def test_cold_account_fails_over(self):
+        router = self.router(2)
+        # The first account's server says it is out of quota
+        self.sinks[0].mail_reply = '550 5.4.5 Daily user sending limit exceeded'
+        self.send_all(router)
+
+        self.assertEqual(len(self.sinks[0].messages), 0)
+        self.assertEqual(len(self.sinks[1].messages), MESSAGES)
+        cold, healthy = router.accounts
+        self.assertTrue(cold.is_cold())
+        self.assertEqual((cold.sent, healthy.sent), (0, MESSAGES))
+        self.assertIn('5.4.5', cold.last_error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Splitting a long session into zips that each fit in one email, naming and
+labelling the parts, and sending the parts side by side.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+from mime_stream import StreamingMessage, encoded_size
+from send_pipeline import send_all
+from session_zip import MESSAGE_OVERHEAD, SessionArchive, fits_in_message, part_label, part_path
+from smtp_pool import SMTPConnectionPool
+
+from tests.smtp_sink import SMTPSink
+
+PHOTO_BYTES = 300 * 1024
+# Room for three photos per email, after base64
+MAX_MESSAGE_BYTES = encoded_size(3 * PHOTO_BYTES + 4096) + MESSAGE_OVERHEAD
+
+
+class SessionArchiveSplitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_zip_')
+        self.zip_path = os.path.join(self.directory, 'photos_guest_20240101_120000.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def photos(self, count):
+        paths = []
+        for i in range(count):
+            paths.append(os.path.join(self.directory, f'photo_{i}.jpg'))
+            with open(paths[-1], 'wb') as f:
+                f.write(os.urandom(PHOTO_BYTES))  # Doesn't compress, like a JPEG
+        return paths
+
+    def test_splits_into_numbered_parts(self):
+        photos = self.photos(8)
+        archive = SessionArchive(self.zip_path, MAX_MESSAGE_BYTES)
+        for photo in photos[:5]:
+            archive.add(photo)  # The rest is added when the session is finalized
+        parts = archive.finalize(photos)
+
+        self.assertEqual([os.path.basename(part.path) for part in parts], [
+            'photos_guest_20240101_120000_part1of3.zip',
+            'photos_guest_20240101_120000_part2of3.zip',
+            'photos_guest_20240101_120000_part3of3.zip',
+        ])
+        self.assertEqual([part.photo_count for part in parts], [3, 3, 2])
+        self.assertEqual([part_label(part.path) for part in parts],
+                         ['part 1 of 3', 'part 2 of 3', 'part 3 of 3'])
+        self.assertFalse(os.path.exists(self.zip_path))
+        names = []
+        for part in parts:
+            self.assertTrue(fits_in_message(os.path.getsize(part.path), MAX_MESSAGE_BYTES))
+            with zipfile.ZipFile(part.path) as z:
+                self.assertIsNone(z.testzip())
+                names += z.namelist()
+        self.assertEqual(names, [os.path.basename(photo) for photo in photos])
+
+    def test_small_session_is_one_zip(self):
+        photos = self.photos(2)
+        archive = SessionArchive(self.zip_path, MAX_MESSAGE_BYTES)
+        parts = archive.finalize(photos)
+        self.assertEqual([(part.path, part.photo_count) for part in parts], [(self.zip_path, 2)])
+        self.assertIsNone(part_label(self.zip_path))
+
+    def test_finalize_again_rebuilds(self):
+        # A packaged session that a later one was merged into is finalized a second time
+        photos = self.photos(5)
+        archive = SessionArchive(self.zip_path, MAX_MESSAGE_BYTES)
+        archive.finalize(photos[:3])
+        parts = archive.finalize(photos)
+
+        self.assertEqual([part.photo_count for part in parts], [3, 2])
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(
+            [os.path.basename(photo) for photo in photos] + [os.path.basename(part.path) for part in parts]))
+
+    def test_part_paths(self):
+        self.assertEqual(part_path('a/photos_x_1.zip', 2), 'a/photos_x_1_part2.zip')
+        self.assertEqual(part_path('a/photos_x_1.zip', 2, 5), 'a/photos_x_1_part2of5.zip')
+        self.assertIsNone(part_label('photos_x_1_part2.zip'))  # Not finished yet
+
+
+class PartSendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='photo_booth_zip_')
+        self.sink = SMTPSink(delay=0.3)
+
+    def tearDown(self):
+        self.sink.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def send_parts(self, pool_size):
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(self.directory, f'photos_guest_1_part{i + 1}of3.zip'))
+            with open(paths[-1], 'wb') as f:
+                f.write(os.urandom(10 * 1024))
+        pool = SMTPConnectionPool('127.0.0.1', self.sink.port, 'booth@example.com', 'secret',
+                                  size=pool_size, starttls=False)
+
+        def send(path):
+            message = StreamingMessage('booth@example.com', 'guest@example.com',
+                                       f"Your Photo Booth Pictures! ({part_label(path)})", 'Thanks!', [path])
+            pool.send_stream(message, 'booth@example.com', ['guest@example.com'])
+
+        started = time.monotonic()
+        failures = send_all(paths, send, workers=3)
+        elapsed = time.monotonic() - started
+        pool.close()
+        self.assertEqual(failures, {})
+        return elapsed
+
+    def test_parts_are_sent_side_by_side(self):
+        # One connection per part, like the SMTP app's pool
+        self.assertLess(self.send_parts(3), 0.6)
+        self.assertEqual(len(self.sink.messages), 3)
+        self.assertTrue(all(b'part ' in message for message in self.sink.messages))
+        # A single connection sends them one after another
+        self.assertGreaterEqual(self.send_parts(1), 0.85)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Counts SMTP handshakes per 100 sends through the connection pool, against
+a local SMTP sink.
+"""
+
+import time
+import unittest
+from email.message import EmailMessage
+
+from smtp_pool import SMTPConnectionPool
+
+from tests.smtp_sink import SMTPSink
+
+SENDS = 100
+
+
+def message(i):
+    msg = EmailMessage()
+    msg['From'] = 'booth@example.com'
+    msg['To'] = f'guest{i}@example.com'
+    msg['Subject'] = 'Your Photo Booth Pictures!'
+    msg.set_content('Thank you for using our photo booth!')
+    return msg
+
+
+class SMTPConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = SMTPSink()
+
+    def tearDown(self):
+        self.sink.close()
+
+    def pool(self, **kwargs):
+        return SMTPConnectionPool('127.0.0.1', self.sink.port, 'booth@example.com', 'secret',
+                                  starttls=False, **kwargs)
+
+    def test_one_handshake_per_connection(self):
+        pool = self.pool(max_messages_per_connection=50)
+        for i in range(SENDS):
+            pool.send_message(message(i))
+        pool.close()
+
+        self.assertEqual(len(self.sink.messages), SENDS)
+        # A new connection per send would be 100 of each
+        self.assertEqual(pool.handshakes, 2)
+        self.assertEqual(self.sink.connections, 2)
+        self.assertEqual(self.sink.ehlos, 2)
+        self.assertEqual(self.sink.auths, 2)
+
+    def test_reconnects_when_dropped(self):
+        self.sink.drop_after = 30  # The server hangs up after every 30 messages
+        pool = self.pool(max_messages_per_connection=1000)
+        for i in range(SENDS):
+            pool.send_message(message(i))
+        pool.close()
+
+        self.assertEqual(len(self.sink.messages), SENDS)
+        self.assertEqual(pool.handshakes, 4)
+
+    def test_idle_connection_checked_with_noop(self):
+        pool = self.pool(keepalive_interval=0.05)
+        pool.send_message(message(0))
+        time.sleep(0.1)
+        pool.send_message(message(1))
+        pool.close()
+
+        self.assertEqual(self.sink.noops, 1)
+        self.assertEqual(pool.handshakes, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Thread-safe UI update bus for the photo booth apps.
+
+Watchdog, ingest, timer and send threads must not touch Tk widgets directly.
+They post typed events to a UIUpdateBus instead, and the Tk thread drains the
+bus at a fixed cadence. Status updates are coalesced so a burst of captures
+only redraws the status bar once per drain, with the latest message.
+Notifications are shown in non-modal windows so workers never wait on a
+dialog.
+"""
+
+import threading
+import tkinter as tk
+from collections import deque
+
+# Event kinds
+STATUS = 'status'
+CAPTURED = 'captured'
+SENDING = 'sending'
+SENT = 'sent'
+ARCHIVED = 'archived'
+ERROR = 'error'
+NOTIFY = 'notify'
+CALL = 'call'
+
+# Notifications close themselves after this many seconds
+NOTIFICATION_SECONDS = 15
+
+
+class UIUpdateBus:
+    def __init__(self, root, status_label, interval_ms=100):
+        self.root = root
+        self.status_label = status_label
+        self.interval_ms = interval_ms
+        self.last_kind = None
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._notifications = {}
+        self._running = True
+        self.root.after(self.interval_ms, self._drain)
+
+    def _post(self, kind, payload):
+        with self._lock:
+            self._events.append((kind, payload))
+
+    def post(self, kind, text, fg=None):
+        """Queue a status bar update - safe to call from any thread"""
+        self._post(kind, (text, fg))
+
+    def notify(self, title, message):
+        """Show a non-blocking notification window - safe to call from any thread"""
+        self._post(NOTIFY, (title, message))
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the Tk thread, in order with the other events"""
+        self._post(CALL, (fn, args))
+
+    def _drain(self):
+        """Apply queued events (runs on the Tk thread)"""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+
+        latest_status = None
+        for kind, payload in events:
+            try:
+                if kind == NOTIFY:
+                    self._show_notification(*payload)
+                elif kind == CALL:
+                    fn, args = payload
+                    fn(*args)
+                else:
+                    # Only the most recent status update is worth drawing
+                    latest_status = (kind, payload)
+            except Exception as e:
+                print(f"Error applying UI update {kind}: {e}")
+
+        if latest_status:
+            kind, (text, fg) = latest_status
+            self.last_kind = kind
+            if fg:
+                self.status_label.config(text=text, fg=fg)
+            else:
+                self.status_label.config(text=text)
+
+        if self._running:
+            self.root.after(self.interval_ms, self._drain)
+
+    def _show_notification(self, title, message):
+        # Reuse an open window with the same title instead of stacking them up
+        window = self._notifications.get(title)
+        if window is not None and window.winfo_exists():
+            window.message_label.config(text=message)
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        window.transient(self.root)
+        window.message_label = tk.Label(window, text=message, justify=tk.LEFT,
+                                        wraplength=420, padx=15, pady=10)
+        window.message_label.pack()
+        tk.Button(window, text="OK", command=window.destroy).pack(pady=(0, 10))
+        window.after(NOTIFICATION_SECONDS * 1000,
+                     lambda: window.winfo_exists() and window.destroy())
+        self._notifications[title] = window
+
+    def stop(self):
+        """Stop draining events"""
+        self._running = False